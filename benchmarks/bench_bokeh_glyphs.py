@@ -0,0 +1,78 @@
+"""
+Bokeh document size and serialization time of the two Bokeh endpoints.
+
+    python benchmarks/bench_bokeh_glyphs.py [--sizes 100 1000 10000]
+
+For netlists of about each number of nodes, builds the plot the way
+CircuitDiagramAPIView (generate-diagram) and CircuitAPIView (generate) do
+and reports the number of Bokeh models in the document, the time to draw
+it, and the time and size of its ``file_html`` page and ``json_item``.
+Parsing and (for generate) the layered layout run first and are not
+timed.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "pythondiagram.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from bokeh.embed import file_html, json_item  # noqa: E402
+from bokeh.resources import CDN  # noqa: E402
+
+from benchmarks.netlists import csv_bytes, fabric_netlist, master_slave_netlist  # noqa: E402
+from diagramapp.ingest import read_netlist  # noqa: E402
+from diagramapp.bokeh_views import CircuitAPIView, CircuitDiagramAPIView  # noqa: E402
+from diagramapp.views import dumps  # noqa: E402
+
+
+def generate_diagram_plot(n_nodes):
+    # master_slave_netlist has 5 devices per 8 rows
+    data = csv_bytes(master_slave_netlist(n_nodes * 8 // 5))
+    df = read_netlist(data, columns=["From_Device", "To_Device", "Device_Type", "Bus_Label"],
+                      categoricals=["Device_Type", "Bus_Label"], fmt="csv")
+    view = CircuitDiagramAPIView()
+    return len(set(df["From_Device"])), lambda: view.draw(df)
+
+
+def generate_plot(n_nodes):
+    view = CircuitAPIView()
+    G = view.build_graph(csv_bytes(fabric_netlist(n_nodes)), "csv")
+    layout = view.layout(G)
+    return G.number_of_nodes(), lambda: view.plot(G, layout)
+
+
+PLOTS = {'generate-diagram': generate_diagram_plot, 'generate': generate_plot}
+
+
+def timed(func):
+    started = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    args = parser.parse_args()
+
+    print(f"{'endpoint':>16} {'nodes':>6} {'models':>7} {'draw ms':>9} {'html ms':>9} {'html KB':>9} "
+          f"{'json ms':>9} {'json KB':>9}")
+    for endpoint, build in PLOTS.items():
+        for n in args.sizes:
+            nodes, draw = build(n)
+            p, draw_seconds = timed(draw)
+            models = len(p.references())
+            html, html_seconds = timed(lambda: file_html(p, CDN, "Circuit Diagram"))
+            item, json_seconds = timed(lambda: dumps(json_item(p, "circuit-diagram")))
+            print(f"{endpoint:>16} {nodes:>6} {models:>7} {draw_seconds * 1000:>9.1f} {html_seconds * 1000:>9.1f} "
+                  f"{len(html.encode('utf-8')) / 1024:>9.1f} {json_seconds * 1000:>9.1f} {len(item) / 1024:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Rows/sec of DynamicCircuitDiagram.generate_diagram on synthetic netlists.
+
+    python benchmarks/bench_circuit_generator.py [--sizes 100 1000 10000 50000]
+
+Excel parsing is bypassed so only the figure pipeline is measured.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.netlists import dynamic_netlist  # noqa: E402
+from diagramapp.circuit_generator import DynamicCircuitDiagram  # noqa: E402
+
+
+def bench(n_rows, repeat):
+    df = dynamic_netlist(n_rows)
+    generator = DynamicCircuitDiagram()
+    generator.read_excel_data = lambda *args, **kwargs: df.copy()
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        generator.generate_diagram(None)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 50000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'seconds':>10} {'rows/sec':>12}")
+    for n in args.sizes:
+        seconds = bench(n, args.repeat if n <= 10000 else 1)
+        print(f"{n:>8} {seconds:>10.3f} {n / seconds:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
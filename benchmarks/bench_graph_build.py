@@ -0,0 +1,92 @@
+"""
+Graph construction time of CircuitAPIView: the previous row-by-row build
+(two ``iterrows`` passes, one ``add_node``/``add_edge`` per row, a third
+pass for the layers, then the name-order sort keys parsed per node)
+against the column-wise ``_graph``.
+
+    python benchmarks/bench_graph_build.py [--sizes 1000 5000 11600] [--repeat 5]
+
+Sizes are fabric nodes (11600 nodes make about 20000 netlist rows).
+Parsing is not timed; the best of ``--repeat`` builds is reported, and
+both graphs are checked to have the same nodes, edges and layers.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "pythondiagram.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+import networkx as nx  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from benchmarks.netlists import csv_bytes, fabric_netlist  # noqa: E402
+from diagramapp.ingest import read_netlist  # noqa: E402
+from diagramapp.bokeh_views import CircuitAPIView, fabric_layer  # noqa: E402
+
+
+def previous_graph(df):
+    """The graph CircuitAPIView built before, and the name-order keys its layout parsed."""
+    G = nx.DiGraph()
+    for _, row in df.iterrows():
+        G.add_node(row["Node"], type=row["Type"])
+    for _, row in df.iterrows():
+        if pd.notna(row["Connects_To"]):
+            target = row["Connects_To"]
+            if target not in G.nodes:
+                G.add_node(target, type="Unknown")
+            G.add_edge(row["Node"], target)
+    for node in G.nodes:
+        G.nodes[node]["layer"] = fabric_layer(G.nodes[node].get("type", "Unknown"))
+    order = {n: int("".join(filter(str.isdigit, str(n))) or 0) for n in G.nodes}
+    return G, order
+
+
+def best_of(repeat, build, df):
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = build(df)
+        seconds.append(time.perf_counter() - started)
+    return min(seconds), result
+
+
+def bench(n_nodes, repeat):
+    df = read_netlist(csv_bytes(fabric_netlist(n_nodes)), columns=["Node", "Type", "Connects_To"],
+                      categoricals=["Type"], fmt="csv")
+    previous_seconds, (previous, order) = best_of(max(1, repeat // 2), previous_graph, df)
+    seconds, G = best_of(repeat, CircuitAPIView._graph, df)
+    same = (list(G.nodes) == list(previous.nodes) and list(G.edges) == list(previous.edges)
+            and dict(G.nodes.data("layer")) == dict(previous.nodes.data("layer"))
+            and dict(G.nodes.data("order")) == order)
+    return {
+        "rows": len(df),
+        "nodes": G.number_of_nodes(),
+        "edges": G.number_of_edges(),
+        "previous_ms": previous_seconds * 1000,
+        "ms": seconds * 1000,
+        "us_per_row": seconds * 1e6 / len(df),
+        "same": same,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 11600])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'rows':>6} {'nodes':>6} {'edges':>6} {'previous ms':>12} {'graph ms':>9} {'us/row':>7} {'same':>5}")
+    for n in args.sizes:
+        r = bench(n, args.repeat)
+        print(f"{r['rows']:6d} {r['nodes']:6d} {r['edges']:6d} {r['previous_ms']:12.1f} {r['ms']:9.1f} "
+              f"{r['us_per_row']:7.2f} {str(r['same']):>5}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Parse time per upload format for the same synthetic netlist.
+
+    python benchmarks/bench_ingest.py [--rows 10000]
+
+Each format is written once to memory, then read back through
+diagramapp.ingest.read_netlist with the DynamicCircuitDiagram projection.
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "pythondiagram.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from benchmarks.netlists import dynamic_netlist  # noqa: E402
+from diagramapp.circuit_generator import DynamicCircuitDiagram  # noqa: E402
+from diagramapp.ingest import read_netlist  # noqa: E402
+
+
+def encode(df, fmt):
+    buf = io.BytesIO()
+    if fmt == "excel":
+        df.to_excel(buf, index=False)
+    elif fmt == "csv":
+        df.to_csv(buf, index=False)
+    elif fmt == "parquet":
+        df.to_parquet(buf, index=False)
+    elif fmt == "jsonl":
+        df.to_json(buf, orient="records", lines=True)
+    elif fmt == "json":
+        df.to_json(buf, orient="records")
+    return buf.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    # Blank cells as real nulls, the way a generator would emit them
+    df = dynamic_netlist(args.rows)
+    df = df.mask(df.eq(""))
+    print(f"{'format':>8} {'bytes':>10} {'parse ms':>10} {'rows/sec':>12}")
+    for fmt in ("excel", "csv", "parquet", "jsonl", "json"):
+        try:
+            data = encode(df, fmt)
+        except ImportError as e:
+            print(f"{fmt:>8}  skipped ({e})")
+            continue
+        best = float("inf")
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            read_netlist(data, columns=DynamicCircuitDiagram.columns, fmt=fmt, max_rows=args.rows)
+            best = min(best, time.perf_counter() - started)
+        print(f"{fmt:>8} {len(data):>10} {best * 1000:>10.1f} {args.rows / best:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
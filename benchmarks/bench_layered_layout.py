@@ -0,0 +1,91 @@
+"""
+Layout time and edge crossings for CircuitAPIView: the previous
+multipartite + name-order placement against the layered layout.
+
+    python benchmarks/bench_layered_layout.py [--sizes 100 500 1000 5000]
+
+Only the layout is timed; graph construction and Bokeh drawing are not.
+Crossings are counted the same way for both, on the straight edges as drawn.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "pythondiagram.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+import networkx as nx  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from benchmarks.netlists import fabric_netlist  # noqa: E402
+from diagramapp.layered import count_crossings, layered_layout  # noqa: E402
+
+LAYER_MAP = {"Manager": 0, "Initiator": 1, "Switch": 2, "Target": 3, "Subordinate": 4}
+
+
+def build_graph(df):
+    G = nx.DiGraph()
+    for node, node_type in zip(df["Node"], df["Type"]):
+        G.add_node(node, type=node_type, layer=LAYER_MAP.get(node_type, len(LAYER_MAP)))
+    for node, target in zip(df["Node"], df["Connects_To"]):
+        if pd.notna(target):
+            G.add_edge(node, target)
+    return G
+
+
+def name_order(x):
+    return int("".join(filter(str.isdigit, str(x))) or 0)
+
+
+def previous_layout(G):
+    """The multipartite + reorder_nodes placement CircuitAPIView used before."""
+    pos = nx.multipartite_layout(G, subset_key="layer", align="horizontal")
+    for node_type, layer in LAYER_MAP.items():
+        nodes = sorted((n for n in G.nodes if node_type in G.nodes[n].get("type", "")), key=name_order)
+        for i, node in enumerate(nodes):
+            pos[node] = (i * 3.0, layer * 3.0)
+    return pos
+
+
+def bench(n_nodes, method):
+    G = build_graph(fabric_netlist(n_nodes))
+    rank = {n: G.nodes[n]["layer"] for n in G.nodes}
+    edges = list(G.edges)
+
+    started = time.perf_counter()
+    pos = previous_layout(G)
+    previous_seconds = time.perf_counter() - started
+    previous_crossings = count_crossings(pos, rank, edges)
+
+    layout = layered_layout(list(G.nodes), rank, edges, initial_key=name_order, method=method)
+    return {
+        "nodes": G.number_of_nodes(),
+        "edges": G.number_of_edges(),
+        "previous_ms": previous_seconds * 1000,
+        "previous_crossings": previous_crossings,
+        "layered_ms": layout.seconds * 1000,
+        "layered_crossings": layout.crossings,
+        "sweeps": layout.iterations,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 500, 1000, 5000])
+    parser.add_argument("--method", choices=["median", "barycenter"], default="median")
+    args = parser.parse_args()
+
+    print(f"{'nodes':>6} {'edges':>6} {'previous ms':>12} {'crossings':>10} {'layered ms':>11} {'crossings':>10} {'sweeps':>6}")
+    for n in args.sizes:
+        r = bench(n, args.method)
+        print(f"{r['nodes']:6d} {r['edges']:6d} {r['previous_ms']:12.1f} {r['previous_crossings']:10d} "
+              f"{r['layered_ms']:11.1f} {r['layered_crossings']:10d} {r['sweeps']:6d}")
+
+
+if __name__ == "__main__":
+    main()
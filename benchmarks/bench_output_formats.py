@@ -0,0 +1,73 @@
+"""
+Payload size and server CPU per output format of every render endpoint.
+
+    python benchmarks/bench_output_formats.py [--sizes 100 1000] [--repeat 3]
+
+Each netlist goes through the view's own ``render`` (no HTTP, no render
+cache), so the figures are parse + draw + encode. CPU is process time of
+the server process; PNG export on the Kaleido pool runs in worker
+processes and is reported as wall time instead. Sizes are the raw body
+and the body as the compression middleware would send it.
+"""
+import argparse
+import gzip
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "pythondiagram.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from benchmarks.netlists import NETLISTS, csv_bytes  # noqa: E402
+from diagramapp.compression import brotli, get_compression_config  # noqa: E402
+from diagramapp.views import RENDER_VIEWS  # noqa: E402
+
+
+def bench(endpoint, data, out_format, repeat):
+    view = RENDER_VIEWS[endpoint]()
+    best_cpu = best_wall = float("inf")
+    for _ in range(repeat):
+        cpu, wall = time.process_time(), time.perf_counter()
+        body, content_type, headers = view.render(data, "csv", out_format=out_format)
+        best_cpu = min(best_cpu, time.process_time() - cpu)
+        best_wall = min(best_wall, time.perf_counter() - wall)
+    return body, content_type, best_cpu, best_wall
+
+
+def compressed_sizes(body, content_type):
+    config = get_compression_config()
+    if content_type.split(";")[0] not in config['CONTENT_TYPES']:
+        return "-", "-"
+    gz = len(gzip.compress(body, compresslevel=config['GZIP_LEVEL']))
+    br = len(brotli.compress(body, quality=config['BROTLI_QUALITY'])) if brotli is not None else "n/a"
+    return gz, br
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'endpoint':>16} {'rows':>6} {'format':>6} {'cpu ms':>9} {'wall ms':>9} "
+          f"{'bytes':>10} {'gzip':>9} {'br':>9}")
+    for endpoint, view in RENDER_VIEWS.items():
+        for n in args.sizes:
+            data = csv_bytes(NETLISTS[endpoint](n))
+            for out_format in view.formats:
+                try:
+                    body, content_type, cpu, wall = bench(endpoint, data, out_format, args.repeat)
+                except Exception as e:  # e.g. no Chrome for Kaleido, no mmdc
+                    print(f"{endpoint:>16} {n:>6} {out_format:>6}   unavailable: {str(e).splitlines()[0][:60]}")
+                    continue
+                gz, br = compressed_sizes(body, content_type)
+                print(f"{endpoint:>16} {n:>6} {out_format:>6} {cpu * 1000:>9.1f} {wall * 1000:>9.1f} "
+                      f"{len(body):>10} {gz:>9} {br:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Tile pyramid cost for large DynamicCircuitDiagram boards (see diagramapp/tiles.py).
+
+    python benchmarks/bench_tiles.py [--sizes 1000 10000] [--viewport 1920 1080]
+
+For boards of about each number of devices, reports the time to draw the
+scene (parsing excluded) and its pickled size, next to building the
+full-board plotly figure GenerateCircuitDiagramView exports. Then, at the
+coarsest, a middle and the deepest zoom level, renders the tiles a viewer
+of ``--viewport`` pixels shows on the board's top-left corner: milliseconds
+and primitives per tile from the scene, then the same tiles from the tile cache.
+"""
+import argparse
+import math
+import os
+import pickle
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "pythondiagram.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from benchmarks.netlists import csv_bytes, dynamic_netlist  # noqa: E402
+from diagramapp.circuit_generator import DynamicCircuitDiagram  # noqa: E402
+from diagramapp.render_cache import MemoryCacheBackend, RenderCache  # noqa: E402
+from diagramapp.tiles import build_scene, get_tiles_config, render_tile, tile_key  # noqa: E402
+
+
+def viewport_tiles(scene, z, width, height, tile_size):
+    columns, rows = scene.grid(z)
+    return [(x, y) for x in range(min(columns, math.ceil(width / tile_size)))
+            for y in range(min(rows, math.ceil(height / tile_size)))]
+
+
+def bench(n_devices, viewport, config):
+    data = csv_bytes(dynamic_netlist(n_devices))
+    generator = DynamicCircuitDiagram()
+    netlist = generator.parse(data, fmt="csv")
+
+    started = time.perf_counter()
+    scene = build_scene(netlist, generator)
+    scene_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    generator.generate_diagram(data, fmt="csv")
+    figure_seconds = time.perf_counter() - started
+
+    cache = RenderCache(MemoryCacheBackend(max_bytes=256 * 1024 * 1024, max_entries=100_000))
+    max_zoom = scene.max_zoom(config)
+    levels = []
+    for z in sorted({0, max_zoom // 2, max_zoom}):
+        tiles = viewport_tiles(scene, z, *viewport, config['TILE_SIZE'])
+        rendered, items, total_bytes = 0.0, 0, 0
+        for x, y in tiles:
+            started = time.perf_counter()
+            body, count = render_tile(scene, z, x, y, config)
+            rendered += time.perf_counter() - started
+            cache.set(tile_key("bench", z, x, y, config), {'content_type': "image/png"}, body)
+            items += count
+            total_bytes += len(body)
+        started = time.perf_counter()
+        for x, y in tiles:
+            cache.get(tile_key("bench", z, x, y, config))
+        cached = time.perf_counter() - started
+        levels.append({
+            "zoom": z,
+            "tiles": len(tiles),
+            "ms_per_tile": rendered * 1000 / len(tiles),
+            "cached_ms_per_tile": cached * 1000 / len(tiles),
+            "items_per_tile": items / len(tiles),
+            "kb_per_tile": total_bytes / 1024 / len(tiles),
+        })
+    return {
+        "devices": scene.devices,
+        "primitives": sum(scene.counts().values()),
+        "scene_ms": scene_seconds * 1000,
+        "scene_kb": len(pickle.dumps(scene, protocol=pickle.HIGHEST_PROTOCOL)) / 1024,
+        "figure_ms": figure_seconds * 1000,
+        "max_zoom": max_zoom,
+        "levels": levels,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--viewport", type=int, nargs=2, default=[1920, 1080], metavar=("WIDTH", "HEIGHT"))
+    args = parser.parse_args()
+    config = get_tiles_config()
+
+    for n in args.sizes:
+        r = bench(n, args.viewport, config)
+        print(f"{r['devices']} devices, {r['primitives']} primitives: scene {r['scene_ms']:.1f} ms "
+              f"({r['scene_kb']:.0f} KB pickled), full-board figure {r['figure_ms']:.1f} ms, zoom 0-{r['max_zoom']}")
+        print(f"{'zoom':>6} {'tiles':>6} {'ms/tile':>8} {'cached ms':>10} {'items/tile':>11} {'KB/tile':>8}")
+        for level in r["levels"]:
+            print(f"{level['zoom']:6d} {level['tiles']:6d} {level['ms_per_tile']:8.1f} "
+                  f"{level['cached_ms_per_tile']:10.3f} {level['items_per_tile']:11.0f} {level['kb_per_tile']:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Cost of the per-stage timing middleware (diagramapp/timing.py).
+
+    python benchmarks/bench_timing_overhead.py [--rows 200] [--requests 200]
+
+Posts the same netlist to /api/circuit (built-in SVG renderer, the
+cheapest endpoint) through Django's test client with DIAGRAM_TIMING
+enabled and disabled, with the render cache on (every request a HIT: the
+worst case for relative overhead) and off (every request a full render).
+Log output is discarded, but the log lines are still formatted: the
+recorder thread's work is drained inside the timed loop so it is counted.
+Runs alternate between off and on, and the best of --rounds is kept.
+
+End-to-end differences of a few percent are within this noise, so the
+instrumentation is also timed on its own: the middleware around a view
+that enters as many stages as a cached /api/circuit request does.
+"""
+import argparse
+import io
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "pythondiagram.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.http import HttpResponse  # noqa: E402
+from django.test import Client, RequestFactory  # noqa: E402
+
+from benchmarks.netlists import fabric_netlist  # noqa: E402
+from diagramapp import render_cache, timing  # noqa: E402
+
+
+def run(body, requests, timing_enabled, cache):
+    settings.DIAGRAM_TIMING = {**settings.DIAGRAM_TIMING, 'ENABLED': timing_enabled}
+    settings.DIAGRAM_RENDER_CACHE = {**settings.DIAGRAM_RENDER_CACHE, 'BACKEND': 'memory' if cache else None}
+    render_cache._render_cache = None
+    client = Client()   # loads the middleware again with the settings above
+    post = lambda: client.post("/api/circuit", body, content_type="application/json")  # noqa: E731
+    post()
+    timing._record_pending()
+    started = time.perf_counter()
+    for _ in range(requests):
+        post()
+    timing._record_pending()   # the log lines and histograms of these requests
+    return (time.perf_counter() - started) / requests
+
+
+def instrumentation_cost(stages, requests=20000):
+    """
+    Seconds per request the timing middleware and ``stages`` stage() calls
+    add: on the request path, and deferred to the recorder thread.
+    """
+    request = RequestFactory().post("/api/circuit")
+    request.resolver_match = Client().post("/api/circuit", {}, content_type="application/json").resolver_match
+    timing._record_pending()
+    response = HttpResponse(b"")
+
+    def view(request):
+        for name in stages:
+            with timing.stage(name):
+                pass
+        return response
+
+    middleware = timing.timing_middleware(view)
+    path = deferred = float("inf")
+    for _ in range(3):
+        started = time.perf_counter()
+        for _ in range(requests):
+            view(request)
+        bare = time.perf_counter() - started
+        started = time.perf_counter()
+        for _ in range(requests):
+            middleware(request)
+        path = min(path, (time.perf_counter() - started - bare) / requests)
+        started = time.perf_counter()
+        timing._record_pending()
+        deferred = min(deferred, (time.perf_counter() - started) / requests)
+    return path, deferred
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    settings.ALLOWED_HOSTS = ["testserver"]
+    logging.getLogger("diagramapp.timing").handlers = [logging.StreamHandler(io.StringIO())]
+    # Drain the recorder queue only where the benchmark says so
+    settings.DIAGRAM_TIMING = {'ENABLED': True, 'FLUSH_SECONDS': 3600}
+    # upload + two render-cache lookups, as on a cache hit
+    path, deferred = instrumentation_cost(("upload", "cache", "cache"))
+
+    df = fabric_netlist(args.rows).astype(object).where(lambda d: d.notna(), "")
+    body = {"rows": df.to_dict(orient="records"), "format": "svg"}
+
+    print(f"{'cache':>6} {'off ms':>9} {'on ms':>9} {'overhead':>9}")
+    for cache in (True, False):
+        requests = args.requests if cache else max(args.requests // 10, 10)
+        off = on = float("inf")
+        for _ in range(args.rounds):
+            off = min(off, run(body, requests, False, cache))
+            on = min(on, run(body, requests, True, cache))
+        print(f"{'hit' if cache else 'miss':>6} {off * 1000:>9.3f} {on * 1000:>9.3f} {(on - off) / off:>9.2%}")
+        if cache:
+            hit = off
+
+    print(f"instrumentation alone, per request: {path * 1e6:.1f} us on the request path ({path / hit:.2%} "
+          f"of a cache hit), {deferred * 1e6:.1f} us deferred ({deferred / hit:.2%}; log line + histograms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Throughput of the same endpoint served over WSGI and over ASGI.
+
+    python benchmarks/load_wsgi_vs_asgi.py [--clients 50] [--duration 20] [--endpoint generate]
+
+Starts each server in turn on a free local port, then drives it with
+``--clients`` concurrent clients posting a small JSON netlist (unique per
+request so the render cache never answers). WSGI requests hit
+``/api/<endpoint>``; ASGI requests hit the async variant at
+``/api/async/<endpoint>``. The WSGI server is gunicorn when installed,
+otherwise Django's threaded runserver.
+"""
+import argparse
+import http.client
+import json
+import os
+import shlex
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def default_wsgi_command(port, threads):
+    if shutil.which("gunicorn"):
+        return (f"gunicorn pythondiagram.wsgi:application --workers 1 --threads {threads} "
+                f"--bind 127.0.0.1:{port}")
+    return f"{shlex.quote(sys.executable)} manage.py runserver --noreload 127.0.0.1:{port}"
+
+
+def default_asgi_command(port):
+    return f"uvicorn pythondiagram.asgi:application --workers 1 --port {port} --log-level warning"
+
+
+def netlist(endpoint, n):
+    """A small netlist for ``endpoint``; ``n`` makes every body unique."""
+    if endpoint == "generate-diagram":
+        return [
+            {"From_Device": "CPU", "To_Device": f"MEM{n}", "Device_Type": "Master", "Bus_Label": "AXI"},
+            {"From_Device": f"MEM{n}", "To_Device": "", "Device_Type": "Slave", "Bus_Label": ""},
+            {"From_Device": "DMA", "To_Device": f"MEM{n}", "Device_Type": "Master", "Bus_Label": "AHB"},
+        ]
+    rows = [{"Node": "Manager1", "Type": "Manager", "Connects_To": "Switch1"}]
+    rows += [{"Node": f"Initiator{i}", "Type": "Initiator", "Connects_To": "Switch1"} for i in range(8)]
+    rows += [{"Node": "Switch1", "Type": "Switch", "Connects_To": f"Target{i}"} for i in range(8)]
+    rows += [{"Node": f"Target{i}", "Type": "Target", "Connects_To": f"Subordinate{n}"} for i in range(8)]
+    return rows
+
+
+def wait_ready(port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+
+def drive(port, path, endpoint, clients, duration):
+    latencies, errors = [], []
+    lock = threading.Lock()
+    counter = iter(range(10 ** 9))
+    stop_at = time.perf_counter() + duration
+
+    def client():
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=300)
+        while time.perf_counter() < stop_at:
+            with lock:
+                n = next(counter)
+            body = json.dumps(netlist(endpoint, n))
+            started = time.perf_counter()
+            try:
+                conn.request("POST", path, body=body, headers={"Content-Type": "application/json"})
+                response = conn.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=300)
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                (latencies if ok else errors).append(elapsed)
+        conn.close()
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": len(latencies) / wall,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else None,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else None,
+    }
+
+
+def run(name, command, port, path, args):
+    proc = subprocess.Popen(shlex.split(command), cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(port)
+        # One warm-up request so process pools and imports are not timed
+        drive(port, path, args.endpoint, 1, 0.1)
+        result = drive(port, path, args.endpoint, args.clients, args.duration)
+    finally:
+        proc.terminate()
+        proc.wait(10)
+    result.update(server=name, command=command, path=path)
+    print(f"{name:5s} {result['requests']:7d} ok {result['errors']:5d} err {result['rps']:9.1f} req/s "
+          f"p50 {result['p50_ms'] or 0:8.1f} ms  p95 {result['p95_ms'] or 0:8.1f} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per server")
+    parser.add_argument("--endpoint", default="generate", choices=["generate", "generate-diagram"])
+    parser.add_argument("--wsgi-threads", type=int, default=8)
+    parser.add_argument("--wsgi-cmd", help="WSGI server command; {port} is substituted")
+    parser.add_argument("--asgi-cmd", help="ASGI server command; {port} is substituted")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    port = free_port()
+    wsgi = args.wsgi_cmd.format(port=port) if args.wsgi_cmd else default_wsgi_command(port, args.wsgi_threads)
+    results.append(run("wsgi", wsgi, port, f"/api/{args.endpoint}", args))
+
+    port = free_port()
+    asgi = args.asgi_cmd.format(port=port) if args.asgi_cmd else default_asgi_command(port)
+    results.append(run("asgi", asgi, port, f"/api/async/{args.endpoint}", args))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"clients": args.clients, "duration": args.duration, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
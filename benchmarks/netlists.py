@@ -0,0 +1,138 @@
+"""
+Synthetic netlists for the benchmark scripts in this directory and
+``manage.py bench``, one generator per endpoint schema (:data:`NETLISTS`).
+Every generator is deterministic for a given size and seed.
+"""
+import io
+import random
+
+import pandas as pd
+
+
+I2C_BUSES = "SDA,SCL"
+SPI_BUSES = "SCLK,MOSI,MISO"
+UART_BUSES = "TX,RX"
+
+
+def dynamic_netlist(n_rows, seed=0):
+    """
+    Rows in the DynamicCircuitDiagram schema (already cleaned the way
+    ``read_excel_data`` cleans them). Every tenth row is a microcontroller
+    driving the next nine peripherals over I2C, SPI or UART.
+    """
+    rnd = random.Random(seed)
+    rows = []
+    mcu = None
+    for i in range(n_rows):
+        col, line = divmod(i, 10)
+        x, y = col * 400, line * 120
+        if line == 0:
+            mcu = f"MCU{col}"
+            rows.append({
+                "From_Device": mcu, "To_Device": "", "Device_Type": "Microcontroller",
+                "X": x, "Y": y, "Address": "", "Bus_Label": I2C_BUSES, "Status": "",
+                "Pin_Offset": "", "Pin_Side": "right", "Bus_Extend": 300,
+                "Connect_To_Bus": "", "Connect_To_Bus_Type": "", "Bus_X_Offset": "", "Bus_Y_Offset": "",
+                "Arrow_X": "", "Arrow_Y": "", "Direction": "", "Arrow_Color": "",
+            })
+            continue
+        kind = rnd.choice(("I2C_Device", "SPI_Device", "UART_Device"))
+        dev = f"{kind.split('_')[0]}{i}"
+        row = {
+            "From_Device": dev, "To_Device": "", "Device_Type": kind,
+            "X": x + 200, "Y": y, "Address": "", "Bus_Label": "", "Status": "",
+            "Pin_Offset": "", "Pin_Side": "", "Bus_Extend": "",
+            "Connect_To_Bus": "", "Connect_To_Bus_Type": "", "Bus_X_Offset": "", "Bus_Y_Offset": "",
+            "Arrow_X": "", "Arrow_Y": "", "Direction": "", "Arrow_Color": "",
+        }
+        if kind == "I2C_Device":
+            row.update(Address=f"0x{0x20 + line:02X}", Connect_To_Bus=I2C_BUSES,
+                       Connect_To_Bus_Type="solid,dashed", Bus_X_Offset="-5,5")
+        else:
+            # device -> MCU point-to-point buses
+            row.update(To_Device=mcu, Status="active", Pin_Side="left",
+                       Bus_Label=SPI_BUSES if kind == "SPI_Device" else UART_BUSES)
+        if rnd.random() < 0.05:
+            row.update(Arrow_X=x + 150, Arrow_Y=y + 30, Direction=rnd.choice(("up", "down", "left", "right")),
+                       Arrow_Color=rnd.choice(("", "red")))
+        rows.append(row)
+    return pd.DataFrame(rows).replace("-", "").fillna("")
+
+
+def master_slave_netlist(n_rows, seed=0):
+    """
+    Rows in the CircuitDiagramAPIView schema (From_Device, To_Device,
+    Device_Type, Bus_Label): boards of one master and its slaves, every
+    slave wired to its master over I2C, SPI or UART. Half the rows are
+    master -> slave connections, half the slaves' own rows.
+    """
+    rnd = random.Random(seed)
+    rows = []
+    master = None
+    for i in range(max(n_rows // 2, 1)):
+        board, slot = divmod(i, 4)
+        if slot == 0:
+            master = f"MCU{board}"
+        slave = f"Dev{i}"
+        rows.append({"From_Device": master, "To_Device": slave, "Device_Type": "Master",
+                     "Bus_Label": rnd.choice(("I2C", "SPI", "UART"))})
+        rows.append({"From_Device": slave, "To_Device": "", "Device_Type": "Slave", "Bus_Label": ""})
+    return pd.DataFrame(rows[:max(n_rows, 2)])
+
+
+FABRIC_SHARES = (("Manager", 0.05), ("Initiator", 0.30), ("Switch", 0.05), ("Target", 0.30), ("Subordinate", 0.30))
+
+
+def fabric_netlist(n_nodes, seed=0):
+    """
+    Rows in the CircuitAPIView schema (Node, Type, Connects_To) for an
+    interconnect of about ``n_nodes`` nodes: managers feed initiators,
+    initiators feed switches, switches feed targets, targets feed
+    subordinates, and one initiator in ten also reaches a target directly.
+    Names are numbered in random order so the name sort is not already a
+    good layout.
+    """
+    rnd = random.Random(seed)
+    tiers = []
+    for node_type, share in FABRIC_SHARES:
+        count = max(int(n_nodes * share), 1)
+        numbers = list(range(count))
+        rnd.shuffle(numbers)
+        tiers.append((node_type, [f"{node_type}{i}" for i in numbers]))
+
+    rows = []
+    for level, (node_type, names) in enumerate(tiers):
+        below = tiers[level + 1][1] if level + 1 < len(tiers) else []
+        for i, name in enumerate(names):
+            if not below:
+                rows.append({"Node": name, "Type": node_type, "Connects_To": None})
+                continue
+            # Mostly local wiring with some long-range links, like a real fabric
+            j = min(int(i * len(below) / len(names)) + rnd.randint(-2, 2), len(below) - 1)
+            targets = {below[max(j, 0)], rnd.choice(below)}
+            if node_type == "Initiator" and rnd.random() < 0.1:
+                targets.add(rnd.choice(tiers[3][1]))
+            rows.extend({"Node": name, "Type": node_type, "Connects_To": t} for t in targets)
+    return pd.DataFrame(rows)
+
+
+# Generator of each render endpoint's schema (Mermaid reads the fabric's Node/Connects_To)
+NETLISTS = {
+    'diagram': dynamic_netlist,
+    'generate-diagram': master_slave_netlist,
+    'generate': fabric_netlist,
+    'circuit': fabric_netlist,
+}
+
+
+def workbook_bytes(df):
+    """``df`` as the .xlsx a user would upload."""
+    buf = io.BytesIO()
+    df.to_excel(buf, index=False, engine="openpyxl")
+    return buf.getvalue()
+
+
+def csv_bytes(df):
+    buf = io.BytesIO()
+    df.to_csv(buf, index=False)
+    return buf.getvalue()
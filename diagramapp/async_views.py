@@ -0,0 +1,238 @@
+"""
+Async variants of the diagram endpoints for ASGI servers (uvicorn, daphne).
+
+Request handling stays on the event loop; parsing and rendering run in the
+bounded render process pool (``render_pool.py``), PNG export awaits the warm
+Kaleido pool and Mermaid runs through ``asyncio.create_subprocess_exec``, so
+one server process keeps many slow renders in flight. Responses, cache keys
+and error bodies match the synchronous views.
+"""
+import asyncio
+import os
+import tempfile
+
+from django.http import HttpResponse, JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from .circuit_generator import FIGURE_FORMATS, TRACE_MODES
+from .disk_io import record_disk_write
+from .export_pool import export_figure_async
+from .ingest import IngestError, netlist_payload, _json_body
+from .jobs import job_links, submit_if_large
+from .metrics import annotate, measured, observe_input
+from .mermaid_pool import MermaidPoolBusy, render_pooled
+from .render_cache import get_render_cache
+from .render_pool import run_in_pool
+from .serializer import validate_upload
+from .timing import stage
+from .figure_views import GenerateCircuitDiagramView
+from .mermaid_views import MermaidCircuitAPIView
+from .views import BOKEH_FORMATS, MERMAID_FORMAT_ERROR, MERMAID_FORMATS, MERMAID_THEME, RENDER_VIEWS, flag
+
+
+# --- process pool entry points (module-level so they pickle) ---
+
+def render_netlist(endpoint, data, fmt, params):
+    return RENDER_VIEWS[endpoint]().render(data, fmt, **params)
+
+
+def build_figure(data, fmt, trace_mode, figure_bytes=False):
+    view = GenerateCircuitDiagramView()
+    fig = view.build_figure(data, fmt, trace_mode=trace_mode)
+    fig_json = view.figure_json(fig) if figure_bytes else None
+    return fig.to_dict(), view.figure_headers(fig, fig_json, attachment=True)
+
+
+def mermaid_source(data, fmt):
+    return MermaidCircuitAPIView().mermaid_source(data, fmt)
+
+
+async def in_pool(func, *args):
+    """``func(*args)`` on the render pool, reporting the input sizes it saw for this request."""
+    result, sizes = await run_in_pool(measured, func, *args)
+    observe_input(**sizes)
+    return result
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncRenderView(View):
+    """Shared request flow: payload, cache lookup, offload, render, store."""
+    endpoint = None
+    http_method_names = ['post']
+
+    async def post(self, request, *args, **kwargs):
+        try:
+            # Multipart parsing reads the spooled upload; keep it off the loop
+            invalid = await asyncio.to_thread(self.validate, request)
+            if invalid is not None:
+                return invalid
+            data, fmt = await asyncio.to_thread(netlist_payload, request)
+        except IngestError as e:
+            return self.error(str(e), 400)
+        if data is None:
+            return self.error("Please upload an Excel file.", 400)
+
+        try:
+            params = self.params(request)
+        except ValueError as e:
+            return self.error(str(e), 400)
+        annotate(self.endpoint, params['out_format'])
+
+        render_cache = get_render_cache()
+        cache_key = RENDER_VIEWS[self.endpoint]().cache_key(data, fmt, **params)
+        cached = render_cache.lookup(request, cache_key)
+        if cached is not None:
+            return cached
+
+        job = await asyncio.to_thread(submit_if_large, self.endpoint, data, fmt, params, cache_key)
+        if job is not None:
+            links = job_links(request, job)
+            response = JsonResponse(links, status=202)
+            response['Location'] = links['status_url']
+            return response
+
+        try:
+            body, content_type, headers = await self.render(data, fmt, params)
+        except IngestError as e:
+            return self.error(str(e), 400)
+        except MermaidPoolBusy as e:
+            return self.error(str(e), 503)
+        except Exception as e:
+            return self.error(str(e), 500)
+        return render_cache.store(cache_key, body, content_type, headers, stream=self.stream(params))
+
+    def validate(self, request):
+        """A 400 response when the request fails the checks of the sync view, else None."""
+        return None
+
+    def params(self, request):
+        return {}
+
+    def stream(self, params):
+        return False
+
+    def output_format(self, request, formats):
+        out_format = str(self.field(request, "format", None) or formats[0]).lower()
+        if out_format not in formats:
+            raise ValueError(f"format must be one of {list(formats)}")
+        return out_format
+
+    async def render(self, data, fmt, params):
+        with stage("render_pool"):
+            return await in_pool(render_netlist, self.endpoint, data, fmt, params)
+
+    def error(self, message, status):
+        return HttpResponse(message, status=status)
+
+    @staticmethod
+    def field(request, name, default):
+        if request.content_type == "application/json":
+            body = _json_body(request)
+            return body.get(name, default) if isinstance(body, dict) else default
+        return request.POST.get(name, default)
+
+
+class AsyncGenerateCircuitDiagramView(AsyncRenderView):
+    endpoint = GenerateCircuitDiagramView.endpoint
+
+    def validate(self, request):
+        if request.content_type == "application/json":
+            body = _json_body(request)
+        else:
+            body = {**request.POST.dict(), **request.FILES.dict()}
+        serializer = validate_upload(body)
+        if serializer.errors:
+            return JsonResponse({'error': 'Invalid file', 'details': serializer.errors}, status=400)
+        return None
+
+    def params(self, request):
+        trace_mode = self.field(request, "trace_mode", "segments")
+        if trace_mode not in TRACE_MODES:
+            raise ValueError(f"trace_mode must be one of {list(TRACE_MODES)}")
+        return {'trace_mode': trace_mode, 'out_format': self.output_format(request, FIGURE_FORMATS),
+                'figure_bytes': flag(self.field(request, "figure_bytes", False), "figure_bytes")}
+
+    def stream(self, params):
+        return params['out_format'] == "png"
+
+    async def render(self, data, fmt, params):
+        if params['out_format'] == "json":
+            # Nothing to export: the figure JSON is built in the render pool
+            return await super().render(data, fmt, params)
+        with stage("render_pool"):
+            fig_dict, headers = await in_pool(build_figure, data, fmt, params['trace_mode'], params['figure_bytes'])
+        image = await export_figure_async(fig_dict, format="png", width=1000, height=800)
+        return image, "image/png", headers
+
+    def error(self, message, status):
+        error = 'Invalid file' if status == 400 else 'Processing failed'
+        return JsonResponse({'error': error, 'message': message}, status=status)
+
+
+class AsyncCircuitDiagramAPIView(AsyncRenderView):
+    endpoint = 'generate-diagram'
+
+    def params(self, request):
+        return {'out_format': self.output_format(request, BOKEH_FORMATS)}
+
+
+class AsyncCircuitAPIView(AsyncRenderView):
+    endpoint = 'generate'
+
+    def params(self, request):
+        return {'out_format': self.output_format(request, BOKEH_FORMATS)}
+
+
+class AsyncMermaidCircuitAPIView(AsyncRenderView):
+    endpoint = MermaidCircuitAPIView.endpoint
+
+    def params(self, request):
+        out_format = str(self.field(request, "format", "png")).lower()
+        if out_format not in MERMAID_FORMATS:
+            raise ValueError(MERMAID_FORMAT_ERROR)
+        return {'out_format': out_format}
+
+    async def render(self, data, fmt, params):
+        out_format = params['out_format']
+        if MermaidCircuitAPIView.engine(out_format) == "builtin":
+            # No external renderer: the whole render is in-process CPU work
+            return await super().render(data, fmt, params)
+
+        with stage("render_pool"):
+            mmd_text = await in_pool(mermaid_source, data, fmt)
+        # The warm pool blocks on its pipes, so it runs on a thread; mmdc
+        # (the fallback) is awaited as a subprocess
+        with stage("mermaid"):
+            rendered = await asyncio.to_thread(render_pooled, mmd_text, out_format, MERMAID_THEME)
+            image_data, content_type = rendered or await self.render_mmdc(mmd_text, out_format)
+        return image_data, content_type, {}
+
+    async def render_mmdc(self, mmd_text, out_format):
+        with tempfile.TemporaryDirectory() as td:
+            in_path = os.path.join(td, "diagram.mmd")
+            out_path = os.path.join(td, f"diagram.{out_format}")
+            with open(in_path, "w", encoding="utf-8") as f:
+                f.write(mmd_text)
+
+            proc = await asyncio.create_subprocess_exec(
+                *MermaidCircuitAPIView._mmdc_command(in_path, out_path),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            stdout, stderr = await proc.communicate()
+            if proc.returncode != 0:
+                MermaidCircuitAPIView._render_failed(td, mmd_text, proc.returncode,
+                                                     stdout.decode(errors="replace"),
+                                                     stderr.decode(errors="replace"))
+
+            with open(out_path, "rb") as f:
+                blob = f.read()
+            record_disk_write(len(mmd_text.encode("utf-8")) + len(blob))
+
+        content_type = "image/png" if out_format == "png" else "image/jpeg"
+        return blob, content_type
+
+    def error(self, message, status):
+        return JsonResponse({"error": message}, status=status)
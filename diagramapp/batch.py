@@ -0,0 +1,377 @@
+"""
+Many renders in one request: every sheet of a workbook (``/api/batch``)
+or many uploaded netlists (``/api/bulk``).
+
+Inputs are read one at a time and handed to the render process pool as
+soon as they are read, so reading overlaps rendering; at most
+``MAX_IN_FLIGHT`` renders are queued, which bounds the inputs and results
+held in memory. Identical inputs (same render-cache key, i.e. the same
+content hash and parameters) are rendered once. Finished outputs are
+written to the response archive (ZIP or multipart/mixed) in completion
+order, failed inputs as ``<name>.error.txt`` entries, and
+``manifest.json`` closes the archive with per-input timings. Inputs
+already in the render cache are not rendered again, and new renders are
+stored there like single renders.
+"""
+import io
+import json
+import os
+import re
+import time
+import uuid
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, TimeoutError as FuturesTimeout, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from django.conf import settings
+
+from .ingest import FORMATS, IngestError
+from .render_pool import _reset_executor, get_render_executor, get_render_pool_config, submit
+
+
+DEFAULT_BATCH_CONFIG = {
+    'MAX_SHEETS': 64,
+    'MAX_FILES': 5000,            # netlists per /api/bulk request
+    'MAX_FILE_BYTES': 10 * 1024 * 1024,  # per netlist, checked before a ZIP member is inflated
+    'MAX_IN_FLIGHT': None,        # queued renders; None: twice the render pool size
+    'TIMEOUT': 300.0,             # seconds for a whole batch; renders still running are reported as failed
+}
+
+ARCHIVES = ("zip", "multipart")
+
+EXTENSIONS = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/svg+xml": "svg",
+    "application/json": "json",
+    "text/html": "html",
+    "text/plain": "mmd",
+}
+
+
+def get_batch_config():
+    return {**DEFAULT_BATCH_CONFIG, **getattr(settings, 'DIAGRAM_BATCH', {})}
+
+
+def render_input(endpoint, data, fmt, params):
+    """Render one input; runs in the render pool. Failures are returned, not raised."""
+    from .views import RENDER_VIEWS
+
+    started_at, started, cpu = time.time(), time.perf_counter(), time.process_time()
+    result = {'started_at': started_at, 'worker': os.getpid(), 'error': None}
+    try:
+        result['body'], result['content_type'], result['headers'] = \
+            RENDER_VIEWS[endpoint]().render(data, fmt, **params)
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['render_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    result['cpu_ms'] = round((time.process_time() - cpu) * 1000, 1)
+    return result
+
+
+class _Sink:
+    """Write-only, unseekable file for ZipFile; hands out what was written since the last drain."""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ZipArchive:
+    content_type = "application/zip"
+
+    def __init__(self):
+        self._sink = _Sink()
+        # Unseekable output: members get data descriptors, nothing is rewritten
+        self._zip = zipfile.ZipFile(self._sink, mode="w")
+
+    def add(self, name, body, content_type):
+        # Images are already compressed
+        compress = zipfile.ZIP_STORED if content_type.startswith("image/") and "svg" not in content_type \
+            else zipfile.ZIP_DEFLATED
+        self._zip.writestr(zipfile.ZipInfo(name, date_time=time.localtime()[:6]), body, compress_type=compress)
+        return self._sink.drain()
+
+    def close(self):
+        self._zip.close()
+        return self._sink.drain()
+
+
+class MultipartArchive:
+    def __init__(self):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/mixed; boundary={self.boundary}"
+
+    def add(self, name, body, content_type):
+        head = (f"--{self.boundary}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f'Content-Disposition: attachment; filename="{name}"\r\n'
+                f"Content-Length: {len(body)}\r\n\r\n")
+        return head.encode("utf-8") + body + b"\r\n"
+
+    def close(self):
+        return f"--{self.boundary}--\r\n".encode("utf-8")
+
+
+class RenderBatch:
+    """
+    A stream of inputs rendered through one endpoint. Subclasses yield
+    ``(name, read)`` from :meth:`inputs`, where ``read()`` returns
+    ``(data, fmt, rows)`` or raises IngestError; iterate :meth:`stream`
+    for the archive bytes.
+    """
+
+    def __init__(self, endpoint, params, archive, render_cache=None):
+        from .views import RENDER_VIEWS
+
+        self.endpoint = endpoint
+        self.params = params
+        self.archive = archive
+        self.render_cache = render_cache
+        self.view = RENDER_VIEWS[endpoint]()
+        self.entries = []
+        self._names = set()
+
+    def inputs(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def stream(self):
+        chunks = self._chunks()
+        try:
+            for chunk in chunks:
+                if chunk:
+                    yield chunk
+        finally:
+            chunks.close()
+
+    def _chunks(self):
+        config = get_batch_config()
+        limit = config['MAX_IN_FLIGHT'] or 2 * get_render_pool_config()['PROCESSES']
+        started = time.perf_counter()
+        self._executor = get_render_executor()
+        pending = {}    # future -> (cache key, submitted at, entry indices, executor)
+        inflight = {}   # cache key -> future, for identical inputs
+        try:
+            for name, read in self.inputs():
+                yield self._submit(pending, inflight, name, read)
+                # Hand out whatever finished meanwhile; wait while the queue is full
+                done = [f for f in pending if f.done()]
+                if not done and len(pending) >= limit:
+                    remaining = config['TIMEOUT'] - (time.perf_counter() - started)
+                    done = wait(list(pending), timeout=max(remaining, 0), return_when=FIRST_COMPLETED).done
+                    if not done:
+                        raise FuturesTimeout()
+                for future in done:
+                    yield self._collect(future, inflight, *pending.pop(future))
+            self.close()
+
+            remaining = config['TIMEOUT'] - (time.perf_counter() - started)
+            for future in as_completed(list(pending), timeout=max(remaining, 0)):
+                yield self._collect(future, inflight, *pending.pop(future))
+        except FuturesTimeout:
+            for future, (_, _, indices, _) in pending.items():
+                future.cancel()
+                for index in indices:
+                    yield self._fail(index, f"Did not finish within {config['TIMEOUT']}s")
+            pending.clear()
+        finally:
+            # Also reached when the client goes away mid-stream
+            for future in pending:
+                future.cancel()
+            self.close()
+
+        statuses = [entry['status'] for entry in self.entries]
+        manifest = {
+            'endpoint': self.endpoint,
+            'params': self.params,
+            'inputs': self.entries,
+            **{state: statuses.count(state) for state in ('rendered', 'cached', 'duplicate', 'failed')},
+            'total_ms': round((time.perf_counter() - started) * 1000, 1),
+        }
+        yield self.archive.add("manifest.json", json.dumps(manifest, indent=2).encode("utf-8"), "application/json")
+        yield self.archive.close()
+
+    def stem(self, index, name):
+        return os.path.splitext(name)[0]
+
+    def member_name(self, index, name, suffix):
+        """Archive name for the output of input ``index``: a relative path, unique within the archive."""
+        parts = [re.sub(r"[^\w.-]+", "_", part).strip("_") for part in self.stem(index, name).split("/")]
+        stem = "/".join(part for part in parts if part.strip(".")) or f"input{index + 1}"
+        member, n = f"{stem}.{suffix}", 1
+        while member in self._names:
+            n += 1
+            member = f"{stem}_{n}.{suffix}"
+        self._names.add(member)
+        return member
+
+    def _submit(self, pending, inflight, name, read):
+        """Read one input and queue its render; returns archive bytes when it needs no render."""
+        index = len(self.entries)
+        entry = {'name': name, 'status': 'pending'}
+        self.entries.append(entry)
+        read_started = time.perf_counter()
+        try:
+            data, fmt, rows = read()
+        except IngestError as e:
+            return self._fail(index, str(e))
+        entry['read_ms'] = round((time.perf_counter() - read_started) * 1000, 1)
+        if rows is not None:
+            entry['rows'] = rows
+
+        cache_key = self.view.cache_key(data, fmt, **self.params)
+        entry['id'] = cache_key
+        future = inflight.get(cache_key)
+        if future is not None:
+            # Same content and parameters as an input still rendering
+            entry['status'] = 'duplicate'
+            pending[future][2].append(index)
+            return b""
+        cached = self.render_cache.get(cache_key) if self.render_cache is not None else None
+        if cached is not None:
+            meta, body = cached
+            entry['status'] = 'cached'
+            return self._add(index, body, meta['content_type'])
+
+        args = (render_input, self.endpoint, data, fmt, self.params)
+        try:
+            future = submit(self._executor, *args)
+        except BrokenProcessPool:
+            # A render process died since the last submit; retry once on a fresh pool
+            self._replace_executor(self._executor)
+            try:
+                future = submit(self._executor, *args)
+            except BrokenProcessPool as e:
+                self._replace_executor(self._executor)
+                return self._fail(index, f"Render process died: {e}")
+        inflight[cache_key] = future
+        pending[future] = (cache_key, time.time(), [index], self._executor)
+        return b""
+
+    def _replace_executor(self, broken):
+        """Drop a broken pool; later inputs go to a fresh one."""
+        _reset_executor(broken)
+        if self._executor is broken:
+            self._executor = get_render_executor()
+
+    def _collect(self, future, inflight, cache_key, submitted_at, indices, executor):
+        del inflight[cache_key]
+        try:
+            result = future.result()
+        except BrokenProcessPool as e:
+            self._replace_executor(executor)
+            return b"".join(self._fail(index, f"Render process died: {e}") for index in indices)
+        timings = dict(queue_ms=round(max(result['started_at'] - submitted_at, 0) * 1000, 1),
+                       render_ms=result['render_ms'], cpu_ms=result['cpu_ms'], worker=result['worker'],
+                       total_ms=round((time.time() - submitted_at) * 1000, 1))
+        self.entries[indices[0]].update(timings)
+        if result['error'] is not None:
+            return b"".join(self._fail(index, result['error']) for index in indices)
+
+        if self.render_cache is not None:
+            stream = self.endpoint == 'diagram' and result['content_type'] == "image/png"
+            self.render_cache.set(cache_key, {'content_type': result['content_type'],
+                                              'headers': result['headers'], 'stream': stream}, result['body'])
+        self.entries[indices[0]]['status'] = 'rendered'
+        return b"".join(self._add(index, result['body'], result['content_type']) for index in indices)
+
+    def _add(self, index, body, content_type):
+        entry = self.entries[index]
+        suffix = EXTENSIONS.get(content_type.split(';')[0], 'bin')
+        entry['file'] = self.member_name(index, entry['name'], suffix)
+        entry['bytes'] = len(body)
+        return self.archive.add(entry['file'], body, content_type)
+
+    def _fail(self, index, message):
+        entry = self.entries[index]
+        entry.update(status='failed', error=message)
+        entry['file'] = self.member_name(index, entry['name'], 'error.txt')
+        return self.archive.add(entry['file'], message.encode("utf-8"), "text/plain; charset=utf-8")
+
+
+class SheetBatch(RenderBatch):
+    """Every selected sheet of ``workbook`` (an open ``ingest.Workbook``, closed by the batch)."""
+
+    def __init__(self, workbook, sheets, endpoint, params, archive, render_cache=None):
+        super().__init__(endpoint, params, archive, render_cache=render_cache)
+        self.workbook = workbook
+        self.sheets = sheets
+
+    def inputs(self):
+        for name in self.sheets:
+            yield name, partial(self._read, name)
+
+    def _read(self, name):
+        data, rows = self.workbook.sheet(name)
+        return data, 'sheet', rows
+
+    def stem(self, index, name):
+        return f"{index + 1:02d}_{name.replace('/', '_')}"
+
+    def close(self):
+        self.workbook.close()
+
+
+class FileBatch(RenderBatch):
+    """
+    Uploaded netlists: ``files`` yields ``(name, size, read)`` with
+    ``read()`` returning the bytes, so ZIP members are only inflated when
+    their turn comes (and never above ``MAX_FILE_BYTES``).
+    """
+
+    def __init__(self, files, endpoint, params, archive, render_cache=None):
+        super().__init__(endpoint, params, archive, render_cache=render_cache)
+        self.files = files
+
+    def inputs(self):
+        max_bytes = get_batch_config()['MAX_FILE_BYTES']
+        for name, size, read in self.files:
+            yield name, partial(self._read, name, size, read, max_bytes)
+
+    @staticmethod
+    def _read(name, size, read, max_bytes):
+        fmt = FORMATS.get(os.path.splitext(name)[1].lower())
+        if fmt is None:
+            raise IngestError("Not a netlist file (" + ", ".join(FORMATS) + ")")
+        if max_bytes is not None and size > max_bytes:
+            raise IngestError(f"File is {size} bytes, limit is {max_bytes}")
+        return read(), fmt, None
+
+
+def zip_members(archive):
+    """``(name, size, read)`` for the files of an uploaded ZIP, skipping directories and macOS metadata."""
+    try:
+        zf = zipfile.ZipFile(io.BytesIO(archive))
+    except zipfile.BadZipFile as e:
+        raise IngestError(f"Could not read ZIP upload: {e}") from e
+    members = [info for info in zf.infolist()
+               if not info.is_dir() and not info.filename.startswith("__MACOSX/")
+               and not os.path.basename(info.filename).startswith(".")]
+    return [(info.filename, info.file_size, partial(_read_member, zf, info)) for info in members]
+
+
+def _read_member(zf, info):
+    try:
+        return zf.read(info)
+    except (zipfile.BadZipFile, NotImplementedError, RuntimeError) as e:
+        raise IngestError(f"Could not extract {info.filename}: {e}") from e
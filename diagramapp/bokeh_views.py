@@ -0,0 +1,356 @@
+"""
+/api/generate-diagram and /api/generate: Bokeh plots of a netlist, as a
+standalone page or a json_item document. Bokeh and networkx are imported
+here only, so processes that never serve these endpoints do not load them.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+import networkx as nx
+from django.http import HttpResponse
+from rest_framework.views import APIView
+from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
+from bokeh.plotting import figure
+from bokeh.embed import file_html, json_item
+from bokeh.resources import CDN
+from bokeh.models import Arrow, ColumnDataSource, NormalHead
+from .render_cache import get_render_cache
+from .ingest import IngestError, netlist_payload, read_netlist
+from .timing import stage
+from .metrics import annotate, observe_input
+from .layered import get_layout_config, layered_layout
+from .jobs import offload_if_large
+from .views import BOKEH_FORMATS, dumps, output_format
+
+
+def bokeh_output(p, out_format="html"):
+    """``(body, content_type)`` of a Bokeh plot in ``out_format``."""
+    with stage("serialize"):
+        if out_format == "json":
+            return dumps(json_item(p, "circuit-diagram")), "application/json"
+        return file_html(p, CDN, "Circuit Diagram").encode("utf-8"), "text/html; charset=utf-8"
+
+
+# Rows of the circuit diagram; a type containing a layer name, e.g. "Initiator_AXI", joins that layer
+FABRIC_LAYERS = {
+    "Manager": 0,
+    "Initiator": 1,
+    "Switch": 2,
+    "Target": 3,
+    "Subordinate": 4,
+}
+
+
+def fabric_layer(node_type):
+    """Layer of ``node_type`` in FABRIC_LAYERS (the last layer name it contains), or the one below them all."""
+    if node_type in FABRIC_LAYERS:
+        return FABRIC_LAYERS[node_type]
+    matches = [name for name in FABRIC_LAYERS if isinstance(node_type, str) and name in node_type]
+    return FABRIC_LAYERS[matches[-1]] if matches else len(FABRIC_LAYERS)
+
+
+def name_order(names):
+    """The digits of every name read as one number (0 without digits), e.g. ``S12_3`` -> 123."""
+    text = [str(name) for name in names]
+    if not text:
+        return []
+    # One row of code points per name (padded with 0), folded column by column
+    points = np.array(text).view(np.uint32).reshape(len(text), -1)
+    digits = points - ord("0")  # wraps around below "0"
+    is_digit = digits < 10
+    order = np.zeros(len(text), dtype=np.int64)
+    for column, column_is_digit in zip(digits.T, is_digit.T):
+        order = np.where(column_is_digit, order * 10 + column, order)
+    order = order.tolist()
+    # Names past int64 or with non-ASCII (possibly digit) characters: one at a time
+    for i in np.flatnonzero((is_digit.sum(axis=1) > 18) | (points > 127).any(axis=1)).tolist():
+        order[i] = int(re.sub(r"\D+", "", text[i]) or 0)
+    return order
+
+
+class CircuitDiagramAPIView(APIView):
+    parser_classes = (MultiPartParser, FormParser, JSONParser)
+    endpoint = 'generate-diagram'
+    formats = BOKEH_FORMATS
+
+    def post(self, request, *args, **kwargs):
+        data, fmt = netlist_payload(request)
+        if data is None:
+            return HttpResponse("Please upload an Excel file.", status=400)
+        try:
+            params = {'out_format': output_format(request, self.formats)}
+        except ValueError as e:
+            return HttpResponse(str(e), status=400)
+        annotate(self.endpoint, params['out_format'])
+
+        render_cache = get_render_cache()
+        cache_key = self.cache_key(data, fmt, **params)
+        cached = render_cache.lookup(request, cache_key)
+        if cached is not None:
+            return cached
+
+        offloaded = offload_if_large(request, self.endpoint, data, fmt, params, cache_key)
+        if offloaded is not None:
+            return offloaded
+
+        try:
+            body, content_type, headers = self.render(data, fmt, **params)
+        except IngestError as e:
+            return HttpResponse(str(e), status=400)
+        return render_cache.store(cache_key, body, content_type, headers)
+
+    def cache_key(self, data, fmt, out_format="html"):
+        return get_render_cache().make_key(data, endpoint=self.endpoint, format=out_format, width=1000, height=800,
+                                           input_format=fmt)
+
+    def render(self, data, fmt, out_format="html"):
+        """Render a netlist to standalone HTML or Bokeh JSON; returns ``(body, content_type, headers)``."""
+        # Read Excel into DataFrame (only the columns drawn below)
+        with stage("read"):
+            df = read_netlist(data, columns=["From_Device", "To_Device", "Device_Type", "Bus_Label"],
+                              categoricals=["Device_Type", "Bus_Label"], fmt=fmt)
+        with stage("draw"):
+            p = self.draw(df)
+
+        # Export as HTML or JSON
+        body, content_type = bokeh_output(p, out_format)
+        return body, content_type, {}
+
+    def draw(self, df):
+        # Separate Masters and Slaves
+        masters = df[df["Device_Type"] == "Master"]["From_Device"].unique().tolist()
+        slaves = df[df["Device_Type"] == "Slave"]["From_Device"].unique().tolist()
+        observe_input(rows=len(df), nodes=len(masters) + len(slaves),
+                      edges=int(df["To_Device"].fillna("").astype(bool).sum()))
+
+        # Create Bokeh figure
+        p = figure(title="Circuit Diagram", 
+                   x_range=(0, 1000), 
+                   y_range=(0, 800),
+                   width=1000, height=800)
+
+        # Masters on the left, Slaves on the right; one glyph each for all boxes and all names
+        names = masters + slaves
+        xs = np.array([200] * len(masters) + [800] * len(slaves), dtype=float)
+        ys = 700.0 - 200.0 * np.concatenate([np.arange(len(masters)), np.arange(len(slaves))])
+        devices = ColumnDataSource({
+            'x': xs, 'y': ys, 'name': names,
+            'color': ["lightblue"] * len(masters) + ["lightgreen"] * len(slaves),
+        })
+        p.rect('x', 'y', width=80, height=50, fill_color='color', source=devices)
+        p.text('x', 'y', text='name', text_align="center", text_baseline="middle", source=devices)
+
+        # Connections (buses with arrows) between placed devices; a later
+        # placement of the same name wins, as in a dict
+        device_index = {name: i for i, name in enumerate(names)}
+        start = df["From_Device"].map(device_index)
+        end = df["To_Device"].map(device_index)
+        connected = (start.notna() & end.notna()).to_numpy()
+        start = start.to_numpy()[connected].astype(int)
+        end = end.to_numpy()[connected].astype(int)
+        x0, y0, x1, y1 = xs[start], ys[start], xs[end], ys[end]
+
+        # Arrow from master to slave
+        p.add_layout(Arrow(end=NormalHead(size=10, fill_color="black"),
+                           x_start='x0', y_start='y0', x_end='x1', y_end='y1', line_width=2,
+                           source=ColumnDataSource({'x0': x0 + 40, 'y0': y0, 'x1': x1 - 40, 'y1': y1})))
+
+        # Bus label in the middle
+        # Bus_Label is optional; a sheet without it draws unlabelled arrows
+        bus_label = df["Bus_Label"] if "Bus_Label" in df.columns else pd.Series("", index=df.index)
+        labels = bus_label.astype(object).to_numpy()[connected]
+        labelled = np.array([isinstance(label, str) and label != "" for label in labels], dtype=bool)
+        p.text('x', 'y', text='text', text_align="center", source=ColumnDataSource({
+            'x': ((x0 + x1) / 2)[labelled], 'y': ((y0 + y1) / 2)[labelled], 'text': labels[labelled].tolist(),
+        }))
+
+        return p
+
+
+class CircuitAPIView(APIView):
+    parser_classes = (MultiPartParser, FormParser, JSONParser)
+    endpoint = 'generate'
+    formats = BOKEH_FORMATS
+
+    def post(self, request, *args, **kwargs):
+        data, fmt = netlist_payload(request)
+        if data is None:
+            return HttpResponse("Please upload an Excel file.", status=400)
+        try:
+            params = {'out_format': output_format(request, self.formats)}
+        except ValueError as e:
+            return HttpResponse(str(e), status=400)
+        annotate(self.endpoint, params['out_format'])
+
+        render_cache = get_render_cache()
+        cache_key = self.cache_key(data, fmt, **params)
+        cached = render_cache.lookup(request, cache_key)
+        if cached is not None:
+            return cached
+
+        offloaded = offload_if_large(request, self.endpoint, data, fmt, params, cache_key)
+        if offloaded is not None:
+            return offloaded
+
+        try:
+            body, content_type, headers = self.render(data, fmt, **params)
+        except IngestError as e:
+            return HttpResponse(str(e), status=400)
+        return render_cache.store(cache_key, body, content_type, headers)
+
+    def cache_key(self, data, fmt, out_format="html"):
+        return get_render_cache().make_key(data, endpoint=self.endpoint, format=out_format, width=1200, height=700,
+                                           input_format=fmt)
+
+    def render(self, data, fmt, out_format="html"):
+        """Render a layered netlist to standalone HTML or Bokeh JSON; returns ``(body, content_type, headers)``."""
+        G = self.build_graph(data, fmt)
+        return self.draw(G, self.layout(G), out_format)
+
+    def build_graph(self, data, fmt):
+        """Netlist as a DiGraph with ``type`` and ``layer`` on every node."""
+        # Load Excel (now without Parent column)
+        with stage("read"):
+            df = read_netlist(data, columns=["Node", "Type", "Connects_To"], categoricals=["Type"], fmt=fmt)
+        with stage("graph"):
+            G = self._graph(df)
+        observe_input(rows=len(df), nodes=G.number_of_nodes(), edges=G.number_of_edges())
+        return G
+
+    @staticmethod
+    def _graph(df):
+        """
+        The netlist's DiGraph, built from whole columns: every node (in the
+        order first seen, typed by its last row) with its ``type``, ``layer``
+        and ``order`` (the number in its name), then every connection, a
+        target that is not a node of its own joining as type "Unknown".
+        """
+        nodes = df["Node"].tolist()
+        types = df["Type"] if isinstance(df["Type"].dtype, pd.CategoricalDtype) else df["Type"].astype("category")
+        # The layer of every type, looked up once per category (code -1: no type)
+        layers = np.array([fabric_layer(t) for t in types.cat.categories] + [len(FABRIC_LAYERS)])
+        row_layers = layers[types.cat.codes.to_numpy()].tolist()
+        row_types = types.tolist()
+
+        # Last row of every node, in the order the nodes first appear
+        last = dict(zip(nodes, range(len(nodes))))
+        connected = df["Connects_To"].notna().to_numpy()
+        sources = np.asarray(nodes, dtype=object)[connected].tolist()
+        targets = df["Connects_To"].to_numpy()[connected].tolist()
+        unknown = [target for target in dict.fromkeys(targets) if target not in last]
+
+        if None in last or None in unknown:
+            raise ValueError("None cannot be a node")
+        order = name_order(list(last) + unknown)
+        unknown_layer = fabric_layer("Unknown")
+        G = nx.DiGraph()
+        G.add_nodes_from((name, {"type": row_types[row], "layer": row_layers[row], "order": key})
+                         for (name, row), key in zip(last.items(), order))
+        G.add_nodes_from((name, {"type": "Unknown", "layer": unknown_layer, "order": key})
+                         for name, key in zip(unknown, order[len(last):]))
+        G.add_edges_from(zip(sources, targets))
+        return G
+
+    def layout(self, G):
+        # Layered layout: one row per layer, seeded with the numeric order of
+        # the names, then reordered to reduce edge crossings
+        config = get_layout_config()
+        with stage("layout"):
+            return layered_layout(
+                list(G.nodes), dict(G.nodes.data("layer")), list(G.edges),
+                initial_key=dict(G.nodes.data("order", default=0)).__getitem__,
+                method=config['METHOD'], iterations=config['ITERATIONS'],
+                spacing=3.0, layer_gap=3.0,
+            )
+
+    def draw(self, G, layout, out_format="html"):
+        with stage("draw"):
+            p = self.plot(G, layout)
+
+        # Export
+        body, content_type = bokeh_output(p, out_format)
+        return body, content_type, {
+            "X-Layout-Crossings": str(layout.crossings),
+            "X-Layout-Ms": f"{layout.seconds * 1000:.1f}",
+        }
+
+    def plot(self, G, layout):
+        pos = layout.positions
+
+        # --- Box size for all nodes ---
+        box_width = 1.8
+        box_height = 0.9
+
+        # --- Compute dynamic bounds ---
+        xs, ys = zip(*pos.values())
+        x_min, x_max = min(xs), max(xs)
+        y_min, y_max = min(ys), max(ys)
+
+        margin_x = box_width * 2
+        margin_y = box_height * 2
+
+        x_range = (x_min - margin_x, x_max + margin_x)
+        y_range = (y_min - margin_y, y_max + margin_y)
+
+        # --- Fixed plot size, but dynamic ranges ---
+        p = figure(
+            title="Circuit Diagram",
+            x_range=x_range,
+            y_range=y_range,
+            width=1200,   # fixed frame width
+            height=700,   # fixed frame height
+            match_aspect=True,
+            tools=""  # no pan/zoom/reset
+        )
+
+        # Clean background (white, no axes/grid)
+        p.xaxis.visible = False
+        p.yaxis.visible = False
+        p.xgrid.visible = False
+        p.ygrid.visible = False
+        p.outline_line_color = None
+
+        # Color mapping
+        color_map = {
+            "Manager": "lightblue",
+            "Initiator": "orange",
+            "Switch": "lightgreen",
+            "Target": "pink",
+            "Subordinate": "violet",
+        }
+
+        # Draw nodes: all boxes in one rect glyph, all names in one text glyph
+        names = list(pos)
+        xy = np.array([pos[n] for n in names], dtype=float).reshape(-1, 2)
+        nodes = ColumnDataSource({
+            'x': xy[:, 0], 'y': xy[:, 1], 'name': names,
+            'color': [color_map.get(G.nodes[n].get("type", "Unknown"), "gray") for n in names],
+        })
+        p.rect('x', 'y', width=box_width, height=box_height, source=nodes,
+               fill_color='color', line_color="black", line_width=2)
+        p.text('x', 'y', text='name', source=nodes,
+               text_align="center", text_baseline="middle", text_font_size="14pt")
+
+        # Draw arrows (edge clipping at box borders), all in one Arrow annotation
+        index = {n: i for i, n in enumerate(names)}
+        ends = np.array([(index[src], index[dst]) for src, dst in G.edges()], dtype=int).reshape(-1, 2)
+        x0, y0 = xy[ends[:, 0]].T
+        x1, y1 = xy[ends[:, 1]].T
+        dx, dy = x1 - x0, y1 - y0
+        dist = np.hypot(dx, dy)
+        keep = dist > 0
+        x0, y0, x1, y1, dx, dy, dist = (a[keep] for a in (x0, y0, x1, y1, dx, dy, dist))
+        ux, uy = dx / dist, dy / dist
+
+        horizontal = np.abs(dx) > np.abs(dy)
+        clip_x = np.where(horizontal, box_width / 2, box_height / 2)
+        clip_y = np.where(~horizontal, box_height / 2, box_width / 2)
+        p.add_layout(Arrow(end=NormalHead(size=12),
+                           x_start='x0', y_start='y0', x_end='x1', y_end='y1',
+                           line_width=2, source=ColumnDataSource({
+                               'x0': x0 + ux * clip_x, 'y0': y0 + uy * clip_y,
+                               'x1': x1 - ux * clip_x, 'y1': y1 - uy * clip_y,
+                           })))
+
+        return p
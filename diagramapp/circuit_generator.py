@@ -1,219 +1,460 @@
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 
+from .ingest import compact_dtypes, read_netlist
+from .netlist import Arrows, Buses, Devices, Drops, Netlist, Rows, Segments, get_model_cache, model_key
+from .metrics import observe_input
+from .timing import stage
+
+
+def _column(df, name):
+    """Column as an object array (values keep the Python types iterrows() yields), or None if absent."""
+    if name not in df.columns:
+        return None
+    return df[name].to_numpy(dtype=object)
+
+
+def _filled(values):
+    """Mask of cells that are non-blank once stringified and stripped."""
+    if values is None:
+        return None
+    return pd.Series(values, dtype=object).astype(str).str.strip().to_numpy() != ""
+
+
+def _split(values):
+    """Comma-split every cell (as str), the way the per-row code did."""
+    return pd.Series(values, dtype=object).astype(str).str.split(",").tolist()
+
+
+def _int_list(text):
+    return [int(v.strip()) for v in str(text).split(",")]
+
+
+TRACE_MODES = ("segments", "merged", "webgl")
+# Outputs of GenerateCircuitDiagramView: the exported image or the figure itself as plotly JSON
+FIGURE_FORMATS = ("png", "json")
+
+
 class DynamicCircuitDiagram:
-    def __init__(self):
+    # Every column the drawing stages read; nothing else is loaded
+    columns = ("From_Device", "To_Device", "Device_Type", "X", "Y", "Address", "Status",
+               "Bus_Label", "Bus_Order", "Bus_Extend", "Pin_Offset", "Pin_Side",
+               "Connect_To_Bus", "Connect_To_Bus_Type", "Bus_X_Offset", "Bus_Y_Offset",
+               "Arrow_X", "Arrow_Y", "Direction", "Arrow_Color")
+    categoricals = ("Device_Type", "Status", "Bus_Label")
+
+    def __init__(self, trace_mode="segments"):
+        # "segments": one trace per bus segment (original output)
+        # "merged":   one trace per bus / line style, segments split by None
+        # "webgl":    like "merged", drawn with Scattergl
+        if trace_mode not in TRACE_MODES:
+            raise ValueError(f"trace_mode must be one of {TRACE_MODES}")
+        self.trace_mode = trace_mode
         #Define only colors here
         self.colors = {'SDA': '#0066cc','SCL': '#00ccff','SCLK': '#009900','MOSI': '#66ff66','MISO': '#006600','SS1': '#800080','SS2': '#9932CC',
             'TX': '#cc0000','RX': '#ff6600'
         }
         self.device_colors = {'Microcontroller': '#b3d9ff','I2C_Device': '#b3ffb3','SPI_Device': '#ffffb3','UART_Device': '#ffb3b3' }
 
-    def read_excel_data(self, file_path):
-        df = pd.read_excel(file_path)
+    def read_excel_data(self, file_path, fmt='excel'):
+        df = read_netlist(file_path, columns=self.columns, fmt=fmt)
         # convert "-" and NaN into empty string
         df = df.replace("-", "").fillna("")
-        return df
-
-    def create_chip(self, row):
-        x, y = row["X"], row["Y"] 
-        device_type = row["Device_Type"] 
-        device_id = row["From_Device"] 
-        address = row["Address"] 
-        width, height = (80, 60) if device_type == "Microcontroller" else (40, 30) 
-        shapes = [{ 'type': 'rect', 'x0': x - width/2, 'x1': x + width/2, 'y0': y - height/2, 'y1': y + height/2, 
-                   'fillcolor': self.device_colors.get(device_type, 'lightgray'), 'line': {'color': 'black', 'width': 2} 
-                }] 
-        label = device_id 
-        if address not in ["", "-"]:
-            label += f" addr: {address}" 
-        annotations = [{ 'x': x, 'y': y, 'text': label, 'showarrow': False, 'font': {'size': 11, 'color': 'black'}, 'align': 'center' }] 
-        
+        return compact_dtypes(df, self.categoricals)
+
+    def parse(self, source, fmt='excel'):
+        """
+        The upload as a :class:`~diagramapp.netlist.Netlist`. Models of
+        in-memory uploads are cached by content, so another render of the
+        same netlist (a different trace mode, a revision, an evicted image)
+        skips reading and preparing it.
+        """
+        key = model_key(bytes(source), fmt, type(self).__name__) if isinstance(source, (bytes, bytearray)) else None
+        if key is not None:
+            with stage("model_cache"):
+                netlist = get_model_cache().get(key)
+            if netlist is not None:
+                return netlist
+        with stage("read"):
+            df = self.read_excel_data(source, fmt=fmt)
+        with stage("prepare"):
+            netlist = self.prepare(df)
+        if key is not None:
+            with stage("model_cache"):
+                get_model_cache().set(key, netlist)
+        return netlist
+
+    def prepare(self, df, devices=None, buses=None):
+        """
+        Single columnar preprocessing stage. Pulls every column the drawing
+        stages use out of the DataFrame once, and precomputes the blank-cell
+        masks, bus lists, bus Y-positions and segment offsets they need, so
+        no stage has to walk the frame row by row. Returns a ``Netlist``.
+
+        ``devices`` and ``buses`` override the tables derived from ``df``,
+        so a subset of rows can be prepared against the whole netlist (see
+        revisions.py).
+        """
+        from_device, x, y = _column(df, "From_Device"), _column(df, "X"), _column(df, "Y")
+        if devices is None:
+            devices = Devices.from_rows(from_device.tolist(), x.tolist(), y.tolist())
+        if buses is None:
+            buses = self.bus_table(df, devices)
+
+        index = devices.index
+        rows = Rows(
+            device=np.fromiter((index[d] for d in from_device.tolist()), dtype=np.int64, count=len(df)),
+            device_type=_column(df, "Device_Type"),
+            address=_column(df, "Address"),
+            x=x, y=y,
+        )
+        return Netlist(
+            devices=devices,
+            buses=buses,
+            rows=rows,
+            drops=self._prepare_bus_drops(df, x, y, buses),
+            segments=self._prepare_bus_segments(df, devices, buses),
+            arrows=self._prepare_free_arrows(df),
+        )
+
+    def _prepare_free_arrows(self, df):
+        arrow_x, arrow_y = _column(df, "Arrow_X"), _column(df, "Arrow_Y")
+        if arrow_x is None or arrow_y is None:
+            return None
+
+        x = pd.to_numeric(pd.Series(arrow_x, dtype=object), errors="coerce").to_numpy(dtype=float)
+        y = pd.to_numeric(pd.Series(arrow_y, dtype=object), errors="coerce").to_numpy(dtype=float)
+        # skip rows with missing or non-numeric values
+        keep = (arrow_x != "") & (arrow_y != "") & ~np.isnan(x) & ~np.isnan(y)
+
+        direction = _column(df, "Direction")
+        if direction is None:
+            direction = np.full(len(df), "right", dtype=object)
+        direction = pd.Series(direction, dtype=object).astype(str).str.lower().to_numpy()
+
+        # Arrow offset length; anything unrecognised points right
+        shift = 20
+        dx = np.where(direction == "left", -shift, np.where((direction == "up") | (direction == "down"), 0, shift))
+        dy = np.where(direction == "up", shift, np.where(direction == "down", -shift, 0))
+
+        color = _column(df, "Arrow_Color")
+        if color is None:
+            color = np.full(len(df), "black", dtype=object)
+        else:
+            color = np.where(color != "", color, "black")
+
+        return Arrows(
+            row=np.flatnonzero(keep),
+            x=x[keep], y=y[keep],
+            ax=(x + dx)[keep], ay=(y + dy)[keep],
+            color=color[keep],
+        )
+
+    def bus_table(self, df, devices):
+        """Interned buses, with the Y coordinate of every extended bus."""
+        buses = Buses.empty()
+        bus_label, bus_extend = _column(df, "Bus_Label"), _column(df, "Bus_Extend")
+        if bus_label is None or bus_extend is None:
+            return buses
+
+        rows = np.flatnonzero((bus_label != "") & _filled(bus_extend))
+        pin_offset = _column(df, "Pin_Offset")
+        has_offset = _filled(pin_offset)
+
+        from_device = df["From_Device"].to_numpy(dtype=object)
+        for r, labels in zip(rows, _split(bus_label[rows])):
+            # compute bus_y from Pin_Offset if present
+            offset = int(pin_offset[r]) if has_offset is not None and has_offset[r] else 0
+            bus_y = devices.y[devices.index[from_device[r]]] + offset
+            for bus in labels:
+                buses.line_y[buses.intern(bus.strip())] = bus_y
+        return buses
+
+    def _prepare_bus_drops(self, df, x, y, buses):
+        """Vertical device-to-bus drops: one entry per (row, bus) that lands on an extended bus."""
+        connect = _column(df, "Connect_To_Bus")
+        drops = {'x': [], 'y0': [], 'y1': [], 'bus': [], 'dash': [], 'x_off': [], 'y_off': [], 'row': []}
+        if connect is None:
+            return Drops(row=np.array([], dtype=np.int64), bus=np.array([], dtype=np.int64),
+                         x=[], y0=[], y1=[], dash=[])
+
+        rows = np.flatnonzero(connect != "")
+        bus_type = _column(df, "Connect_To_Bus_Type")
+        x_offset, y_offset = _column(df, "Bus_X_Offset"), _column(df, "Bus_Y_Offset")
+        has_type = bus_type != "" if bus_type is not None else np.zeros(len(df), dtype=bool)
+        has_x_off = _filled(x_offset) if x_offset is not None else np.zeros(len(df), dtype=bool)
+        has_y_off = _filled(y_offset) if y_offset is not None else np.zeros(len(df), dtype=bool)
+
+        for r, names in zip(rows, _split(connect[rows])):
+            styles = str(bus_type[r]).split(",") if has_type[r] else ["dashed"] * len(names)
+            x_offsets = _int_list(x_offset[r]) if has_x_off[r] else []
+            y_offsets = _int_list(y_offset[r]) if has_y_off[r] else []
+            for i, bus in enumerate(names):
+                bus = buses.index.get(bus.strip())
+                if bus is None or buses.line_y[bus] is None:
+                    continue
+                # use "solid" if defined, else default "dot"
+                drops['dash'].append("solid" if i < len(styles) and styles[i].strip().lower() == "solid" else "dot")
+                drops['x_off'].append(x_offsets[i] if i < len(x_offsets) else 0)
+                drops['y_off'].append(y_offsets[i] if i < len(y_offsets) else 0)
+                drops['x'].append(x[r])
+                drops['y0'].append(y[r])
+                drops['y1'].append(buses.line_y[bus])
+                drops['bus'].append(bus)
+                drops['row'].append(r)
+
+        x_off = np.array(drops['x_off'], dtype=object)
+        y_off = np.array(drops['y_off'], dtype=object)
+        return Drops(
+            row=np.array(drops['row'], dtype=np.int64),
+            bus=np.array(drops['bus'], dtype=np.int64),
+            x=(np.array(drops['x'], dtype=object) + x_off).tolist(),
+            y0=(np.array(drops['y0'], dtype=object) + y_off).tolist(),
+            y1=(np.array(drops['y1'], dtype=object) + y_off).tolist(),
+            dash=drops['dash'],
+        )
+
+    def _device_order(self, df):
+        """
+        Row order of the device-to-device pass: devices in sorted order
+        (as groupby would visit them), rows of one device in file order,
+        or sorted by Bus_Order when that column exists.
+        """
+        codes, _ = pd.factorize(df["From_Device"], sort=True)
+        order = np.argsort(codes, kind="stable")
+        if "Bus_Order" not in df.columns or len(order) == 0:
+            return order
+        # Native dtype on purpose: ties must resolve exactly as DataFrame.sort_values did
+        bus_order = df["Bus_Order"].to_numpy()
+
+        sorted_codes = codes[order]
+        bounds = np.flatnonzero(np.diff(sorted_codes)) + 1
+        starts = np.concatenate(([0], bounds))
+        ends = np.concatenate((bounds, [len(order)]))
+        for start, end in zip(starts[ends - starts > 1], ends[ends - starts > 1]):
+            group = order[start:end]
+            by_bus_order = pd.Series(bus_order[group]).sort_values()
+            order[start:end] = group[by_bus_order.index.to_numpy()]
+        return order
+
+    def _prepare_bus_segments(self, df, devices, buses):
+        """Horizontal device-to-device bus segments, one entry per drawn bus."""
+        order = self._device_order(df)
+        active = (df["To_Device"].to_numpy(dtype=object) != "") & (df["Status"].to_numpy(dtype=object) == "active")
+        rows = order[active[order]]
+
+        from_device = df["From_Device"].to_numpy(dtype=object)[rows]
+        to_device = df["To_Device"].to_numpy(dtype=object)[rows]
+        from_id = [devices.index[d] for d in from_device]
+        to_id = [devices.index[d] for d in to_device]
+
+        # Explode the bus list of every active row: one entry per (row, bus)
+        labels = _split(df["Bus_Label"].to_numpy(dtype=object)[rows])
+        counts = np.array([len(l) for l in labels], dtype=int)
+        seg_row = np.repeat(np.arange(len(rows)), counts)
+        seg_index = np.arange(len(seg_row)) - np.repeat(np.cumsum(counts) - counts, counts)
+        seg_bus = np.array([bus for l in labels for bus in l], dtype=object)
+
+        keep = np.array([bus in self.colors for bus in seg_bus], dtype=bool)
+        seg_row, seg_index, seg_bus = seg_row[keep], seg_index[keep], seg_bus[keep]
+        src = rows[seg_row]
+
+        spacing = 15
+        offset = ((seg_index - counts[seg_row] // 2) * spacing).astype(object)
+        bus_order = _column(df, "Bus_Order")
+        if bus_order is not None:
+            has_order = _filled(bus_order)[src]
+            offset[has_order] = [int(v) * spacing for v in bus_order[src][has_order]]
+        pin_offset = _column(df, "Pin_Offset")
+        if pin_offset is not None:
+            has_offset = _filled(pin_offset)[src]
+            offset[has_offset] = [int(v) for v in pin_offset[src][has_offset]]
+
+        from_x = np.array([devices.x[from_id[i]] for i in seg_row], dtype=object)
+        from_y = np.array([devices.y[from_id[i]] for i in seg_row], dtype=object)
+        to_x = np.array([devices.x[to_id[i]] for i in seg_row], dtype=object)
+        bus_y = from_y + offset
+
+        # Pin_Side decides connection direction
+        pin_side = _column(df, "Pin_Side")
+        side = pin_side[src] if pin_side is not None else np.full(len(src), "right", dtype=object)
+        right, left = side == "right", side == "left"
+        start_x = np.where(right, from_x + 40, np.where(left, from_x - 40, from_x))
+        end_x = np.where(right, to_x - 40, np.where(left, to_x + 40, to_x))
+
+        bus_extend = _column(df, "Bus_Extend")
+        if bus_extend is not None:
+            extended = _filled(bus_extend)[src]
+            end_x[extended] = from_x[extended] + np.array([int(v) for v in bus_extend[src][extended]], dtype=object)
+
+        return Segments(
+            row=src,
+            bus=np.array([buses.intern(bus) for bus in seg_bus.tolist()], dtype=np.int64),
+            start_x=start_x.tolist(),
+            end_x=end_x.tolist(),
+            bus_y=bus_y.tolist(),
+            mid_x=((start_x + end_x) / 2).tolist(),
+        )
+
+    def chip_geometry(self, netlist):
+        """``(x0, x1, y0, y1, fill, labels)`` of the chip drawn for every row (see also tiles.py)."""
+        rows = netlist.rows
+        x, y = rows.x, rows.y
+        device_type = rows.device_type
+        address = rows.address
+
+        is_mcu = device_type == "Microcontroller"
+        half_w = np.where(is_mcu, 80 / 2, 40 / 2)
+        half_h = np.where(is_mcu, 60 / 2, 30 / 2)
+        fill = pd.Series(device_type, dtype=object).map(self.device_colors).fillna('lightgray').tolist()
+
+        has_address = (address != "") & (address != "-")
+        labels = [d + f" addr: {a}" if h else d
+                  for d, a, h in zip(netlist.device_names(), address.tolist(), has_address)]
+        return x - half_w, x + half_w, y - half_h, y + half_h, fill, labels
+
+    def create_chips(self, netlist):
+        x0, x1, y0, y1, fill, labels = self.chip_geometry(netlist)
+
+        shapes = [{ 'type': 'rect', 'x0': x0, 'x1': x1, 'y0': y0, 'y1': y1,
+                   'fillcolor': c, 'line': {'color': 'black', 'width': 2}
+                } for x0, x1, y0, y1, c in zip(x0.tolist(), x1.tolist(), y0.tolist(), y1.tolist(), fill)]
+        annotations = [{ 'x': xi, 'y': yi, 'text': label, 'showarrow': False, 'font': {'size': 11, 'color': 'black'}, 'align': 'center' }
+                       for xi, yi, label in zip(netlist.rows.x.tolist(), netlist.rows.y.tolist(), labels)]
+
         return shapes, annotations
 
-    def add_free_arrows(self, df):
+    def add_free_arrows(self, netlist):
         """
-        Reads Arrow_X, Arrow_Y, Direction, Arrow_Color from Excel
+        Uses Arrow_X, Arrow_Y, Direction, Arrow_Color from Excel
         and adds free-floating arrows (not tied to bus lines).
         """
-        annotations = []
-
+        arrows = netlist.arrows
         # Only run if the required columns exist
-        if not {"Arrow_X", "Arrow_Y"}.issubset(df.columns):
-            return annotations
-
-        for _, row in df.iterrows():
-            if row["Arrow_X"] == "" or row["Arrow_Y"] == "":
-                continue  # skip if missing values
-
-            try:
-                x = float(row["Arrow_X"])
-                y = float(row["Arrow_Y"])
-            except ValueError:
-                continue  # skip if not numeric
-
-            direction = str(row.get("Direction", "right")).lower()
-            color = row.get("Arrow_Color", "black") if row.get("Arrow_Color", "") != "" else "black"
-
-            # Arrow offset length
-            shift = 20
-            if direction == "right":
-                ax, ay = x + shift, y
-            elif direction == "left":
-                ax, ay = x - shift, y
-            elif direction == "up":
-                ax, ay = x, y + shift   # FIXED
-            elif direction == "down":
-                ax, ay = x, y - shift   # FIXED
-            else:
-                ax, ay = x + shift, y  # default → right
-
-            annotations.append(dict(
-                x=ax, y=ay,
-                ax=x, ay=y,
-                xref="x", yref="y",
-                axref="x", ayref="y",
-                showarrow=True,
-                arrowhead=3, arrowsize=1.5, arrowwidth=2,
-                arrowcolor=color
-            ))
-        return annotations
+        if arrows is None:
+            return []
+
+        return [dict(
+            x=ax, y=ay,
+            ax=x, ay=y,
+            xref="x", yref="y",
+            axref="x", ayref="y",
+            showarrow=True,
+            arrowhead=3, arrowsize=1.5, arrowwidth=2,
+            arrowcolor=color
+        ) for ax, ay, x, y, color in zip(arrows.ax.tolist(), arrows.ay.tolist(),
+                                         arrows.x.tolist(), arrows.y.tolist(), arrows.color.tolist())]
+
+    def connect_devices(self, netlist):
+        if self.trace_mode != "segments":
+            return self.connect_devices_merged(netlist)
 
-    def connect_devices(self, df):
         traces, annotations = [], []
-        device_positions = {row["From_Device"]: (row["X"], row["Y"]) for _, row in df.iterrows()}
-
-        # --- PASS 1: record bus_y positions for extended buses ---
-        bus_lines = {}  # {bus_label: y_coordinate}
-        for _, row in df.iterrows():
-            if "Bus_Label" in row and row["Bus_Label"] != "" and "Bus_Extend" in row and str(row["Bus_Extend"]).strip() != "":
-                bus_labels = str(row["Bus_Label"]).split(",")
-                from_x, from_y = device_positions[row["From_Device"]]
-
-                # compute bus_y from Pin_Offset if present
-                offset = int(row["Pin_Offset"]) if "Pin_Offset" in row and str(row["Pin_Offset"]).strip() != "" else 0
-                bus_y = from_y + offset
-
-                for bus in bus_labels:
-                    bus_lines[bus.strip()] = bus_y
-
-        # --- PASS 2: draw vertical connections from devices to buses ---
-        for _, row in df.iterrows():
-            buses = []
-            styles = []
-            
-            if "Connect_To_Bus" in row and row["Connect_To_Bus"] != "":
-                buses = str(row["Connect_To_Bus"]).split(",")
-
-                if "Connect_To_Bus_Type" in row and row["Connect_To_Bus_Type"] != "":
-                    styles = str(row["Connect_To_Bus_Type"]).split(",")
-                else:
-                    styles = ["dashed"] * len(buses)  # default style
-            else:
-                continue  # skip rows without vertical bus connections
-
-            x, y = row["X"], row["Y"]
-
-            # ✅ NEW: parse offsets if present
-            x_offsets = []
-            y_offsets = []
-            if "Bus_X_Offset" in row and str(row["Bus_X_Offset"]).strip() != "":
-                x_offsets = [int(v.strip()) for v in str(row["Bus_X_Offset"]).split(",")]
-            if "Bus_Y_Offset" in row and str(row["Bus_Y_Offset"]).strip() != "":
-                y_offsets = [int(v.strip()) for v in str(row["Bus_Y_Offset"]).split(",")]
-
-
-            for i, bus in enumerate(buses):
-                bus = bus.strip()
-                if bus in bus_lines:
-                    # use "solid" if defined, else default "dot"
-                    line_style = "solid" if i < len(styles) and styles[i].strip().lower() == "solid" else "dot"
-
-                    x_off = x_offsets[i] if i < len(x_offsets) else 0
-                    y_off = y_offsets[i] if i < len(y_offsets) else 0
-
-                    traces.append(go.Scatter(
-                        x=[x + x_off, x + x_off],
-                        y=[y + y_off, bus_lines[bus] + y_off],
-                        mode="lines",
-                        line=dict(color=self.colors.get(bus, "black"), width=2, dash=line_style),
-                         showlegend=False
-                    ))
-
-
-        # --- PASS 3: normal device-to-device connections (unchanged) ---
-        for device_name, group in df.groupby("From_Device"):
-            if "Bus_Order" in group.columns:
-                group = group.sort_values(by="Bus_Order")
-        
-            for _, row in group.iterrows():
-                if row["To_Device"] == "" or row["Status"] != "active":
-                    continue
+        names, colors = netlist.buses.names, netlist.buses.colors(self.colors)
+
+        # Vertical connections from devices to extended buses
+        drops = netlist.drops
+        for x, y0, y1, bus, dash in zip(drops.x, drops.y0, drops.y1, drops.bus.tolist(), drops.dash):
+            traces.append(dict(
+                type="scatter",
+                x=[x, x],
+                y=[y0, y1],
+                mode="lines",
+                line=dict(color=colors[bus], width=2, dash=dash),
+                showlegend=False
+            ))
+
+        # Device-to-device bus segments
+        segments = netlist.segments
+        for bus, start_x, end_x, bus_y, mid_x in zip(segments.bus.tolist(), segments.start_x, segments.end_x,
+                                                      segments.bus_y, segments.mid_x):
+            traces.append(dict(type="scatter", x=[start_x, end_x], y=[bus_y, bus_y], mode="lines",
+                               line=dict(color=colors[bus], width=3), name=names[bus], showlegend=True))
 
-                from_dev, to_dev = row["From_Device"], row["To_Device"]
-                bus_labels = str(row["Bus_Label"]).split(",")
-                from_x, from_y = device_positions[from_dev]
-                to_x, to_y = device_positions[to_dev]
-
-                spacing = 15
-                for i, bus in enumerate(bus_labels):
-                    if bus not in self.colors:
-                        continue
-
-                    if "Pin_Offset" in row and str(row["Pin_Offset"]).strip() != "":
-                        offset = int(row["Pin_Offset"])
-                    elif "Bus_Order" in row and str(row["Bus_Order"]).strip() != "":
-                        offset = int(row["Bus_Order"]) * spacing
-                    else:
-                        offset = (i - len(bus_labels)//2) * spacing
-
-                    bus_y = from_y + offset
-
-                    # ✅ Pin_Side decides connection direction
-                    pin_side = row.get("Pin_Side", "right")
-                    if pin_side == "right":
-                        start_x = from_x + 40
-                        end_x = to_x - 40
-                    elif pin_side == "left":
-                        start_x = from_x - 40
-                        end_x = to_x + 40
-                    else:
-                        start_x, end_x = from_x, to_x
-
-                    if "Bus_Extend" in row and str(row["Bus_Extend"]).strip() != "":
-                        end_x = from_x + int(row["Bus_Extend"])
-
-                    traces.append(go.Scatter(x=[start_x, end_x],y=[bus_y, bus_y],mode="lines",line=dict(color=self.colors[bus], width=3),
-                    name=bus,showlegend=True))
-
-                    annotations.append({'x': (start_x + end_x) / 2,'y': bus_y + 10,'text': bus,'showarrow': False,'font': {'size': 10, 'color': self.colors[bus]}
-                })
+            annotations.append({'x': mid_x, 'y': bus_y + 10, 'text': names[bus], 'showarrow': False,
+                                'font': {'size': 10, 'color': colors[bus]}})
         return traces, annotations
 
-    def generate_diagram(self, excel_file):
-        df = self.read_excel_data(excel_file)
+    def connect_devices_merged(self, netlist):
+        """
+        Same geometry as connect_devices, but every segment sharing a colour
+        and dash style goes into a single trace, with None between segments
+        so they stay disconnected. Keeps one legend entry per bus.
+        """
+        trace_type = "scattergl" if self.trace_mode == "webgl" else "scatter"
+        traces, annotations = [], []
+        names, colors = netlist.buses.names, netlist.buses.colors(self.colors)
+
+        # Vertical connections, grouped by (colour, dash)
+        drops = netlist.drops
+        drop_groups = {}
+        for x, y0, y1, bus, dash in zip(drops.x, drops.y0, drops.y1, drops.bus.tolist(), drops.dash):
+            xs, ys = drop_groups.setdefault((colors[bus], dash), ([], []))
+            xs.extend((x, x, None))
+            ys.extend((y0, y1, None))
+        for (color, dash), (xs, ys) in drop_groups.items():
+            traces.append(dict(type=trace_type, x=xs[:-1], y=ys[:-1], mode="lines",
+                               line=dict(color=color, width=2, dash=dash), showlegend=False))
+
+        # Device-to-device segments, grouped by bus (each bus has its own colour)
+        segments = netlist.segments
+        bus_groups = {}
+        for bus, start_x, end_x, bus_y, mid_x in zip(segments.bus.tolist(), segments.start_x, segments.end_x,
+                                                      segments.bus_y, segments.mid_x):
+            xs, ys = bus_groups.setdefault(bus, ([], []))
+            xs.extend((start_x, end_x, None))
+            ys.extend((bus_y, bus_y, None))
+
+            annotations.append({'x': mid_x, 'y': bus_y + 10, 'text': names[bus], 'showarrow': False,
+                                'font': {'size': 10, 'color': colors[bus]}})
+        for bus, (xs, ys) in bus_groups.items():
+            traces.append(dict(type=trace_type, x=xs[:-1], y=ys[:-1], mode="lines",
+                               line=dict(color=colors[bus], width=3), name=names[bus], showlegend=True))
+        return traces, annotations
 
-        fig = go.Figure()
+    def generate_diagram(self, excel_file, fmt='excel'):
+        netlist = self.parse(excel_file, fmt=fmt)
+        observe_input(rows=len(netlist), nodes=len(netlist.devices), edges=len(netlist.segments))
 
         # Draw devices
-        device_shapes, device_annotations = [], []
-        for _, row in df.iterrows():
-            shapes, ann = self.create_chip(row)
-            device_shapes.extend(shapes)
-            device_annotations.extend(ann)
+        with stage("chips"):
+            device_shapes, device_annotations = self.create_chips(netlist)
 
         # Draw bus communication
-        traces, comm_annotations = self.connect_devices(df)
-        for t in traces:
-            fig.add_trace(t)
+        with stage("connect"):
+            traces, comm_annotations = self.connect_devices(netlist)
 
         # 🔹 Add free arrows (independent of buses)
-        free_arrow_annotations = self.add_free_arrows(df)
+        with stage("arrows"):
+            free_arrow_annotations = self.add_free_arrows(netlist)
+
+        with stage("figure"):
+            return self.figure(traces, device_shapes, device_annotations + comm_annotations + free_arrow_annotations)
+
+    def figure(self, traces, shapes, annotations):
+        # Build the figure with all traces at once (validated in one pass)
+        fig = go.Figure(data=traces)
+        fig.update_layout(**self.layout(shapes, annotations))
+        return fig
 
-        fig.update_layout(
+    def figure_dict(self, traces, shapes, annotations):
+        """
+        The figure :meth:`figure` builds, as a plain dict with the default
+        template applied, skipping plotly's per-object validation. Only for
+        pieces that came out of this class unchanged (see revisions.py).
+        """
+        import plotly.io as pio
+
+        template = pio.templates[pio.templates.default].to_plotly_json()
+        return {'data': traces, 'layout': {**self.layout(shapes, annotations), 'template': template}}
+
+    @staticmethod
+    def layout(shapes, annotations):
+        return dict(
             title={'text': "Circuit Communication Diagram", 'x': 0.5},
-            shapes=device_shapes,
-            annotations=device_annotations + comm_annotations + free_arrow_annotations,
+            shapes=shapes,
+            annotations=annotations,
             showlegend=True,
             width=1200, height=800,
             xaxis=dict(showgrid=False, zeroline=False, showticklabels=False),
@@ -221,8 +462,6 @@ class DynamicCircuitDiagram:
             plot_bgcolor='white',
             paper_bgcolor='white'
         )
-        return fig
-
 
 
 
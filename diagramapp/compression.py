@@ -0,0 +1,175 @@
+"""
+Response compression for the text outputs (JSON, HTML, SVG, Mermaid source).
+
+Brotli is used when the client accepts it and the ``brotli`` package is
+installed, gzip otherwise. Rendered responses carry their render-cache key
+as ETag, so their compressed bodies are kept in a small per-process LRU and
+a cache hit is not compressed again. Images (PNG/JPEG) are never touched.
+"""
+import gzip
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.decorators import sync_and_async_middleware
+
+from .timing import stage
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+
+DEFAULT_COMPRESSION_CONFIG = {
+    'ENABLED': True,
+    'MIN_BYTES': 512,            # smaller bodies are sent as they are
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 5,         # 0-11; 5 is close to gzip -6 in speed with smaller output
+    'CONTENT_TYPES': ('application/json', 'text/html', 'text/plain', 'image/svg+xml'),
+    'CACHE_BYTES': 32 * 1024 * 1024,  # compressed bodies kept by (ETag, encoding)
+}
+
+_q_value = re.compile(r'^\s*([^;\s]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?')
+
+
+def get_compression_config():
+    return {**DEFAULT_COMPRESSION_CONFIG, **getattr(settings, 'DIAGRAM_COMPRESSION', {})}
+
+
+def accepted_encoding(header):
+    """'br', 'gzip' or None for an ``Accept-Encoding`` header, preferring brotli."""
+    accepted = {}
+    for part in (header or '').split(','):
+        match = _q_value.match(part)
+        if match:
+            try:
+                accepted[match.group(1).lower()] = float(match.group(2) or 1)
+            except ValueError:
+                continue
+    for encoding in (('br', 'gzip') if brotli is not None else ('gzip',)):
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body, encoding, config=None):
+    config = config or get_compression_config()
+    if encoding == 'br':
+        return brotli.compress(body, quality=config['BROTLI_QUALITY'])
+    return gzip.compress(body, compresslevel=config['GZIP_LEVEL'], mtime=0)
+
+
+class CompressedBodies:
+    """LRU of compressed bodies by (ETag, encoding), bounded by total size."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def set(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = body
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+
+_bodies = None
+_totals = {'responses': 0, 'reused': 0, 'bytes_in': 0, 'bytes_out': 0, 'cpu_seconds': 0.0}
+_totals_lock = threading.Lock()
+
+
+def _compressed_bodies(config):
+    global _bodies
+    if _bodies is None:
+        _bodies = CompressedBodies(config['CACHE_BYTES'])
+    return _bodies
+
+
+def compression_stats():
+    with _totals_lock:
+        stats = dict(_totals)
+    stats['ratio'] = stats['bytes_out'] / stats['bytes_in'] if stats['bytes_in'] else None
+    stats['brotli'] = brotli is not None
+    return stats
+
+
+def compress_response(request, response, config=None):
+    """Compress ``response`` in place when the client, content type and size allow it."""
+    config = config or get_compression_config()
+    if not config['ENABLED'] or response.streaming or response.status_code != 200:
+        return response
+    if response.has_header('Content-Encoding'):
+        return response
+    content_type = response.get('Content-Type', '').split(';')[0].strip()
+    if content_type not in config['CONTENT_TYPES']:
+        return response
+
+    patch_vary_headers(response, ('Accept-Encoding',))
+    body = response.content
+    if len(body) < config['MIN_BYTES']:
+        return response
+    encoding = accepted_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return response
+
+    etag = response.get('ETag')
+    key = (etag, encoding) if etag and not etag.startswith('W/') else None
+    started = time.process_time()
+    with stage("compress"):
+        compressed = _compressed_bodies(config).get(key) if key else None
+        reused = compressed is not None
+        if compressed is None:
+            compressed = compress(body, encoding, config)
+            if len(compressed) >= len(body):
+                return response
+            if key:
+                _compressed_bodies(config).set(key, compressed)
+    cpu = time.process_time() - started
+
+    with _totals_lock:
+        _totals['responses'] += 1
+        _totals['reused'] += reused
+        _totals['bytes_in'] += len(body)
+        _totals['bytes_out'] += len(compressed)
+        _totals['cpu_seconds'] += cpu
+
+    response.content = compressed
+    response['Content-Length'] = str(len(compressed))
+    response['Content-Encoding'] = encoding
+    if etag:
+        # Same rule as Django's GZipMiddleware: the encoded body is a different representation
+        response['ETag'] = etag if etag.startswith('W/') else 'W/' + etag
+    return response
+
+
+@sync_and_async_middleware
+def compression_middleware(get_response):
+    """Brotli/gzip for text responses (see :func:`compress_response`)."""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            return compress_response(request, await get_response(request))
+    else:
+        def middleware(request):
+            return compress_response(request, get_response(request))
+    return middleware
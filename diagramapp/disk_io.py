@@ -0,0 +1,81 @@
+import contextvars
+import io
+import tempfile
+import threading
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+
+DEFAULT_SPOOL_CONFIG = {
+    'MAX_MEMORY_BYTES': 16 * 1024 * 1024,  # response bodies above this stream from a temp file
+}
+
+# Bytes written to disk while serving the current request ([count] so copies share it)
+_request_bytes = contextvars.ContextVar('diagram_disk_bytes', default=None)
+
+_totals = {'requests': 0, 'requests_with_writes': 0, 'bytes_written': 0}
+_totals_lock = threading.Lock()
+
+
+def get_spool_config():
+    return {**DEFAULT_SPOOL_CONFIG, **getattr(settings, 'DIAGRAM_SPOOL', {})}
+
+
+def record_disk_write(nbytes):
+    """Count ``nbytes`` written to disk against the current request."""
+    counter = _request_bytes.get()
+    if counter is not None:
+        counter[0] += nbytes
+
+
+def spool_body(body):
+    """
+    File object streaming ``body`` to the client: a BytesIO, or a temp file
+    once the body exceeds ``DIAGRAM_SPOOL['MAX_MEMORY_BYTES']``.
+    """
+    if len(body) <= get_spool_config()['MAX_MEMORY_BYTES']:
+        return io.BytesIO(body)
+    spooled = tempfile.SpooledTemporaryFile(max_size=0)
+    spooled.write(body)
+    spooled.seek(0)
+    record_disk_write(len(body))
+    return spooled
+
+
+def disk_write_stats():
+    with _totals_lock:
+        stats = dict(_totals)
+    stats['avg_bytes_per_request'] = stats['bytes_written'] / stats['requests'] if stats['requests'] else 0.0
+    return stats
+
+
+def _start():
+    counter = [0]
+    return counter, _request_bytes.set(counter)
+
+
+def _finish(counter, token, response):
+    _request_bytes.reset(token)
+    with _totals_lock:
+        _totals['requests'] += 1
+        _totals['bytes_written'] += counter[0]
+        if counter[0]:
+            _totals['requests_with_writes'] += 1
+    response['X-Disk-Bytes-Written'] = str(counter[0])
+    return response
+
+
+@sync_and_async_middleware
+def disk_write_middleware(get_response):
+    """Meter disk writes per request (``X-Disk-Bytes-Written`` header and totals)."""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            counter, token = _start()
+            return _finish(counter, token, await get_response(request))
+    else:
+        def middleware(request):
+            counter, token = _start()
+            return _finish(counter, token, get_response(request))
+    return middleware
@@ -0,0 +1,320 @@
+import asyncio
+import atexit
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from .timing import stage
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXPORT_POOL_CONFIG = {
+    'ENABLED': True,
+    'SIZE': 2,               # warm Kaleido browsers
+    'MAX_RENDERS': 200,      # recycle a browser after this many exports
+    'QUEUE_TIMEOUT': 10.0,   # seconds to wait for an idle worker
+    'RENDER_TIMEOUT': 30.0,  # seconds allowed for a single export
+    'START_ON_BOOT': True,   # warm the pool from wsgi.py / asgi.py
+}
+
+
+class ExportPoolError(RuntimeError):
+    pass
+
+
+class ExportPoolTimeout(ExportPoolError, TimeoutError):
+    pass
+
+
+class ExportWorker:
+    """A single long-lived Kaleido (headless Chromium) session."""
+
+    def __init__(self, index, render_timeout):
+        self.index = index
+        self.render_timeout = render_timeout
+        self.kaleido = None
+        self.renders = 0
+        self.generation = 0
+        self.started_at = None
+
+    @property
+    def alive(self):
+        return self.kaleido is not None
+
+    async def start(self):
+        import kaleido
+
+        k = kaleido.Kaleido(n=1, timeout=self.render_timeout)
+        await k.open()
+        self.kaleido = k
+        self.renders = 0
+        self.generation += 1
+        self.started_at = time.time()
+
+    async def stop(self):
+        k, self.kaleido = self.kaleido, None
+        if k is None:
+            return
+        try:
+            await k.close()
+        except Exception:
+            logger.exception("Failed to close export worker %s", self.index)
+
+    async def export(self, fig_dict, opts):
+        if self.kaleido is None:
+            await self.start()
+        data = await self.kaleido.calc_fig(fig_dict, opts=opts)
+        self.renders += 1
+        return data
+
+
+class ExportPool:
+    """
+    Pool of warm Kaleido workers driven from one background event loop.
+
+    Requests borrow an idle worker (waiting at most ``queue_timeout``),
+    export, and hand it back. Workers are recycled after ``max_renders``
+    exports or as soon as an export fails, so a wedged browser never
+    serves a second request.
+    """
+
+    def __init__(self, size, max_renders, queue_timeout, render_timeout):
+        self.size = size
+        self.max_renders = max_renders
+        self.queue_timeout = queue_timeout
+        self.render_timeout = render_timeout
+        self.pid = os.getpid()
+
+        self.workers = [ExportWorker(i, render_timeout) for i in range(size)]
+        self.exports = 0
+        self.failures = 0
+        self.recycles = 0
+        self.timeouts = 0
+        self.waiting = 0
+        self.total_export_seconds = 0.0
+
+        self._loop = None
+        self._thread = None
+        self._idle = None
+        self._started = threading.Event()
+        self._lock = threading.Lock()
+
+    # --- lifecycle ---
+
+    def start(self, wait=True):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run_loop, name="diagram-export-pool", daemon=True)
+            self._thread.start()
+        self._started.wait()
+        future = asyncio.run_coroutine_threadsafe(self._start_workers(), self._loop)
+        if wait:
+            future.result()
+
+    def _run_loop(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._idle = asyncio.Queue()
+        self._started.set()
+        self._loop.run_forever()
+
+    async def _start_workers(self):
+        results = await asyncio.gather(*(w.start() for w in self.workers), return_exceptions=True)
+        for worker, result in zip(self.workers, results):
+            if isinstance(result, BaseException):
+                # Keep the slot; the worker retries its start on first use
+                logger.warning("Export worker %s failed to start: %s", worker.index, result)
+            await self._idle.put(worker)
+
+    def shutdown(self):
+        if self._loop is None:
+            return
+
+        async def _stop_all():
+            await asyncio.gather(*(w.stop() for w in self.workers), return_exceptions=True)
+
+        try:
+            asyncio.run_coroutine_threadsafe(_stop_all(), self._loop).result(timeout=10)
+        except Exception:
+            pass
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    # --- exporting ---
+
+    def export(self, fig, format="png", width=None, height=None, scale=None):
+        """Export a plotly figure (or figure dict) to image bytes."""
+        if not self.running:
+            self.start()
+        fig_dict, opts = self._request(fig, format, width, height, scale)
+
+        future = asyncio.run_coroutine_threadsafe(self._export(fig_dict, opts), self._loop)
+        try:
+            return future.result(timeout=self.queue_timeout + self.render_timeout + 5)
+        except TimeoutError:
+            future.cancel()
+            raise ExportPoolTimeout("Export did not finish in time")
+
+    @staticmethod
+    def _request(fig, format, width, height, scale):
+        fig_dict = fig.to_dict() if hasattr(fig, "to_dict") else fig
+        opts = {"format": format}
+        if width is not None:
+            opts["width"] = width
+        if height is not None:
+            opts["height"] = height
+        if scale is not None:
+            opts["scale"] = scale
+        return fig_dict, opts
+
+    async def export_async(self, fig, format="png", width=None, height=None, scale=None):
+        """Awaitable :meth:`export` for async views; the caller's loop is never blocked."""
+        if not self.running:
+            await asyncio.get_running_loop().run_in_executor(None, self.start)
+        fig_dict, opts = self._request(fig, format, width, height, scale)
+
+        future = asyncio.run_coroutine_threadsafe(self._export(fig_dict, opts), self._loop)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.queue_timeout + self.render_timeout + 5)
+        except asyncio.TimeoutError:
+            future.cancel()
+            raise ExportPoolTimeout("Export did not finish in time")
+
+    async def _export(self, fig_dict, opts):
+        self.waiting += 1
+        try:
+            worker = await asyncio.wait_for(self._idle.get(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise ExportPoolTimeout(f"No idle export worker within {self.queue_timeout}s")
+        finally:
+            self.waiting -= 1
+
+        started = time.perf_counter()
+        try:
+            data = await asyncio.wait_for(worker.export(fig_dict, opts), self.render_timeout)
+        except BaseException:
+            self.failures += 1
+            await self._recycle(worker)
+            raise
+        else:
+            self.exports += 1
+            self.total_export_seconds += time.perf_counter() - started
+            if worker.renders >= self.max_renders:
+                await self._recycle(worker)
+            return data
+        finally:
+            self._idle.put_nowait(worker)
+
+    async def _recycle(self, worker):
+        self.recycles += 1
+        await worker.stop()
+        try:
+            await worker.start()
+        except Exception as e:
+            logger.warning("Export worker %s failed to restart: %s", worker.index, e)
+
+    # --- health ---
+
+    def stats(self):
+        idle = self._idle.qsize() if self._idle is not None else 0
+        alive = sum(1 for w in self.workers if w.alive)
+        return {
+            'status': 'ok' if self.running and alive == self.size else ('degraded' if self.running else 'stopped'),
+            'pid': self.pid,
+            'size': self.size,
+            'alive': alive,
+            'idle': idle,
+            'busy': self.size - idle if self.running else 0,
+            'waiting': self.waiting,
+            'exports': self.exports,
+            'failures': self.failures,
+            'recycles': self.recycles,
+            'timeouts': self.timeouts,
+            'avg_export_ms': (self.total_export_seconds / self.exports * 1000) if self.exports else None,
+            'workers': [
+                {'index': w.index, 'alive': w.alive, 'renders': w.renders, 'generation': w.generation,
+                 'started_at': w.started_at}
+                for w in self.workers
+            ],
+        }
+
+
+def get_export_pool_config():
+    return {**DEFAULT_EXPORT_POOL_CONFIG, **getattr(settings, 'DIAGRAM_EXPORT_POOL', {})}
+
+
+_export_pool = None
+_export_pool_lock = threading.Lock()
+
+
+def get_export_pool():
+    """Process-wide export pool, or None when disabled in settings."""
+    global _export_pool
+    config = get_export_pool_config()
+    if not config['ENABLED']:
+        return None
+    with _export_pool_lock:
+        # A forked worker inherits the object but not the loop thread
+        if _export_pool is None or _export_pool.pid != os.getpid():
+            _export_pool = ExportPool(
+                size=config['SIZE'],
+                max_renders=config['MAX_RENDERS'],
+                queue_timeout=config['QUEUE_TIMEOUT'],
+                render_timeout=config['RENDER_TIMEOUT'],
+            )
+    return _export_pool
+
+
+def warm_up(wait=False):
+    """Start the export pool at boot so the first request finds warm browsers; ``wait`` for them to open."""
+    config = get_export_pool_config()
+    if not (config['ENABLED'] and config['START_ON_BOOT']):
+        return
+    pool = get_export_pool()
+    try:
+        pool.start(wait=wait)
+    except Exception:
+        logger.exception("Could not start the export pool")
+
+
+def export_figure(fig, format="png", width=None, height=None):
+    """
+    Export through the warm pool, or plotly's one-shot export when the pool
+    is disabled. Figure dicts are exported as they are, without validation.
+    """
+    with stage("export"):
+        pool = get_export_pool()
+        if pool is not None:
+            return pool.export(fig, format=format, width=width, height=height)
+        if isinstance(fig, dict):
+            import plotly.io as pio
+
+            return pio.to_image(fig, format=format, width=width, height=height, validate=False)
+        return fig.to_image(format=format, width=width, height=height)
+
+
+async def export_figure_async(fig, format="png", width=None, height=None):
+    """Async :func:`export_figure`; the one-shot fallback runs on a thread."""
+    with stage("export"):
+        pool = get_export_pool()
+        if pool is not None:
+            return await pool.export_async(fig, format=format, width=width, height=height)
+        import plotly.io as pio
+
+        return await asyncio.to_thread(pio.to_image, fig, format=format, width=width, height=height)
+
+
+@atexit.register
+def _shutdown_pool():
+    if _export_pool is not None and _export_pool.pid == os.getpid():
+        _export_pool.shutdown()
@@ -0,0 +1,119 @@
+"""
+/api/diagram: the plotly figure of a netlist, as PNG (exported on the warm
+Kaleido pool) or as plotly JSON.
+"""
+from rest_framework.views import APIView
+from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
+from rest_framework.response import Response
+from rest_framework import status
+from .serializer import validate_upload
+from .circuit_generator import DynamicCircuitDiagram, FIGURE_FORMATS
+from .render_cache import get_render_cache
+from .export_pool import export_figure
+from .ingest import IngestError, netlist_payload
+from .timing import stage
+from .metrics import annotate
+from .jobs import offload_if_large
+
+
+class GenerateCircuitDiagramView(APIView):
+    parser_classes = [MultiPartParser, FormParser, JSONParser]
+    endpoint = 'diagram'
+    formats = FIGURE_FORMATS
+    # imported inside methods; startup.preload() loads them ahead of the first request
+    deferred_imports = ("plotly.io",)
+
+    def post(self, request):
+        serializer = validate_upload(request.data)
+        if serializer.errors:
+            return Response({
+                'error': 'Invalid file',
+                'details': serializer.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        params = {'trace_mode': serializer.validated_data['trace_mode'],
+                  'out_format': serializer.validated_data['format'],
+                  'figure_bytes': serializer.validated_data['figure_bytes']}
+        annotate(self.endpoint, params['out_format'])
+        data, fmt = netlist_payload(request)
+
+        render_cache = get_render_cache()
+        cache_key = self.cache_key(data, fmt, **params)
+        cached = render_cache.lookup(request, cache_key)
+        if cached is not None:
+            return cached
+
+        offloaded = offload_if_large(request, self.endpoint, data, fmt, params, cache_key)
+        if offloaded is not None:
+            return offloaded
+
+        try:
+            body, content_type, headers = self.render(data, fmt, **params)
+            # PNGs are streamed; JSON stays a plain response so it can be compressed
+            return render_cache.store(cache_key, body, content_type, headers, stream=params['out_format'] == "png")
+
+        except IngestError as e:
+            return Response({
+                'error': 'Invalid file',
+                'message': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        except Exception as e:
+            return Response({
+                'error': 'Processing failed',
+                'message': str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    def cache_key(self, data, fmt, trace_mode="segments", out_format="png", figure_bytes=False):
+        # Only a PNG's headers change with figure_bytes; keys without it stay as they were
+        extra = {'figure_bytes': True} if figure_bytes and out_format == "png" else {}
+        return get_render_cache().make_key(data, endpoint=self.endpoint, format=out_format, width=1000, height=800,
+                                           trace_mode=trace_mode, input_format=fmt, **extra)
+
+    def render(self, data, fmt, trace_mode="segments", out_format="png", figure_bytes=False):
+        """
+        Render a netlist to PNG or plotly JSON; returns ``(body, content_type, headers)``.
+        ``figure_bytes`` serializes a PNG's figure as well, to report its JSON size.
+        """
+        fig = self.build_figure(data, fmt, trace_mode=trace_mode)
+        if out_format == "json":
+            # The client draws it with plotly.js; no export at all
+            fig_json = self.figure_json(fig)
+            return fig_json, "application/json", self.figure_headers(fig, fig_json)
+
+        # Export PNG on a warm Kaleido worker
+        image = export_figure(fig, format="png", width=1000, height=800)
+        return image, "image/png", self.figure_headers(fig, self.figure_json(fig) if figure_bytes else None,
+                                                        attachment=True)
+
+    def build_figure(self, data, fmt, trace_mode="segments"):
+        # Generate figure straight from the in-memory upload
+        generator = DynamicCircuitDiagram(trace_mode=trace_mode)
+        fig = generator.generate_diagram(data, fmt=fmt)
+
+        if fig is None:
+            raise RuntimeError('Failed to generate diagram, please check your Excel file format')
+        return fig
+
+    @staticmethod
+    def figure_json(fig):
+        """Plotly JSON of a figure or figure dict, serialized by orjson."""
+        import plotly.io as pio
+
+        with stage("serialize"):
+            return pio.to_json(fig, validate=False, engine="orjson").encode("utf-8")
+
+    @staticmethod
+    def figure_headers(fig, fig_json=None, attachment=False):
+        """
+        Response headers for a figure, or a figure dict as built by revisions.py.
+        Its size is reported when its JSON is passed (the body of a JSON
+        response; a PNG only serializes it on request); ``attachment`` names
+        the PNG download.
+        """
+        headers = {"X-Trace-Count": str(len(fig["data"] if isinstance(fig, dict) else fig.data))}
+        if fig_json is not None:
+            headers["X-Figure-Bytes"] = str(len(fig_json))
+        if attachment:
+            headers["Content-Disposition"] = 'attachment; filename="circuit_diagram.png"'
+        return headers
@@ -0,0 +1,238 @@
+"""
+Built-in top-to-bottom flowchart renderer for the Mermaid endpoint.
+
+Takes the node/edge graph the Mermaid view builds, lays it out in ranks
+(longest-path layering with back edges ignored, barycenter ordering from
+layered.py) and draws it as SVG, or as PNG/JPEG through Pillow, without
+Node or mmdc.
+"""
+import io
+import shutil
+from collections import defaultdict
+from xml.sax.saxutils import escape, quoteattr
+
+from django.conf import settings
+
+from .layered import is_dummy, order_layers, proper_graph
+
+
+DEFAULT_FLOWCHART_CONFIG = {
+    'ENGINE': 'auto',   # 'auto' (mmdc when installed), 'builtin' or 'mmdc' for png/jpg output
+    'FONT_SIZE': 14,
+    'RANK_GAP': 60,     # vertical space between ranks
+    'NODE_GAP': 30,     # horizontal space between boxes in a rank
+    'PADDING': 12,      # space around a label inside its box
+    'MARGIN': 20,
+    'SWEEPS': 4,        # at most this many barycenter passes (each one down + one up)
+}
+
+FONT_FAMILY = "trebuchet ms, verdana, arial, sans-serif"
+EDGE_COLOR = "#333333"
+
+
+def get_flowchart_config():
+    return {**DEFAULT_FLOWCHART_CONFIG, **getattr(settings, 'DIAGRAM_FLOWCHART', {})}
+
+
+def use_builtin_renderer():
+    """Whether png/jpg output is drawn here instead of by Mermaid (mmdc or the warm pool)."""
+    engine = get_flowchart_config()['ENGINE']
+    if engine == 'auto':
+        from .mermaid_pool import get_mermaid_pool
+
+        return get_mermaid_pool() is None and not (shutil.which("mmdc") or shutil.which("mmdc.cmd"))
+    return engine == 'builtin'
+
+
+class Box:
+    __slots__ = ('id', 'label', 'cls', 'rank', 'order', 'x', 'y', 'width', 'height')
+
+    def __init__(self, id, label, cls):
+        self.id = id
+        self.label = label
+        self.cls = cls
+        self.rank = 0
+        self.order = 0
+        self.x = self.y = 0.0
+        self.width = self.height = 0.0
+
+
+class Flowchart:
+    """A laid-out diagram: boxes with centre coordinates plus directed edges."""
+
+    def __init__(self, boxes, edges, width, height, styles, font_size):
+        self.boxes = boxes      # {id: Box}
+        self.edges = edges      # [(src_id, dst_id)]
+        self.width = width
+        self.height = height
+        self.styles = styles    # {cls: (fill, stroke, color)}
+        self.font_size = font_size
+
+    def edge_points(self, src, dst):
+        """Start and end of an edge, clipped to the box borders."""
+        a, b = self.boxes[src], self.boxes[dst]
+        if a.rank < b.rank:
+            return (a.x, a.y + a.height / 2), (b.x, b.y - b.height / 2)
+        if a.rank > b.rank:
+            return (a.x, a.y - a.height / 2), (b.x, b.y + b.height / 2)
+        side = 1 if b.x > a.x else -1
+        return (a.x + side * a.width / 2, a.y), (b.x - side * b.width / 2, b.y)
+
+
+def _ranks(ids, successors):
+    """Longest-path rank per node, ignoring the edges that close cycles."""
+    state = dict.fromkeys(ids, 0)  # 0 new, 1 on stack, 2 done
+    order = []
+    back = set()
+    for root in ids:
+        if state[root]:
+            continue
+        state[root] = 1
+        stack = [(root, iter(successors[root]))]
+        while stack:
+            node, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                state[node] = 2
+                order.append(node)
+                stack.pop()
+            elif state[child] == 0:
+                state[child] = 1
+                stack.append((child, iter(successors[child])))
+            elif state[child] == 1:
+                back.add((node, child))
+
+    rank = dict.fromkeys(ids, 0)
+    for node in reversed(order):  # topological order of the acyclic part
+        for child in successors[node]:
+            if (node, child) not in back and rank[child] < rank[node] + 1:
+                rank[child] = rank[node] + 1
+    return rank
+
+
+def text_width(text, font_size):
+    # Average glyph width of the sans-serif fonts Mermaid uses
+    return len(text) * font_size * 0.6
+
+
+def layout(nodes, edges, styles, config=None):
+    """
+    Lay out ``nodes`` ([(id, label, cls)]) and ``edges`` ([(src_id, dst_id)])
+    top to bottom. Returns a :class:`Flowchart`.
+    """
+    config = {**get_flowchart_config(), **(config or {})}
+    font_size = config['FONT_SIZE']
+    padding = config['PADDING']
+
+    boxes = {}
+    for id, label, cls in nodes:
+        boxes.setdefault(id, Box(id, label, cls))
+    edges = [(a, b) for a, b in edges if a in boxes and b in boxes]
+
+    successors = {id: [] for id in boxes}
+    for a, b in edges:
+        successors[a].append(b)
+
+    rank = _ranks(list(boxes), successors)
+    layers_of = defaultdict(list)
+    for id in boxes:
+        layers_of[rank[id]].append(id)
+    up, down = proper_graph(layers_of, dict(rank), edges)
+    layers = [layers_of[r] for r in range(max(rank.values(), default=-1) + 1)]
+    order_layers(layers, up, down, method="barycenter", iterations=config['SWEEPS'])
+    layers = [[id for id in layer if not is_dummy(id)] for layer in layers]
+
+    box_height = font_size + 2 * padding
+    for box in boxes.values():
+        box.width = max(text_width(box.label, font_size) + 2 * padding, 2 * box_height)
+        box.height = box_height
+
+    layer_widths = [sum(boxes[id].width for id in layer) + config['NODE_GAP'] * (len(layer) - 1)
+                    for layer in layers]
+    inner_width = max(layer_widths, default=0)
+    for r, layer in enumerate(layers):
+        x = config['MARGIN'] + (inner_width - layer_widths[r]) / 2
+        y = config['MARGIN'] + r * (box_height + config['RANK_GAP']) + box_height / 2
+        for i, id in enumerate(layer):
+            box = boxes[id]
+            box.rank, box.order = r, i
+            box.x, box.y = x + box.width / 2, y
+            x += box.width + config['NODE_GAP']
+
+    width = inner_width + 2 * config['MARGIN']
+    height = (len(layers) * box_height + max(len(layers) - 1, 0) * config['RANK_GAP']
+              + 2 * config['MARGIN'])
+    return Flowchart(boxes, edges, width, height, styles, font_size)
+
+
+def _fmt(value):
+    return f"{value:.1f}".rstrip("0").rstrip(".")
+
+
+def render_svg(chart):
+    """The flowchart as a standalone SVG document (bytes)."""
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{_fmt(chart.width)}" height="{_fmt(chart.height)}" '
+        f'viewBox="0 0 {_fmt(chart.width)} {_fmt(chart.height)}">',
+        '<defs><marker id="arrow" viewBox="0 0 10 10" refX="9" refY="5" markerWidth="8" markerHeight="8" '
+        f'orient="auto-start-reverse"><path d="M0,0 L10,5 L0,10 z" fill="{EDGE_COLOR}"/></marker></defs>',
+        f'<g stroke="{EDGE_COLOR}" stroke-width="1.5" fill="none" marker-end="url(#arrow)">',
+    ]
+    for src, dst in chart.edges:
+        (x0, y0), (x1, y1) = chart.edge_points(src, dst)
+        parts.append(f'<line x1="{_fmt(x0)}" y1="{_fmt(y0)}" x2="{_fmt(x1)}" y2="{_fmt(y1)}"/>')
+    parts.append('</g>')
+
+    parts.append(f'<g font-family={quoteattr(FONT_FAMILY)} font-size="{chart.font_size}" text-anchor="middle" '
+                 'dominant-baseline="central">')
+    for box in chart.boxes.values():
+        fill, stroke, color = chart.styles.get(box.cls, chart.styles.get("other"))
+        parts.append(
+            f'<g class="node cls_{escape(box.cls)}" id={quoteattr(box.id)}>'
+            f'<rect x="{_fmt(box.x - box.width / 2)}" y="{_fmt(box.y - box.height / 2)}" '
+            f'width="{_fmt(box.width)}" height="{_fmt(box.height)}" rx="3" fill="{fill}" stroke="{stroke}"/>'
+            f'<text x="{_fmt(box.x)}" y="{_fmt(box.y)}" fill="{color}">{escape(box.label)}</text></g>'
+        )
+    parts.append('</g></svg>')
+    return "".join(parts).encode("utf-8")
+
+
+def render_raster(chart, format="png", scale=1.0):
+    """The flowchart as PNG (transparent background) or JPEG (white) bytes, drawn with Pillow."""
+    import math
+
+    from PIL import Image, ImageDraw, ImageFont
+
+    size = (max(int(math.ceil(chart.width * scale)), 1), max(int(math.ceil(chart.height * scale)), 1))
+    if format == "png":
+        image = Image.new("RGBA", size, (255, 255, 255, 0))
+    else:
+        image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    try:
+        font = ImageFont.load_default(size=chart.font_size * scale)
+    except TypeError:  # Pillow < 10.1 has a single bitmap default font
+        font = ImageFont.load_default()
+
+    head = 8 * scale
+    for src, dst in chart.edges:
+        (x0, y0), (x1, y1) = chart.edge_points(src, dst)
+        x0, y0, x1, y1 = x0 * scale, y0 * scale, x1 * scale, y1 * scale
+        draw.line([(x0, y0), (x1, y1)], fill=EDGE_COLOR, width=max(int(round(1.5 * scale)), 1))
+        angle = math.atan2(y1 - y0, x1 - x0)
+        draw.polygon([
+            (x1, y1),
+            (x1 - head * math.cos(angle - 0.4), y1 - head * math.sin(angle - 0.4)),
+            (x1 - head * math.cos(angle + 0.4), y1 - head * math.sin(angle + 0.4)),
+        ], fill=EDGE_COLOR)
+
+    for box in chart.boxes.values():
+        fill, stroke, color = chart.styles.get(box.cls, chart.styles.get("other"))
+        left, top = (box.x - box.width / 2) * scale, (box.y - box.height / 2) * scale
+        draw.rounded_rectangle([left, top, left + box.width * scale, top + box.height * scale],
+                               radius=3 * scale, fill=fill, outline=stroke)
+        draw.text((box.x * scale, box.y * scale), box.label, fill=color, font=font, anchor="mm")
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG" if format == "png" else "JPEG", quality=90)
+    return buffer.getvalue()
@@ -0,0 +1,425 @@
+import io
+import os
+import pickle
+import zipfile
+
+import pandas as pd
+from django.conf import settings
+from pandas.io.parsers import TextParser
+
+from .timing import timed
+
+
+DEFAULT_INGEST_CONFIG = {
+    'MAX_ROWS': 100_000,
+    'MAX_COLUMNS': 64,
+}
+
+
+# Upload formats by file extension
+FORMATS = {
+    '.xlsx': 'excel',
+    '.xls': 'excel',
+    '.csv': 'csv',
+    '.parquet': 'parquet',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+    '.json': 'json',
+}
+
+
+class IngestError(ValueError):
+    """The uploaded table is malformed or exceeds the configured limits."""
+
+
+def detect_format(filename):
+    """Netlist format for an uploaded file name (Excel when unknown)."""
+    ext = os.path.splitext(str(filename or ""))[1].lower()
+    return FORMATS.get(ext, 'excel')
+
+
+def get_ingest_config():
+    return {**DEFAULT_INGEST_CONFIG, **getattr(settings, 'DIAGRAM_INGEST', {})}
+
+
+def _as_buffer(source):
+    """Accept a path, raw bytes or a (Django) file object."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    if isinstance(source, (str, os.PathLike)):
+        return open(source, "rb")
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return source
+
+
+def _is_xlsx(buffer):
+    head = buffer.read(4)
+    buffer.seek(0)
+    return head == b"PK\x03\x04"
+
+
+def _convert_cell(value):
+    # Same cell conversion pandas applies for openpyxl workbooks
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _kept_columns(names, columns):
+    """Indices of the first occurrence of every wanted column name."""
+    if columns is None:
+        return list(range(len(names)))
+    wanted = set(columns)
+    seen = set()
+    keep = []
+    for i, name in enumerate(names):
+        if name in wanted and name not in seen:
+            keep.append(i)
+            seen.add(name)
+    return keep
+
+
+def _sheet_rows(ws, columns, max_rows, max_columns):
+    """
+    Stream one read-only worksheet row by row, keeping only the projected
+    cells of each row. Returns header + data rows in the shape pandas'
+    TextParser expects.
+    """
+    ws.reset_dimensions()
+    rows = ws.iter_rows(values_only=True)
+
+    header = list(next(rows, ()))
+    while header and header[-1] is None:
+        header.pop()
+    if max_columns is not None and len(header) > max_columns:
+        raise IngestError(f"Sheet has {len(header)} columns, limit is {max_columns}")
+
+    names = [_convert_cell(v) for v in header]
+    keep = _kept_columns(names, columns)
+
+    data = [[names[i] for i in keep]]
+    blank_run = 0
+    for row in rows:
+        if not any(v is not None for v in row):
+            # Only materialised if more data follows: pandas trims trailing empty rows
+            blank_run += 1
+            continue
+        if max_rows is not None and len(data) + blank_run > max_rows:
+            raise IngestError(f"Sheet has more than {max_rows} rows")
+        data.extend([""] * len(keep) for _ in range(blank_run))
+        blank_run = 0
+        width = len(row)
+        data.append([_convert_cell(row[i]) if i < width else "" for i in keep])
+    return data
+
+
+def _stream_xlsx(buffer, columns, max_rows, max_columns):
+    """The first sheet of a workbook, streamed in openpyxl read-only mode (see :func:`_sheet_rows`)."""
+    from openpyxl import load_workbook
+
+    wb = load_workbook(buffer, read_only=True, data_only=True, keep_links=False)
+    try:
+        return _sheet_rows(wb.worksheets[0], columns, max_rows, max_columns)
+    finally:
+        wb.close()
+
+
+def _rows_frame(data):
+    if len(data) == 1:
+        return pd.DataFrame(columns=data[0])
+    return TextParser(data, header=0, skip_blank_lines=False).read()
+
+
+def _read_excel(buffer, columns, max_rows, max_columns):
+    if _is_xlsx(buffer):
+        return _rows_frame(_stream_xlsx(buffer, columns, max_rows, max_columns))
+
+    # Legacy .xls: no streaming reader, fall back to pandas with projection
+    wanted = None if columns is None else set(columns)
+    usecols = None if wanted is None else (lambda name: name in wanted)
+    df = pd.read_excel(buffer, usecols=usecols, nrows=max_rows + 1 if max_rows else None)
+    if max_rows is not None and len(df) > max_rows:
+        raise IngestError(f"Sheet has more than {max_rows} rows")
+    return df
+
+
+def _has_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _read_csv(buffer, columns, max_rows, max_columns):
+    header = pd.read_csv(buffer, nrows=0).columns
+    buffer.seek(0)
+    if max_columns is not None and len(header) > max_columns:
+        raise IngestError(f"Table has {len(header)} columns, limit is {max_columns}")
+    usecols = None if columns is None else [c for c in header if c in set(columns)]
+    if _has_pyarrow():
+        # Multithreaded Arrow parser; it has no nrows, the limit is checked after
+        df = _read_arrow_csv(buffer, header, usecols)
+    else:
+        # The C parser streams in chunks and stops at nrows
+        df = pd.read_csv(buffer, usecols=usecols, nrows=max_rows + 1 if max_rows else None)
+    if max_rows is not None and len(df) > max_rows:
+        raise IngestError(f"Table has more than {max_rows} rows")
+    return df
+
+
+def _read_arrow_csv(buffer, header, usecols):
+    """
+    The Arrow parser with the C parser's typing: Arrow's own inference reads
+    hex cells such as ``0x25`` (I2C addresses) as numbers, so every column is
+    read as text and a column only becomes numeric when all its cells parse
+    as decimal numbers.
+    """
+    from pyarrow import csv, string
+
+    names = list(header)
+    table = csv.read_csv(
+        buffer,
+        read_options=csv.ReadOptions(column_names=names, skip_rows=1),
+        convert_options=csv.ConvertOptions(include_columns=usecols, column_types={c: string() for c in names},
+                                           strings_can_be_null=True),
+    )
+    df = table.to_pandas()
+    for c in df.columns:
+        try:
+            df[c] = pd.to_numeric(df[c])
+        except (ValueError, TypeError):
+            pass
+    return df
+
+
+def _read_parquet(buffer, columns, max_rows, max_columns):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise IngestError("Parquet uploads require pyarrow to be installed")
+
+    pf = pq.ParquetFile(buffer)
+    names = pf.schema_arrow.names
+    if max_columns is not None and len(names) > max_columns:
+        raise IngestError(f"Table has {len(names)} columns, limit is {max_columns}")
+    if max_rows is not None and pf.metadata.num_rows > max_rows:
+        raise IngestError(f"Table has more than {max_rows} rows")
+    # Columnar format: only the projected columns are ever decoded
+    keep = None if columns is None else [c for c in names if c in set(columns)]
+    return pf.read(columns=keep).to_pandas()
+
+
+def _rows_to_frame(rows, columns, max_rows, max_columns):
+    if max_rows is not None and len(rows) > max_rows:
+        raise IngestError(f"Table has more than {max_rows} rows")
+    present = {}
+    for row in rows:
+        if not isinstance(row, dict):
+            raise IngestError("Each row must be a JSON object")
+        present.update(dict.fromkeys(row))
+    if max_columns is not None and len(present) > max_columns:
+        raise IngestError(f"Table has {len(present)} columns, limit is {max_columns}")
+    keep = [c for c in present if columns is None or c in set(columns)]
+    return pd.DataFrame.from_records(rows, columns=keep)
+
+
+def _read_jsonl(buffer, columns, max_rows, max_columns):
+    rows = []
+    wanted = None if columns is None else set(columns)
+    for line in buffer:
+        if not line.strip():
+            continue
+        row = _json_loads(line)
+        if wanted is not None and isinstance(row, dict):
+            row = {k: v for k, v in row.items() if k in wanted}
+        rows.append(row)
+        if max_rows is not None and len(rows) > max_rows:
+            raise IngestError(f"Table has more than {max_rows} rows")
+    return _rows_to_frame(rows, columns, max_rows, max_columns)
+
+
+def _read_json(buffer, columns, max_rows, max_columns):
+    rows = _json_loads(buffer.read())
+    if isinstance(rows, dict):
+        rows = rows.get("rows")
+    if not isinstance(rows, list):
+        raise IngestError('JSON netlist must be a list of rows or {"rows": [...]}')
+    return _rows_to_frame(rows, columns, max_rows, max_columns)
+
+
+def _read_sheet(buffer, columns, max_rows, max_columns):
+    # Rows extracted by Workbook.sheet(); limits were applied while streaming them
+    data = pickle.load(buffer)
+    keep = _kept_columns(data[0], columns)
+    return _rows_frame([[row[i] for i in keep] for row in data])
+
+
+def _json_loads(data):
+    try:
+        import orjson
+    except ImportError:
+        import json
+        return json.loads(data)
+    return orjson.loads(data)
+
+
+READERS = {
+    'excel': _read_excel,
+    'csv': _read_csv,
+    'parquet': _read_parquet,
+    'jsonl': _read_jsonl,
+    'json': _read_json,
+    # Internal: one sheet of a workbook split by Workbook (never an upload format)
+    'sheet': _read_sheet,
+}
+
+
+class Workbook:
+    """
+    An uploaded .xlsx opened once in read-only mode, handing out its sheets
+    one at a time as ``'sheet'`` payloads. A payload reads back through
+    :func:`read_netlist` exactly like that sheet uploaded on its own, so
+    shared strings and the archive are parsed once for the whole workbook.
+    """
+
+    def __init__(self, source):
+        from openpyxl import load_workbook
+
+        buffer = _as_buffer(source)
+        if not _is_xlsx(buffer):
+            raise IngestError("Batch rendering needs an .xlsx workbook")
+        try:
+            self._wb = load_workbook(buffer, read_only=True, data_only=True, keep_links=False)
+        except (ValueError, KeyError, TypeError, OSError, zipfile.BadZipFile) as e:
+            raise IngestError(f"Could not read excel workbook: {e}") from e
+
+    @property
+    def sheet_names(self):
+        return list(self._wb.sheetnames)
+
+    def sheet(self, name, max_rows=None, max_columns=None):
+        """``(payload, rows)`` of one sheet: every column, limits enforced while streaming."""
+        config = get_ingest_config()
+        max_rows = config['MAX_ROWS'] if max_rows is None else max_rows
+        max_columns = config['MAX_COLUMNS'] if max_columns is None else max_columns
+        data = _sheet_rows(self._wb[name], None, max_rows, max_columns)
+        return pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL), len(data) - 1
+
+    def close(self):
+        self._wb.close()
+
+
+def compact_dtypes(df, categoricals):
+    """Store low-cardinality text columns as categoricals."""
+    for name in categoricals:
+        if name in df.columns and df[name].dtype == object:
+            df[name] = df[name].astype("category")
+    return df
+
+
+def read_netlist(source, columns=None, categoricals=(), max_rows=None, max_columns=None, fmt='excel'):
+    """
+    Read an uploaded netlist (first sheet of a workbook, or a CSV, Parquet,
+    JSON-lines or JSON table) into a DataFrame.
+
+    Only ``columns`` are materialised (absent ones are simply missing from
+    the result) and row/column limits are enforced while streaming, so
+    memory tracks the projected table rather than the whole workbook.
+    For Excel, values and dtypes match ``pd.read_excel`` for the kept columns.
+    """
+    if fmt not in READERS:
+        raise IngestError(f"Unsupported netlist format: {fmt!r}")
+    config = get_ingest_config()
+    max_rows = config['MAX_ROWS'] if max_rows is None else max_rows
+    max_columns = config['MAX_COLUMNS'] if max_columns is None else max_columns
+
+    buffer = _as_buffer(source)
+    opened_here = isinstance(source, (str, os.PathLike))
+    try:
+        df = READERS[fmt](buffer, columns, max_rows, max_columns)
+    except IngestError:
+        raise
+    except (ValueError, KeyError, TypeError, OSError) as e:
+        raise IngestError(f"Could not read {fmt} netlist: {e}") from e
+    finally:
+        if opened_here:
+            buffer.close()
+
+    return compact_dtypes(df, categoricals)
+
+
+def count_rows(source, fmt='excel'):
+    """
+    Cheap upper bound on the number of data rows, without parsing cells:
+    the sheet dimension for workbooks, line counts for text formats and
+    footer metadata for Parquet. Unreadable input counts as 0 so the
+    regular reader reports the error.
+    """
+    buffer = _as_buffer(source)
+    try:
+        if fmt == 'excel' and _is_xlsx(buffer):
+            from openpyxl import load_workbook
+
+            wb = load_workbook(buffer, read_only=True, keep_links=False)
+            try:
+                return max((wb.worksheets[0].max_row or 1) - 1, 0)
+            finally:
+                wb.close()
+        if fmt == 'csv':
+            data = buffer.read()
+            return max(data.count(b"\n") - (1 if data.endswith(b"\n") else 0), 0)
+        if fmt == 'jsonl':
+            return sum(1 for line in buffer if line.strip())
+        if fmt == 'parquet':
+            import pyarrow.parquet as pq
+            return pq.ParquetFile(buffer).metadata.num_rows
+        if fmt == 'json':
+            rows = _json_loads(buffer.read())
+            rows = rows.get("rows") if isinstance(rows, dict) else rows
+            return len(rows) if isinstance(rows, list) else 0
+    except Exception:
+        return 0
+    return 0
+
+
+def _json_body(request):
+    # Plain Django requests (async views) carry no parsed ``data``
+    if request.content_type != "application/json" or not request.body:
+        return None
+    try:
+        return _json_loads(request.body)
+    except ValueError:
+        raise IngestError("Request body is not valid JSON")
+
+
+@timed("upload")
+def netlist_payload(request):
+    """
+    The netlist carried by a request, as ``(bytes, format)``: either the
+    uploaded ``file`` or rows posted inline as a JSON body
+    (``[{...}, ...]`` or ``{"rows": [...]}``). Returns ``(None, None)``
+    when the request has neither.
+    """
+    upload = request.FILES.get("file")
+    if upload is not None:
+        if hasattr(upload, "temporary_file_path"):
+            # Django spooled it to disk (above FILE_UPLOAD_MAX_MEMORY_SIZE)
+            from .disk_io import record_disk_write
+            record_disk_write(upload.size)
+        return b"".join(upload.chunks()), detect_format(upload.name)
+
+    rows = request.data if hasattr(request, "data") else _json_body(request)
+    if isinstance(rows, dict):
+        rows = rows.get("rows")
+    if isinstance(rows, list):
+        try:
+            import orjson
+            return orjson.dumps(rows), 'json'
+        except ImportError:
+            import json
+            return json.dumps(rows).encode("utf-8"), 'json'
+    return None, None
@@ -0,0 +1,457 @@
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from multiprocessing.connection import wait
+
+from django.conf import settings
+
+from .disk_io import record_disk_write
+from .metrics import _is_running
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOBS_CONFIG = {
+    'LOCATION': os.path.join(tempfile.gettempdir(), 'diagram_jobs'),
+    'WORKERS': 2,             # concurrent render processes
+    'TIMEOUT': 300,           # seconds a single job may run
+    'RESULT_TTL': 3600,       # seconds a finished job (and its result) is kept
+    'OFFLOAD_ROWS': 5000,     # sync endpoints hand inputs above this row count to a job; None disables
+}
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+def get_jobs_config():
+    return {**DEFAULT_JOBS_CONFIG, **getattr(settings, 'DIAGRAM_JOBS', {})}
+
+
+class JobStore:
+    """
+    Filesystem job store shared by every server process. Each job is a
+    directory holding ``job.json`` (state), ``input.bin`` and, once
+    finished, ``result.bin``. Cancellation is requested by dropping a
+    ``cancel`` marker, so any process can cancel a job another one runs.
+    ``owner`` is the pid of the server process whose queue holds the job
+    (or whose worker runs it), so others can tell when it is orphaned.
+    """
+
+    def __init__(self, location):
+        self.location = str(location)
+        os.makedirs(self.location, exist_ok=True)
+
+    def _dir(self, job_id):
+        # ids are uuid4 hex; never let a crafted id escape the store
+        if not job_id or not all(c in '0123456789abcdef' for c in job_id):
+            raise KeyError(job_id)
+        return os.path.join(self.location, job_id)
+
+    def _write_json(self, job_id, job):
+        path = os.path.join(self._dir(job_id), 'job.json')
+        fd, tmp_path = tempfile.mkstemp(dir=self._dir(job_id), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(job, f)
+        os.replace(tmp_path, path)
+
+    def create(self, endpoint, data, fmt, params, cache_key=None, owner=None):
+        job_id = uuid.uuid4().hex
+        os.makedirs(self._dir(job_id))
+        with open(os.path.join(self._dir(job_id), 'input.bin'), 'wb') as f:
+            f.write(data)
+        record_disk_write(len(data))
+        job = {
+            'id': job_id,
+            'endpoint': endpoint,
+            'input_format': fmt,
+            'params': params,
+            'cache_key': cache_key,
+            'status': QUEUED,
+            'owner': owner,
+            'created': time.time(),
+            'started': None,
+            'finished': None,
+            'error': None,
+            'content_type': None,
+            'headers': {},
+        }
+        self._write_json(job_id, job)
+        return job
+
+    def get(self, job_id):
+        try:
+            with open(os.path.join(self._dir(job_id), 'job.json')) as f:
+                job = json.load(f)
+        except (KeyError, OSError, ValueError):
+            return None
+        job['cancel_requested'] = os.path.exists(os.path.join(self._dir(job_id), 'cancel'))
+        return job
+
+    def update(self, job_id, **fields):
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.pop('cancel_requested', None)
+        job.update(fields)
+        self._write_json(job_id, job)
+        return job
+
+    def read_input(self, job_id):
+        with open(os.path.join(self._dir(job_id), 'input.bin'), 'rb') as f:
+            return f.read()
+
+    def write_result(self, job_id, body):
+        path = os.path.join(self._dir(job_id), 'result.bin')
+        with open(path + '.tmp', 'wb') as f:
+            f.write(body)
+        os.replace(path + '.tmp', path)
+
+    def read_result(self, job_id):
+        with open(os.path.join(self._dir(job_id), 'result.bin'), 'rb') as f:
+            return f.read()
+
+    def adopt(self, job_id, owner, pid):
+        """Take over a queued job from the exited process ``owner``; False when another process got it first."""
+        try:
+            fd = os.open(os.path.join(self._dir(job_id), f'adopted-{owner}'), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        os.close(fd)
+        return self.update(job_id, owner=pid) is not None
+
+    def jobs(self):
+        """Every stored job."""
+        for job_id in os.listdir(self.location):
+            job = self.get(job_id)
+            if job is not None:
+                yield job
+
+    def request_cancel(self, job_id):
+        open(os.path.join(self._dir(job_id), 'cancel'), 'w').close()
+
+    def delete(self, job_id):
+        shutil.rmtree(self._dir(job_id), ignore_errors=True)
+
+    def purge_expired(self, ttl):
+        """Delete finished jobs older than ``ttl``, and unfinished ones as old whose owner has exited."""
+        now = time.time()
+        for job in self.jobs():
+            if job['status'] in FINISHED:
+                expired = job['finished'] and now - job['finished'] > ttl
+            else:
+                expired = now - job['created'] > ttl and not _owner_running(job)
+            if expired:
+                self.delete(job['id'])
+
+
+def _owner_running(job):
+    owner = job.get('owner')
+    return owner is not None and _is_running(owner)
+
+
+def run_job(store, job_id):
+    """Render one stored job; runs inside a worker process."""
+    from .views import RENDER_VIEWS
+
+    job = store.get(job_id)
+    view = RENDER_VIEWS[job['endpoint']]()
+    body, content_type, headers = view.render(store.read_input(job_id), job['input_format'], **job['params'])
+    store.write_result(job_id, body)
+    return content_type, headers
+
+
+def _worker_main(conn, location):
+    import django
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pythondiagram.settings')
+    django.setup()
+    store = JobStore(location)
+    while True:
+        try:
+            job_id = conn.recv()
+        except EOFError:
+            return
+        try:
+            content_type, headers = run_job(store, job_id)
+            conn.send((job_id, True, {'content_type': content_type, 'headers': headers}))
+        except Exception as e:
+            conn.send((job_id, False, {'error': f"{type(e).__name__}: {e}"}))
+
+
+class JobWorker:
+    """A long-lived render process that handles one job at a time."""
+
+    def __init__(self, ctx, location):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, location),
+                                   name='diagram-job-worker', daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.job_id = None
+        self.deadline = None
+
+    def submit(self, job_id, timeout):
+        self.job_id = job_id
+        self.deadline = time.monotonic() + timeout
+        self.conn.send(job_id)
+
+    def kill(self):
+        self.process.kill()
+        self.process.join(5)
+        self.conn.close()
+
+
+class JobManager:
+    """
+    Runs stored jobs on a bounded set of worker processes. A supervisor
+    thread hands queued jobs to idle workers, records results, and kills
+    (then replaces) a worker whose job overruns its timeout or is cancelled.
+    """
+
+    def __init__(self, store, workers, timeout, result_ttl):
+        self.store = store
+        self.size = workers
+        self.timeout = timeout
+        self.result_ttl = result_ttl
+        self.pid = os.getpid()
+        self._ctx = multiprocessing.get_context('spawn')
+        self._queue = queue.Queue()
+        self._workers = []
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Start the workers and the supervisor thread, or restart the
+        supervisor if it died. The first start also recovers the jobs of
+        server processes that exited (see :meth:`recover`).
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if self._thread is not None:
+                logger.error("Job supervisor thread died; restarting it")
+            if not self._workers:
+                self._workers = [JobWorker(self._ctx, self.store.location) for _ in range(self.size)]
+                self.recover()
+            self._thread = threading.Thread(target=self._supervise, name='diagram-job-supervisor', daemon=True)
+            self._thread.start()
+
+    def submit(self, endpoint, data, fmt, params, cache_key=None):
+        job = self.store.create(endpoint, data, fmt, params, cache_key=cache_key, owner=self.pid)
+        self.start()
+        self._queue.put(job['id'])
+        return job
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def recover(self):
+        """
+        Queue the jobs left queued by exited server processes here, and
+        fail those that were running in one (their worker went with it).
+        """
+        for job in self.store.jobs():
+            owner = job.get('owner')
+            if job['status'] not in (QUEUED, RUNNING) or owner == self.pid or _owner_running(job):
+                continue
+            try:
+                if job['status'] == RUNNING:
+                    self._fail(job['id'], "Server process exited while the job was running")
+                elif self.store.adopt(job['id'], owner, self.pid):
+                    logger.info("Recovered job %s of exited process %s", job['id'], owner)
+                    self._queue.put(job['id'])
+            except OSError:
+                logger.exception("Could not recover job %s", job['id'])
+
+    def _replace(self, worker):
+        worker.kill()
+        index = self._workers.index(worker)
+        self._workers[index] = JobWorker(self._ctx, self.store.location)
+
+    def _fail(self, job_id, error):
+        """Mark a job failed; the store itself may be what is failing, so this never raises."""
+        try:
+            self.store.update(job_id, status=FAILED, finished=time.time(), error=error)
+        except Exception:
+            logger.exception("Could not mark job %s failed", job_id)
+
+    def _finish(self, worker, ok, info):
+        job_id = worker.job_id
+        worker.job_id = worker.deadline = None
+        if ok:
+            job = self.store.update(job_id, status=DONE, finished=time.time(), **info)
+            if job and job.get('cache_key'):
+                from .render_cache import get_render_cache
+                get_render_cache().set(job['cache_key'], {'content_type': job['content_type'],
+                                                          'headers': job['headers']},
+                                       self.store.read_result(job_id))
+        else:
+            self.store.update(job_id, status=FAILED, finished=time.time(), **info)
+
+    def _dispatch(self, worker, job_id):
+        """Hand a queued job to an idle worker (unless it was cancelled while queued)."""
+        try:
+            job = self.store.get(job_id)
+            if job is None or job['status'] != QUEUED:
+                return
+            if job['cancel_requested']:
+                self.store.update(job_id, status=CANCELLED, finished=time.time())
+                return
+            self.store.update(job_id, status=RUNNING, started=time.time(), owner=self.pid)
+            worker.submit(job_id, self.timeout)
+        except Exception as e:
+            # e.g. BrokenPipeError from a worker that died while idle, or a full disk
+            logger.exception("Could not start job %s", job_id)
+            worker.job_id = worker.deadline = None
+            self._fail(job_id, f"Could not start job: {type(e).__name__}: {e}")
+            self._replace(worker)
+
+    def _collect(self, worker):
+        """Record the result a busy worker sent back."""
+        try:
+            _, ok, info = worker.conn.recv()
+        except (EOFError, OSError):
+            job_id = worker.job_id
+            worker.job_id = worker.deadline = None
+            self._fail(job_id, 'Worker process crashed')
+            self._replace(worker)
+            return
+        job_id = worker.job_id
+        try:
+            self._finish(worker, ok, info)
+        except Exception as e:
+            logger.exception("Could not record the result of job %s", job_id)
+            self._fail(job_id, f"Could not record the result: {type(e).__name__}: {e}")
+
+    def _check_running(self, worker):
+        """Stop a running job that was cancelled or overran its timeout, replacing its worker."""
+        job = self.store.get(worker.job_id)
+        if job is not None and job['cancel_requested']:
+            self.store.update(worker.job_id, status=CANCELLED, finished=time.time())
+        elif time.monotonic() > worker.deadline:
+            self._fail(worker.job_id, f"Timed out after {self.timeout}s")
+        else:
+            return
+        worker.job_id = worker.deadline = None
+        self._replace(worker)
+
+    def _supervise(self):
+        last_purge = 0.0
+        while True:
+            try:
+                busy = self._step()
+            except Exception:
+                # A failure outside any one job (e.g. a worker that cannot be spawned);
+                # keep supervising rather than let the thread die
+                logger.exception("Job supervisor iteration failed")
+                busy = False
+            if not busy:
+                time.sleep(0.05)
+            if time.time() - last_purge > 60:
+                last_purge = time.time()
+                try:
+                    self.recover()
+                    self.store.purge_expired(self.result_ttl)
+                except OSError:
+                    logger.exception("Purging expired jobs failed")
+
+    def _step(self):
+        """One supervisor pass; returns whether any worker was busy."""
+        # Hand queued jobs to idle workers
+        for worker in list(self._workers):
+            if worker.job_id is not None:
+                continue
+            try:
+                job_id = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._dispatch(worker, job_id)
+
+        busy = [w for w in self._workers if w.job_id is not None]
+        for conn in wait([w.conn for w in busy], timeout=0.2) if busy else []:
+            self._collect(next(w for w in busy if w.conn is conn))
+
+        # Timeouts and cancellations of running jobs
+        for worker in [w for w in self._workers if w.job_id is not None]:
+            try:
+                self._check_running(worker)
+            except Exception as e:
+                logger.exception("Could not check job %s", worker.job_id)
+                self._fail(worker.job_id, f"{type(e).__name__}: {e}")
+                worker.job_id = worker.deadline = None
+                self._replace(worker)
+        return bool(busy)
+
+
+_job_manager = None
+_job_manager_lock = threading.Lock()
+
+
+def get_job_store():
+    return JobStore(get_jobs_config()['LOCATION'])
+
+
+def get_job_manager():
+    """Process-wide job manager (workers start on the first submission)."""
+    global _job_manager
+    with _job_manager_lock:
+        if _job_manager is None or _job_manager.pid != os.getpid():
+            config = get_jobs_config()
+            _job_manager = JobManager(
+                JobStore(config['LOCATION']),
+                workers=config['WORKERS'],
+                timeout=config['TIMEOUT'],
+                result_ttl=config['RESULT_TTL'],
+            )
+    return _job_manager
+
+
+def job_links(request, job):
+    return {
+        'id': job['id'],
+        'status': job['status'],
+        'status_url': request.build_absolute_uri(f"/api/jobs/{job['id']}"),
+        'result_url': request.build_absolute_uri(f"/api/jobs/{job['id']}/result"),
+    }
+
+
+def submit_if_large(endpoint, data, fmt, params, cache_key=None):
+    """
+    Submit the render as a job when the input exceeds
+    ``DIAGRAM_JOBS['OFFLOAD_ROWS']`` and return the job; otherwise None.
+    """
+    from .ingest import count_rows
+    from .timing import stage
+
+    threshold = get_jobs_config()['OFFLOAD_ROWS']
+    if threshold is None:
+        return None
+    with stage("count_rows"):
+        rows = count_rows(data, fmt)
+    if rows <= threshold:
+        return None
+    return get_job_manager().submit(endpoint, data, fmt, params, cache_key=cache_key)
+
+
+def offload_if_large(request, endpoint, data, fmt, params, cache_key=None):
+    """
+    Return a 202 response pointing at a background job when the input is
+    large enough to offload, or None so the view renders synchronously.
+    """
+    from rest_framework.response import Response
+
+    job = submit_if_large(endpoint, data, fmt, params, cache_key=cache_key)
+    if job is None:
+        return None
+    links = job_links(request, job)
+    response = Response(links, status=202)
+    response['Location'] = links['status_url']
+    return response
@@ -0,0 +1,321 @@
+"""
+Layered (Sugiyama-style) graph layout.
+
+Ranks are given by the caller. Edges spanning several ranks are split
+through dummy nodes, each rank is reordered with median or barycenter
+sweeps (bounded iterations, best order kept), and x coordinates are
+assigned with linear-time passes that pull nodes toward their neighbours
+while keeping a minimum spacing.
+"""
+import bisect
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+
+DEFAULT_LAYOUT_CONFIG = {
+    'METHOD': 'median',   # 'median' or 'barycenter' crossing reduction
+    'ITERATIONS': 8,      # at most this many down+up ordering sweeps
+}
+
+
+def get_layout_config():
+    return {**DEFAULT_LAYOUT_CONFIG, **getattr(settings, 'DIAGRAM_LAYOUT', {})}
+
+
+class LayeredLayout:
+    """Result of :func:`layered_layout`."""
+
+    def __init__(self, positions, order, crossings, initial_crossings, iterations, seconds):
+        self.positions = positions                  # {node: (x, y)}
+        self.order = order                          # [[node, ...] per rank, dummies removed]
+        self.crossings = crossings                  # crossings of the drawn straight edges
+        self.initial_crossings = initial_crossings  # same, before reordering
+        self.iterations = iterations
+        self.seconds = seconds
+
+
+class _Fenwick:
+    def __init__(self, size):
+        self.tree = [0] * (size + 1)
+
+    def add(self, i):
+        i += 1
+        while i < len(self.tree):
+            self.tree[i] += 1
+            i += i & -i
+
+    def count_le(self, i):
+        i += 1
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+
+def _inversions(pairs):
+    """Crossings among segments given as (upper position, lower position)."""
+    if len(pairs) < 2:
+        return 0
+    pairs.sort()
+    lowers = sorted({b for _, b in pairs})
+    fenwick = _Fenwick(len(lowers))
+    crossings = 0
+    seen = 0
+    i = 0
+    while i < len(pairs):
+        # Segments sharing an upper endpoint never cross each other
+        j = i
+        while j < len(pairs) and pairs[j][0] == pairs[i][0]:
+            crossings += seen - fenwick.count_le(bisect.bisect_left(lowers, pairs[j][1]))
+            j += 1
+        for k in range(i, j):
+            fenwick.add(bisect.bisect_left(lowers, pairs[k][1]))
+        seen += j - i
+        i = j
+    return crossings
+
+
+def count_crossings(positions, rank, edges):
+    """
+    Crossings between the straight edges as drawn, counted in every gap
+    between consecutive ranks (an edge spanning several ranks is cut at
+    each boundary). Same-rank edges are ignored. O(E log E) per gap.
+    """
+    levels = sorted(set(rank.values()))
+    index = {r: i for i, r in enumerate(levels)}
+    gaps = defaultdict(list)
+    for u, v in edges:
+        ru, rv = index[rank[u]], index[rank[v]]
+        if ru == rv:
+            continue
+        if ru > rv:
+            u, v, ru, rv = v, u, rv, ru
+        (x0, y0), (x1, y1) = positions[u], positions[v]
+        for g in range(ru, rv):
+            # x where the edge crosses the upper and lower rank of this gap
+            ya, yb = levels[g], levels[g + 1]
+            ta = (ya - rank[u]) / (rank[v] - rank[u])
+            tb = (yb - rank[u]) / (rank[v] - rank[u])
+            gaps[g].append((x0 + (x1 - x0) * ta, x0 + (x1 - x0) * tb))
+    return sum(_inversions(pairs) for pairs in gaps.values())
+
+
+def is_dummy(node):
+    return isinstance(node, tuple) and len(node) == 2 and node[0] == '__dummy__'
+
+
+def proper_graph(layers_of, rank_index, edges):
+    """Split long edges with dummy nodes; returns (up, down) adjacency between adjacent layers."""
+    up = defaultdict(list)    # node -> neighbours in the layer above (lower rank index)
+    down = defaultdict(list)  # node -> neighbours in the layer below
+    dummy = 0
+    for u, v in edges:
+        ru, rv = rank_index[u], rank_index[v]
+        if ru == rv:
+            continue
+        if ru > rv:
+            u, v, ru, rv = v, u, rv, ru
+        prev = u
+        for r in range(ru + 1, rv):
+            node = ('__dummy__', dummy)
+            dummy += 1
+            layers_of[r].append(node)
+            rank_index[node] = r
+            down[prev].append(node)
+            up[node].append(prev)
+            prev = node
+        down[prev].append(v)
+        up[v].append(prev)
+    return up, down
+
+
+def _median(values):
+    values.sort()
+    n = len(values)
+    if n % 2:
+        return values[n // 2]
+    if n == 2:
+        return (values[0] + values[1]) / 2
+    # Weighted median (Gansner et al.): lean toward the denser side
+    left = values[n // 2 - 1] - values[0]
+    right = values[-1] - values[n // 2]
+    if left + right == 0:
+        return (values[n // 2 - 1] + values[n // 2]) / 2
+    return (values[n // 2 - 1] * right + values[n // 2] * left) / (left + right)
+
+
+def _layer_crossings(layers, down):
+    total = 0
+    for r in range(len(layers) - 1):
+        pos_next = {node: i for i, node in enumerate(layers[r + 1])}
+        pairs = [(i, pos_next[w]) for i, node in enumerate(layers[r]) for w in down.get(node, ())]
+        total += _inversions(pairs)
+    return total
+
+
+def order_layers(layers, up, down, method="median", iterations=8):
+    """
+    Reorder ``layers`` in place to reduce crossings between adjacent layers.
+    Runs at most ``iterations`` down+up sweeps and keeps the best order seen.
+    Returns the number of sweeps performed.
+    """
+    score = _median if method == "median" else (lambda values: sum(values) / len(values))
+    position = {node: i for layer in layers for i, node in enumerate(layer)}
+
+    def sweep(indices, neighbours):
+        for r in indices:
+            layer = layers[r]
+            keys = {}
+            for i, node in enumerate(layer):
+                linked = [position[n] for n in neighbours.get(node, ())]
+                keys[node] = score(linked) if linked else i
+            layer.sort(key=keys.__getitem__)  # stable: ties keep their order
+            for i, node in enumerate(layer):
+                position[node] = i
+
+    best = _layer_crossings(layers, down)
+    best_order = [list(layer) for layer in layers]
+    done = 0
+    stale = 0
+    while done < iterations and best > 0 and stale < 2:
+        sweep(range(1, len(layers)), up)
+        sweep(range(len(layers) - 2, -1, -1), down)
+        done += 1
+        crossings = _layer_crossings(layers, down)
+        if crossings < best:
+            best, best_order, stale = crossings, [list(layer) for layer in layers], 0
+        else:
+            stale += 1
+    layers[:] = best_order
+    return done
+
+
+def _place_row(nodes, desired, spacing, centre=True):
+    """Positions as close to ``desired`` as a left-to-right minimum spacing allows."""
+    xs = []
+    for node in nodes:
+        x = desired[node]
+        if xs and x < xs[-1] + spacing:
+            x = xs[-1] + spacing
+        xs.append(x)
+    if not centre:
+        return xs
+    # Centre the row on its desired positions so packing does not drift right
+    shift = (sum(desired[n] for n in nodes) - sum(xs)) / len(nodes) if nodes else 0
+    return [x + shift for x in xs]
+
+
+def layered_layout(nodes, rank, edges, initial_key=None, method="median", iterations=8,
+                   spacing=3.0, layer_gap=3.0):
+    """
+    Lay out ``nodes`` in horizontal rows at ``y = rank[node] * layer_gap``.
+
+    ``initial_key`` gives the starting order within a row (stable, e.g. the
+    numeric suffix of the name); crossing minimisation starts from there.
+    """
+    started = time.perf_counter()
+    levels = sorted(set(rank[n] for n in nodes))
+    level_index = {r: i for i, r in enumerate(levels)}
+    rank_index = {n: level_index[rank[n]] for n in nodes}
+
+    layers_of = defaultdict(list)
+    for n in sorted(nodes, key=initial_key) if initial_key else nodes:
+        layers_of[rank_index[n]].append(n)
+    up, down = proper_graph(layers_of, rank_index, edges)
+    layers = [layers_of[i] for i in range(len(levels))]
+
+    def real(layer):
+        return [n for n in layer if not is_dummy(n)]
+
+    def simple_positions():
+        positions = {}
+        for i, layer in enumerate(layers):
+            for j, n in enumerate(real(layer)):
+                positions[n] = (j * spacing, levels[i] * layer_gap)
+        return positions
+
+    initial_crossings = count_crossings(simple_positions(), rank, edges)
+    done = order_layers(layers, up, down, method=method, iterations=iterations)
+
+    # Coordinates: start packed, then pull each row toward its neighbours (down, then up)
+    rows = [real(layer) for layer in layers]
+    x = {}
+    width = max((len(row) for row in rows), default=0)
+    for row in rows:
+        offset = (width - len(row)) * spacing / 2
+        for j, n in enumerate(row):
+            x[n] = offset + j * spacing
+
+    neighbours_up = defaultdict(list)
+    neighbours_down = defaultdict(list)
+    for u, v in edges:
+        if rank_index[u] < rank_index[v]:
+            neighbours_down[u].append(v)
+            neighbours_up[v].append(u)
+        elif rank_index[u] > rank_index[v]:
+            neighbours_down[v].append(u)
+            neighbours_up[u].append(v)
+
+    for indices, neighbours in ((range(1, len(rows)), neighbours_up),
+                                (range(len(rows) - 2, -1, -1), neighbours_down)):
+        for i in indices:
+            row = rows[i]
+            desired = {}
+            for n in row:
+                linked = [x[m] for m in neighbours[n]]
+                desired[n] = _median(linked) if linked else x[n]
+            for n, value in zip(row, _place_row(row, desired, spacing)):
+                x[n] = value
+
+    positions = {n: (x[n], rank[n] * layer_gap) for n in nodes}
+    crossings = count_crossings(positions, rank, edges)
+    return LayeredLayout(positions, rows, crossings, initial_crossings, done, time.perf_counter() - started)
+
+
+def relayout(previous, nodes, rank, edges, spacing=3.0, layer_gap=3.0):
+    """
+    Incremental :func:`layered_layout` for an edited graph. Nodes found in
+    ``previous`` ({node: (x, y)}) on the same row keep their x; new nodes go
+    to the median x of their already placed neighbours (or the right end of
+    their row), and a row only shifts right where an insertion breaks the
+    minimum spacing. No reordering sweeps run, so ``iterations`` is 0.
+    """
+    started = time.perf_counter()
+    neighbours = defaultdict(list)
+    for u, v in edges:
+        if rank[u] != rank[v]:
+            neighbours[u].append(v)
+            neighbours[v].append(u)
+
+    desired = {n: previous[n][0] for n in nodes
+               if n in previous and previous[n][1] == rank[n] * layer_gap}
+    kept = set(desired)
+    rows = defaultdict(list)
+    for n in nodes:
+        rows[rank[n]].append(n)
+
+    order = []
+    for r in sorted(rows):
+        row = rows[r]
+        right = max((desired[n] for n in row if n in kept), default=-spacing)
+        for n in row:
+            if n in kept:
+                continue
+            linked = [desired[m] for m in neighbours[n] if m in desired]
+            if linked:
+                desired[n] = _median(linked)
+            else:
+                right += spacing
+                desired[n] = right
+        # Kept nodes sort ahead of new ones at the same x, so they are not pushed
+        row.sort(key=lambda n: (desired[n], n not in kept))
+        for n, value in zip(row, _place_row(row, desired, spacing, centre=False)):
+            desired[n] = value
+        order.append(row)
+
+    positions = {n: (desired[n], rank[n] * layer_gap) for n in nodes}
+    crossings = count_crossings(positions, rank, edges)
+    return LayeredLayout(positions, order, crossings, crossings, 0, time.perf_counter() - started)
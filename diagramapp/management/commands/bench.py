@@ -0,0 +1,223 @@
+"""
+Benchmark every render endpoint on synthetic netlists.
+
+    python manage.py bench [--sizes 100 1000] [--endpoints diagram generate] [--formats svg json]
+                           [--repeat 3] [--output bench_results/x.json] [--compare old.json]
+
+Each netlist comes from benchmarks/netlists.py in its endpoint's schema,
+is written as the .xlsx (or CSV) a user would upload and goes through the
+view's own ``render`` (no HTTP, no render cache; the parsed-model cache is
+off unless ``--model-cache``). Times come from the views' timing stages,
+grouped into parse, layout, figure, serialize and export phases; the
+first run of every case is a warm-up that measures peak Python memory
+with tracemalloc. Results are written as JSON with the commit they ran
+on, so two files can be compared with ``--compare`` (on the best run of
+each case, the least noisy figure).
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from functools import partial
+from importlib import metadata
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from diagramapp import netlist, timing
+from diagramapp.metrics import measured
+
+
+# Timing stages (see the views) behind each reported phase
+PHASES = {
+    'parse': ('read', 'model_cache', 'prepare', 'graph'),
+    'layout': ('layout',),
+    'figure': ('chips', 'connect', 'arrows', 'figure', 'draw', 'mermaid_source'),
+    'serialize': ('serialize',),
+    'export': ('export', 'mermaid'),
+}
+
+PACKAGES = ("django", "pandas", "numpy", "plotly", "bokeh", "networkx", "openpyxl", "orjson")
+
+
+def git_revision():
+    """``(commit, dirty)`` of the checkout, or ``(None, None)`` outside git."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=settings.BASE_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=settings.BASE_DIR,
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(status.strip())
+
+
+def package_versions():
+    versions = {}
+    for name in PACKAGES:
+        try:
+            versions[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            versions[name] = None
+    return versions
+
+
+def peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    # kilobytes on Linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+def median_ms(values):
+    return round(statistics.median(values) * 1000, 3)
+
+
+class Command(BaseCommand):
+    help = "Benchmark the render endpoints on synthetic netlists and write the results as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000],
+                            help="netlist sizes (rows, or nodes for the fabric endpoints)")
+        parser.add_argument("--endpoints", nargs="+", help="render endpoints (default: all)")
+        parser.add_argument("--formats", nargs="+", help="output formats (default: each endpoint's own)")
+        parser.add_argument("--repeat", type=int, default=3, help="timed runs per case, after one warm-up")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--input-format", choices=("excel", "csv"), default="excel")
+        parser.add_argument("--model-cache", action="store_true", help="keep the parsed-model cache on")
+        parser.add_argument("--save-inputs", metavar="DIR", help="also write the generated netlists to DIR")
+        parser.add_argument("--output", help="results file (default: bench_results/<commit>.json)")
+        parser.add_argument("--compare", metavar="JSON", help="results of another run to compare totals with")
+        parser.add_argument("--threshold", type=float, default=0.10,
+                            help="with --compare, fail when a case is this much slower (default 0.10)")
+
+    def handle(self, *args, **options):
+        sys.path.insert(0, str(settings.BASE_DIR))
+        from benchmarks.netlists import NETLISTS, csv_bytes, workbook_bytes
+        from diagramapp.views import RENDER_VIEWS
+
+        endpoints = options["endpoints"] or list(RENDER_VIEWS)
+        unknown = sorted(set(endpoints) - set(RENDER_VIEWS))
+        if unknown:
+            raise CommandError(f"Unknown endpoints {unknown}; choose from {sorted(RENDER_VIEWS)}")
+        if not options["model_cache"]:
+            settings.DIAGRAM_MODEL_CACHE = {**getattr(settings, 'DIAGRAM_MODEL_CACHE', {}), 'BACKEND': None}
+            netlist._model_cache = None
+        encode, fmt = (workbook_bytes, "excel") if options["input_format"] == "excel" else (csv_bytes, "csv")
+        if options["save_inputs"]:
+            os.makedirs(options["save_inputs"], exist_ok=True)
+
+        commit, dirty = git_revision()
+        results = []
+        self.stdout.write(f"{'endpoint':>16} {'size':>6} {'format':>6} {'total ms':>10} {'parse':>9} {'layout':>9} "
+                          f"{'figure':>9} {'serial':>9} {'export':>9} {'peak MB':>8}")
+        for endpoint in endpoints:
+            view = RENDER_VIEWS[endpoint]()
+            formats = [f for f in view.formats if not options["formats"] or f in options["formats"]]
+            for size in options["sizes"]:
+                df = NETLISTS[endpoint](size, seed=options["seed"])
+                data = encode(df)
+                if options["save_inputs"]:
+                    extension = "xlsx" if fmt == "excel" else "csv"
+                    with open(os.path.join(options["save_inputs"], f"{endpoint}-{size}.{extension}"), "wb") as f:
+                        f.write(data)
+                for out_format in formats:
+                    params = {'out_format': out_format}
+                    if endpoint == 'diagram':
+                        params['trace_mode'] = "segments"
+                    result = self.bench(view, data, fmt, params, options["repeat"])
+                    result = {'endpoint': endpoint, 'size': size, 'rows': len(df), 'format': out_format, **result}
+                    results.append(result)
+                    self.report(result)
+
+        report = {
+            'commit': commit,
+            'dirty': dirty,
+            'created': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'packages': package_versions(),
+            'options': {name: options[name] for name in ("sizes", "repeat", "seed", "input_format", "model_cache")},
+            'peak_rss_bytes': peak_rss_bytes(),
+            'results': results,
+        }
+        output = options["output"] or os.path.join(
+            settings.BASE_DIR, "bench_results", f"{(commit or 'nogit')[:12]}{'-dirty' if dirty else ''}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(f"Results written to {output}")
+
+        if options["compare"]:
+            self.compare(options["compare"], results, options["threshold"])
+
+    @staticmethod
+    def bench(view, data, fmt, params, repeat):
+        """One case: a tracemalloc warm-up run, then ``repeat`` timed runs."""
+        render = partial(view.render, data, fmt, **params)
+        tracemalloc.start()
+        try:
+            (body, content_type, _), sizes = measured(render)
+            peak = tracemalloc.get_traced_memory()[1]
+        except Exception as e:  # e.g. no Chrome for Kaleido, no mmdc
+            return {'ok': False, 'error': str(e).splitlines()[0] if str(e) else type(e).__name__}
+        finally:
+            tracemalloc.stop()
+
+        totals, stages = [], {}
+        for _ in range(repeat):
+            with timing.collect() as timings:
+                started = time.perf_counter()
+                render()
+                totals.append(time.perf_counter() - started)
+            for name, (seconds, _) in timings.items():
+                stages.setdefault(name, []).append(seconds)
+        stages_ms = {name: median_ms(values) for name, values in stages.items()}
+        return {
+            'ok': True,
+            **sizes,
+            'bytes': len(body),
+            'content_type': content_type,
+            'total_ms': {'min': round(min(totals) * 1000, 3), 'median': median_ms(totals)},
+            'phases_ms': {phase: round(sum(stages_ms.get(name, 0.0) for name in names), 3)
+                          for phase, names in PHASES.items()},
+            'stages_ms': stages_ms,
+            'peak_alloc_bytes': peak,
+        }
+
+    def report(self, result):
+        head = f"{result['endpoint']:>16} {result['size']:>6} {result['format']:>6}"
+        if not result['ok']:
+            self.stdout.write(f"{head}   unavailable: {result['error'][:70]}")
+            return
+        phases = " ".join(f"{result['phases_ms'][phase]:>9.1f}" for phase in PHASES)
+        self.stdout.write(f"{head} {result['total_ms']['median']:>10.1f} {phases} "
+                          f"{result['peak_alloc_bytes'] / 2 ** 20:>8.1f}")
+
+    def compare(self, path, results, threshold):
+        with open(path) as f:
+            baseline = json.load(f)
+        before = {(r['endpoint'], r['size'], r['format']): r for r in baseline['results'] if r['ok']}
+        self.stdout.write(f"\nCompared with {path} (commit {(baseline.get('commit') or '?')[:12]}):")
+        regressions = []
+        for result in results:
+            old = before.get((result['endpoint'], result['size'], result['format']))
+            if not result['ok'] or old is None:
+                continue
+            ratio = result['total_ms']['min'] / old['total_ms']['min'] if old['total_ms']['min'] else 1.0
+            flag = ""
+            if ratio > 1 + threshold:
+                flag = "  REGRESSION"
+                regressions.append(result)
+            self.stdout.write(f"{result['endpoint']:>16} {result['size']:>6} {result['format']:>6} "
+                              f"{old['total_ms']['min']:>10.1f} -> {result['total_ms']['min']:>10.1f} ms "
+                              f"({ratio - 1:+.1%}){flag}")
+        if regressions:
+            raise CommandError(f"{len(regressions)} case(s) more than {threshold:.0%} slower than {path}")
@@ -0,0 +1,166 @@
+"""
+Startup profile of a server process: what a cold worker imports, and when.
+
+    python manage.py importtime [--endpoints circuit] [--top 20] [--repeat 3] [--budget 1.0] [--json]
+
+Starts fresh interpreters that boot the project the way wsgi.py does
+(the interpreter itself, django.setup(), the WSGI handler and its middleware, the URLconf) and
+then load what the first request on each render endpoint imports: its
+view module and the libraries it defers (see startup.py), then openpyxl
+for .xlsx uploads. The phase times are the best of ``--repeat`` plain runs;
+one more run under ``python -X importtime`` attributes them to modules
+(those times are inflated by the tracing). ``--budget`` fails the command
+when the cold start of the chosen endpoints takes longer.
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from diagramapp.startup import served_endpoints
+
+
+MARKER = "diagram-startup-phase:"
+
+# Run with ``python -c`` so that nothing but the phases is imported
+CHILD = f"""
+import json, sys, time
+mark = float(sys.argv[2])  # perf_counter() in the parent just before the spawn (a system-wide clock)
+phases = []
+
+def phase(name):
+    global mark
+    phases.append([name, time.perf_counter() - mark, len(sys.modules)])
+    sys.stderr.write("{MARKER}" + name + "\\n")
+    mark = time.perf_counter()
+
+phase("interpreter")
+import django
+django.setup()
+phase("django")
+from django.core.wsgi import get_wsgi_application
+get_wsgi_application()
+phase("wsgi")
+from importlib import import_module
+from django.urls import get_resolver
+from diagramapp.startup import INGEST_IMPORTS, served_endpoints
+from diagramapp.views import RENDER_VIEWS
+get_resolver().url_patterns
+phase("startup")
+for endpoint in served_endpoints(json.loads(sys.argv[1])):
+    for name in getattr(RENDER_VIEWS[endpoint], "deferred_imports", ()):
+        try:
+            import_module(name)
+        except ImportError:
+            pass
+    phase("endpoint " + endpoint)
+for name in INGEST_IMPORTS:
+    import_module(name)
+phase("xlsx upload")
+try:
+    with open("/proc/self/statm") as f:
+        rss = int(f.read().split()[1]) * 4096
+except OSError:  # not Linux
+    rss = None
+print(json.dumps({{"phases": phases, "rss_bytes": rss}}))
+"""
+
+
+def run_child(endpoints, importtime=False):
+    """``(report, stderr)`` of one fresh interpreter starting up for ``endpoints``."""
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'pythondiagram.settings')}
+    command = [sys.executable, *(["-X", "importtime"] if importtime else []), "-c", CHILD, json.dumps(endpoints),
+               repr(time.perf_counter())]
+    result = subprocess.run(command, cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise CommandError(f"Startup failed:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def parse_importtime(stderr):
+    """
+    ``[(phase, package, self_us, cumulative_us)]``: per phase, the time of
+    every top-level package, counted where another package imports it.
+    """
+    phases, entries = [], []
+    for line in stderr.splitlines():
+        if line.startswith(MARKER):
+            phases.append((line[len(MARKER):], entries))
+            entries = []
+        elif line.startswith("import time:") and "self [us]" not in line:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+            # nested imports are indented by two spaces per level
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            entries.append((depth, name.strip().partition(".")[0], int(self_us), int(cumulative_us)))
+
+    packages = {}
+    for phase, entries in phases:
+        # importtime prints an import after the ones it triggered: walk back from the outermost
+        parents = []
+        for depth, package, self_us, cumulative_us in reversed(entries):
+            del parents[depth:]
+            if not parents or parents[-1] != package:
+                totals = packages.setdefault((phase, package), [0, 0])
+                totals[1] += cumulative_us
+            packages.setdefault((phase, package), [0, 0])[0] += self_us
+            parents.append(package)
+    return [(phase, package, self_us, cumulative_us) for (phase, package), (self_us, cumulative_us) in packages.items()]
+
+
+class Command(BaseCommand):
+    help = "Profile the imports of a cold server process, per startup phase and render endpoint."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--endpoints", nargs="+",
+                            help="render endpoints the worker serves (default: DIAGRAM_STARTUP['ENDPOINTS'])")
+        parser.add_argument("--top", type=int, default=20, help="slowest packages to list")
+        parser.add_argument("--repeat", type=int, default=3, help="plain runs to take the phase times from")
+        parser.add_argument("--budget", type=float, metavar="SECONDS",
+                            help="fail when the cold start takes longer than this")
+        parser.add_argument("--json", action="store_true", help="print the profile as JSON")
+
+    def handle(self, *args, **options):
+        try:
+            endpoints = served_endpoints(options["endpoints"])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        runs = [run_child(endpoints)[0] for _ in range(max(options["repeat"], 1))]
+        best = min(runs, key=lambda run: sum(seconds for _, seconds, _ in run["phases"]))
+        _, stderr = run_child(endpoints, importtime=True)
+        packages = sorted(parse_importtime(stderr), key=lambda entry: -entry[3])
+        # Until the URLconf is loaded, then the chosen endpoints' imports; .xlsx support is extra
+        cold = sum(seconds for name, seconds, _ in best["phases"] if name != "xlsx upload")
+
+        profile = {
+            'endpoints': endpoints,
+            'cold_start_seconds': round(cold, 4),
+            'phases': [{'phase': name, 'seconds': round(seconds, 4), 'modules': modules}
+                       for name, seconds, modules in best["phases"]],
+            'rss_bytes': best["rss_bytes"],
+            'packages': [{'phase': phase, 'package': package, 'self_us': self_us, 'cumulative_us': cumulative_us}
+                         for phase, package, self_us, cumulative_us in packages[:options["top"]]],
+        }
+        if options["json"]:
+            self.stdout.write(json.dumps(profile, indent=2))
+        else:
+            self.report(profile)
+
+        if options["budget"] is not None and cold > options["budget"]:
+            raise CommandError(f"Cold start for {endpoints} took {cold:.3f}s, over the {options['budget']}s budget")
+
+    def report(self, profile):
+        self.stdout.write(f"{'phase':>24} {'ms':>9} {'modules':>8}")
+        for phase in profile['phases']:
+            self.stdout.write(f"{phase['phase']:>24} {phase['seconds'] * 1000:>9.1f} {phase['modules']:>8}")
+        rss = f"{profile['rss_bytes'] / 2 ** 20:.0f} MB" if profile['rss_bytes'] else "unknown"
+        self.stdout.write(f"{'cold start':>24} {profile['cold_start_seconds'] * 1000:>9.1f}   (RSS {rss} in the end)")
+        self.stdout.write(f"\nSlowest packages (under -X importtime):\n"
+                          f"{'phase':>24} {'cumulative ms':>14} {'self ms':>8}  package")
+        for entry in profile['packages']:
+            self.stdout.write(f"{entry['phase']:>24} {entry['cumulative_us'] / 1000:>14.1f} "
+                              f"{entry['self_us'] / 1000:>8.1f}  {entry['package']}")
@@ -0,0 +1,90 @@
+"""
+Run the production server (gunicorn, see diagramapp/server.py).
+
+    python manage.py serve [--bind 0.0.0.0:8000] [--workers 4] [--threads 4] [--asgi]
+                           [--endpoints circuit] [--max-requests 1000] [--max-rss-mb 1024] [--print-config]
+
+With ``--settings pythondiagram.settings_production`` (or
+DJANGO_SETTINGS_MODULE) for DEBUG off and a JSON-only API. Options
+override DIAGRAM_SERVER; worker and thread counts left unset are sized
+from the CPUs this process may use.
+"""
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from diagramapp.startup import served_endpoints
+
+
+# option -> DIAGRAM_SERVER key
+OPTIONS = {
+    'bind': 'BIND',
+    'asgi': 'ASGI',
+    'workers': 'WORKERS',
+    'threads': 'THREADS',
+    'render_processes': 'RENDER_PROCESSES',
+    'max_requests': 'MAX_REQUESTS',
+    'max_rss_mb': 'MAX_RSS_MB',
+    'timeout': 'TIMEOUT',
+}
+
+
+class Command(BaseCommand):
+    help = "Serve the app with gunicorn: preloaded master, auto-sized workers, recycled on requests or memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--bind", help="address(es) to listen on, comma-separated (default 127.0.0.1:8000)")
+        parser.add_argument("--asgi", action="store_true", default=None,
+                            help="serve asgi.py on uvicorn workers (the async endpoints) instead of wsgi.py")
+        parser.add_argument("--workers", type=int, help="worker processes (default: one per CPU, at least 2)")
+        parser.add_argument("--threads", type=int, help="threads per WSGI worker (default 4)")
+        parser.add_argument("--render-processes", type=int, help="render pool processes per worker")
+        parser.add_argument("--max-requests", type=int, help="replace a worker after this many requests (0: never)")
+        parser.add_argument("--max-rss-mb", type=int, help="replace a worker whose RSS passes this (0: never)")
+        parser.add_argument("--timeout", type=int, help="seconds a request may hold a worker")
+        parser.add_argument("--endpoints", nargs="+",
+                            help="render endpoints to preload and warm pools for (default: DIAGRAM_STARTUP)")
+        parser.add_argument("--print-config", action="store_true", help="print the resolved settings and exit")
+
+    def handle(self, *args, **options):
+        try:
+            from diagramapp import server
+        except ImportError as e:
+            raise CommandError(f"The production server needs gunicorn (pip install gunicorn): {e}")
+
+        config = server.get_server_config()
+        config.update({key: options[name] for name, key in OPTIONS.items() if options[name] is not None})
+        if options["endpoints"]:
+            try:
+                endpoints = served_endpoints(options["endpoints"])
+            except ValueError as e:
+                raise CommandError(str(e))
+            # Read again by the preload in the master and the warm-up in every worker
+            settings.DIAGRAM_STARTUP = {**getattr(settings, 'DIAGRAM_STARTUP', {}), 'ENDPOINTS': endpoints}
+
+        workers, threads, render_processes = server.worker_counts(config)
+        stores = server.per_process_stores()
+        summary = {
+            'settings': settings.SETTINGS_MODULE,
+            'debug': settings.DEBUG,
+            'cpus': server.cpu_count(),
+            'workers': workers,
+            'threads': threads,
+            'render_processes': render_processes,
+            'endpoints': served_endpoints(),
+            'per_process_stores': stores,
+            'server': config,
+        }
+        if options["print_config"]:
+            self.stdout.write(json.dumps(summary, indent=2, default=str))
+            return
+        if workers > 1 and stores:
+            raise CommandError(f"{workers} workers would each keep their own {', '.join(stores)}: use the 'disk' "
+                               "backend with a shared LOCATION (see settings_production) or --workers 1")
+        if settings.DEBUG:
+            self.stderr.write("DEBUG is on; use --settings pythondiagram.settings_production in production")
+        self.stdout.write(f"Serving {'ASGI' if config['ASGI'] else 'WSGI'} on {config['BIND']}: {workers} workers x "
+                          f"{threads} threads, {render_processes} render processes each, "
+                          f"endpoints {', '.join(summary['endpoints'])}")
+        server.run(config)
@@ -0,0 +1,366 @@
+"""
+Warm Mermaid renderers for /api/circuit PNGs.
+
+Each worker is a long-lived ``node node/mermaid_worker.mjs`` process that
+keeps a headless browser open and renders with mermaid-cli's
+renderMermaid(). They talk JSON lines over stdin/stdout: the worker
+announces ``{"ready": true}``, then answers each ``{"id", "code", ...}``
+request with the base64 image or an error under the same id. When the
+pool is disabled, mermaid-cli is not installed, or a worker fails,
+:func:`render_pooled` returns None and the view falls back to a one-shot
+``mmdc`` process; a full pool raises :class:`MermaidPoolBusy` (503).
+"""
+import atexit
+import base64
+import json
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+
+from django.conf import settings
+
+from .timing import stage
+
+
+logger = logging.getLogger(__name__)
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'node', 'mermaid_worker.mjs')
+
+DEFAULT_MERMAID_POOL_CONFIG = {
+    'ENABLED': True,
+    'SIZE': 2,               # warm Node/Chromium renderers
+    'MAX_RENDERS': 500,      # recycle a renderer after this many diagrams
+    'MAX_WAITING': 32,       # requests allowed to queue for a renderer before 503
+    'QUEUE_TIMEOUT': 10.0,   # seconds to wait for an idle renderer
+    'RENDER_TIMEOUT': 30.0,  # seconds allowed for a single diagram
+    'START_TIMEOUT': 30.0,   # seconds allowed for a renderer to launch its browser
+    'START_ON_BOOT': True,   # warm the pool from wsgi.py / asgi.py
+    'NODE': 'node',
+    'CLI_DIR': None,         # @mermaid-js/mermaid-cli package dir; found next to mmdc when None
+    'PUPPETEER_CONFIG': {},  # passed to puppeteer.launch()
+}
+
+
+class MermaidPoolError(RuntimeError):
+    """The pooled renderer could not produce a diagram; callers fall back to mmdc."""
+
+
+class MermaidPoolBusy(MermaidPoolError):
+    """Too many requests are already waiting for a renderer."""
+
+
+def get_mermaid_pool_config():
+    return {**DEFAULT_MERMAID_POOL_CONFIG, **getattr(settings, 'DIAGRAM_MERMAID_POOL', {})}
+
+
+def find_cli_dir():
+    """Locate the mermaid-cli package from the ``mmdc`` executable on PATH."""
+    mmdc = shutil.which("mmdc") or shutil.which("mmdc.cmd")
+    if not mmdc:
+        return None
+    path = os.path.dirname(os.path.realpath(mmdc))
+    while path != os.path.dirname(path):
+        package_json = os.path.join(path, 'package.json')
+        if os.path.exists(package_json):
+            try:
+                with open(package_json) as f:
+                    if json.load(f).get('name') == '@mermaid-js/mermaid-cli':
+                        return path
+            except (OSError, ValueError):
+                pass
+        candidate = os.path.join(path, 'node_modules', '@mermaid-js', 'mermaid-cli')
+        if os.path.isdir(candidate):
+            return candidate
+        path = os.path.dirname(path)
+    return None
+
+
+class MermaidWorker:
+    """One ``node mermaid_worker.mjs`` process holding a warm browser."""
+
+    def __init__(self, index, command, env):
+        self.index = index
+        self.command = command
+        self.env = env
+        self.process = None
+        self.renders = 0
+        self.generation = 0
+        self.started_at = None
+        self._lines = None
+        self._next_id = 0
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self, timeout):
+        self.process = subprocess.Popen(
+            self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            env=self.env, text=True, bufsize=1,
+        )
+        # Pipes have no read timeout; a reader thread feeds a queue we can wait on
+        self._lines = queue.Queue()
+        threading.Thread(target=self._read, args=(self.process.stdout, self._lines),
+                         name=f"mermaid-worker-{self.index}", daemon=True).start()
+        try:
+            message = self._lines.get(timeout=timeout)
+        except queue.Empty:
+            self.stop()
+            raise MermaidPoolError(f"Mermaid renderer {self.index} did not start within {timeout}s")
+        if message is None or not message.get('ready'):
+            self.stop()
+            raise MermaidPoolError(f"Mermaid renderer {self.index} failed to start: "
+                                   f"{(message or {}).get('error', 'process exited')}")
+        self.renders = 0
+        self.generation += 1
+        self.started_at = time.time()
+
+    @staticmethod
+    def _read(stream, lines):
+        for line in stream:
+            try:
+                lines.put(json.loads(line))
+            except ValueError:
+                continue
+        lines.put(None)  # EOF: the process died
+
+    def stop(self):
+        process, self.process = self.process, None
+        if process is None:
+            return
+        process.terminate()
+        try:
+            process.wait(5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    def render(self, request, timeout):
+        self._next_id += 1
+        request = {**request, 'id': self._next_id}
+        try:
+            self.process.stdin.write(json.dumps(request) + "\n")
+            self.process.stdin.flush()
+        except (OSError, ValueError, AttributeError) as e:
+            raise MermaidPoolError(f"Mermaid renderer {self.index} is gone: {e}")
+
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                message = self._lines.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                raise MermaidPoolError(f"Mermaid render did not finish within {timeout}s")
+            if message is None:
+                raise MermaidPoolError(f"Mermaid renderer {self.index} exited")
+            if message.get('id') != request['id']:
+                continue  # late answer to a request that already timed out
+            self.renders += 1
+            if not message.get('ok'):
+                raise ValueError(message.get('error') or "Mermaid render failed")
+            return base64.b64decode(message['data'])
+
+
+class MermaidPool:
+    """
+    Pool of warm Mermaid renderers. Requests borrow an idle worker (at most
+    ``max_waiting`` may wait, each for ``queue_timeout``), send one diagram
+    and hand the worker back. A worker that times out, crashes or reaches
+    ``max_renders`` is restarted before its next use.
+    """
+
+    def __init__(self, size, max_renders, max_waiting, queue_timeout, render_timeout, start_timeout,
+                 command, env):
+        self.size = size
+        self.max_renders = max_renders
+        self.max_waiting = max_waiting
+        self.queue_timeout = queue_timeout
+        self.render_timeout = render_timeout
+        self.start_timeout = start_timeout
+        self.pid = os.getpid()
+
+        self.workers = [MermaidWorker(i, command, env) for i in range(size)]
+        self.renders = 0
+        self.failures = 0
+        self.restarts = 0
+        self.rejected = 0
+        self.waiting = 0
+        self.total_render_seconds = 0.0
+
+        self._idle = queue.Queue()
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threads = [threading.Thread(target=self._start_worker, args=(w,)) for w in self.workers]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for worker in self.workers:
+            self._idle.put(worker)
+
+    def _start_worker(self, worker):
+        try:
+            worker.start(self.start_timeout)
+        except MermaidPoolError as e:
+            # Keep the slot; the worker retries its start on first use
+            logger.warning("%s", e)
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.stop()
+
+    def render(self, code, format="png", theme="default", background="transparent"):
+        """Render Mermaid source to image bytes on a warm worker."""
+        self.start()
+        with self._lock:
+            if self.waiting >= self.max_waiting:
+                self.rejected += 1
+                raise MermaidPoolBusy(f"{self.waiting} diagrams already waiting for a renderer")
+            self.waiting += 1
+        try:
+            worker = self._idle.get(timeout=self.queue_timeout)
+        except queue.Empty:
+            raise MermaidPoolBusy(f"No idle Mermaid renderer within {self.queue_timeout}s")
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+        started = time.perf_counter()
+        try:
+            if not worker.alive:
+                self._restart(worker)
+            data = worker.render({'code': code, 'format': format, 'theme': theme, 'backgroundColor': background},
+                                 self.render_timeout)
+        except MermaidPoolError:
+            with self._lock:
+                self.failures += 1
+            worker.stop()
+            raise
+        except ValueError:
+            # Mermaid rejected the diagram; the worker itself is fine
+            with self._lock:
+                self.failures += 1
+            raise
+        else:
+            with self._lock:
+                self.renders += 1
+                self.total_render_seconds += time.perf_counter() - started
+            if worker.renders >= self.max_renders:
+                worker.stop()
+            return data
+        finally:
+            self._idle.put(worker)
+
+    def _restart(self, worker):
+        with self._lock:
+            self.restarts += 1
+        worker.stop()
+        worker.start(self.start_timeout)
+
+    def stats(self):
+        idle = self._idle.qsize()
+        alive = sum(1 for w in self.workers if w.alive)
+        return {
+            'status': 'ok' if self._started and alive == self.size else ('degraded' if self._started else 'stopped'),
+            'pid': self.pid,
+            'size': self.size,
+            'alive': alive,
+            'idle': idle,
+            'busy': self.size - idle if self._started else 0,
+            'waiting': self.waiting,
+            'renders': self.renders,
+            'failures': self.failures,
+            'restarts': self.restarts,
+            'rejected': self.rejected,
+            'avg_render_ms': (self.total_render_seconds / self.renders * 1000) if self.renders else None,
+            'workers': [
+                {'index': w.index, 'alive': w.alive, 'renders': w.renders, 'generation': w.generation,
+                 'started_at': w.started_at}
+                for w in self.workers
+            ],
+        }
+
+
+_mermaid_pool = None
+_mermaid_pool_lock = threading.Lock()
+
+
+def get_mermaid_pool():
+    """Process-wide Mermaid pool, or None when disabled or mermaid-cli is not installed."""
+    global _mermaid_pool
+    config = get_mermaid_pool_config()
+    if not config['ENABLED']:
+        return None
+    with _mermaid_pool_lock:
+        if _mermaid_pool is None or _mermaid_pool.pid != os.getpid():
+            cli_dir = config['CLI_DIR'] or find_cli_dir()
+            node = shutil.which(config['NODE'])
+            if not cli_dir or not node:
+                return None
+            env = {**os.environ, 'MERMAID_CLI_DIR': str(cli_dir),
+                   'PUPPETEER_CONFIG': json.dumps(config['PUPPETEER_CONFIG'])}
+            _mermaid_pool = MermaidPool(
+                size=config['SIZE'],
+                max_renders=config['MAX_RENDERS'],
+                max_waiting=config['MAX_WAITING'],
+                queue_timeout=config['QUEUE_TIMEOUT'],
+                render_timeout=config['RENDER_TIMEOUT'],
+                start_timeout=config['START_TIMEOUT'],
+                command=[node, WORKER_SCRIPT],
+                env=env,
+            )
+    return _mermaid_pool
+
+
+def warm_up(wait=False):
+    """Start the Mermaid renderers at boot, in the background unless ``wait``."""
+    config = get_mermaid_pool_config()
+    if not (config['ENABLED'] and config['START_ON_BOOT']):
+        return
+    pool = get_mermaid_pool()
+    if pool is None:
+        return
+    if wait:
+        pool.start()
+    else:
+        threading.Thread(target=pool.start, name="mermaid-pool-warm-up", daemon=True).start()
+
+
+def render_pooled(code, out_format, theme):
+    """
+    Render on the warm pool, returning ``(bytes, content_type)``, or None
+    when the caller should fall back to a one-shot mmdc process. A full
+    pool raises :class:`MermaidPoolBusy` rather than spawning more processes.
+    """
+    pool = get_mermaid_pool()
+    # renderMermaid produces svg/png/pdf; other formats go through mmdc
+    if pool is None or out_format != "png":
+        return None
+    try:
+        return pool.render(code, format="png", theme=theme), "image/png"
+    except MermaidPoolBusy:
+        raise
+    except MermaidPoolError as e:
+        logger.warning("Mermaid pool failed, falling back to mmdc: %s", e)
+        return None
+
+
+def render_mermaid(code, out_format, theme, one_shot):
+    """:func:`render_pooled`, else ``one_shot(code, out_format)``."""
+    with stage("mermaid"):
+        return render_pooled(code, out_format, theme) or one_shot(code, out_format)
+
+
+@atexit.register
+def _shutdown_pool():
+    if _mermaid_pool is not None and _mermaid_pool.pid == os.getpid():
+        _mermaid_pool.shutdown()
@@ -0,0 +1,253 @@
+"""
+/api/circuit: a netlist as a Mermaid flowchart, drawn by the built-in
+renderer (flowchart.py) or by the Mermaid CLI.
+"""
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+
+import pandas as pd
+from rest_framework.views import APIView
+from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
+from rest_framework.response import Response
+from rest_framework import status
+from .render_cache import get_render_cache
+from .ingest import IngestError, netlist_payload, read_netlist
+from .disk_io import record_disk_write
+from .timing import stage, timed
+from .metrics import annotate, observe_input
+from .mermaid_pool import MermaidPoolBusy, render_mermaid
+from . import flowchart
+from .flowchart import use_builtin_renderer
+from .jobs import offload_if_large
+from .views import MERMAID_FORMAT_ERROR, MERMAID_FORMATS, MERMAID_THEME, dumps
+
+
+# Node classes as (fill, stroke, text colour); used for the classDef lines and the built-in renderer
+MERMAID_CLASSES = {
+    "switch": ("#3399ff", "#000", "#ffffff"),
+    "initiator": ("#ffcccc", "#000", "#000000"),
+    "target": ("#ff9966", "#000", "#000000"),
+    "manager": ("#ffff99", "#000", "#000000"),
+    "subordinate": ("#cc99ff", "#000", "#000000"),
+    "other": ("#dddddd", "#000", "#000000"),
+}
+
+class MermaidCircuitAPIView(APIView):
+    parser_classes = (MultiPartParser, FormParser, JSONParser)
+    endpoint = 'circuit'
+    formats = MERMAID_FORMATS
+    # Pillow, for PNG/JPEG from the built-in renderer (flowchart.render_raster)
+    deferred_imports = ("PIL.Image", "PIL.ImageDraw", "PIL.ImageFont")
+
+    def post(self, request, *args, **kwargs):
+        data, fmt = netlist_payload(request)
+        out_format = request.data.get("format", "png").lower() if hasattr(request.data, "get") else "png"
+
+        if data is None:
+            return Response({"error": "No file uploaded"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if out_format not in MERMAID_FORMATS:
+            return Response({"error": MERMAID_FORMAT_ERROR},
+                            status=status.HTTP_400_BAD_REQUEST)
+        annotate(self.endpoint, out_format)
+
+        render_cache = get_render_cache()
+        cache_key = self.cache_key(data, fmt, out_format=out_format)
+        cached = render_cache.lookup(request, cache_key)
+        if cached is not None:
+            return cached
+
+        offloaded = offload_if_large(request, self.endpoint, data, fmt, {'out_format': out_format}, cache_key)
+        if offloaded is not None:
+            return offloaded
+
+        try:
+            body, content_type, headers = self.render(data, fmt, out_format=out_format)
+            return render_cache.store(cache_key, body, content_type, headers)
+
+        except IngestError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        except MermaidPoolBusy as e:
+            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    def cache_key(self, data, fmt, out_format="png"):
+        return get_render_cache().make_key(data, endpoint=self.endpoint, format=out_format, theme=MERMAID_THEME,
+                                           engine=self.engine(out_format), input_format=fmt)
+
+    @staticmethod
+    def engine(out_format):
+        """'builtin' (flowchart.py) or 'mmdc' for a requested output format."""
+        if out_format in ("svg", "mmd", "json") or use_builtin_renderer():
+            return "builtin"
+        return "mmdc"
+
+    def render(self, data, fmt, out_format="png"):
+        """Render a netlist through Mermaid; returns ``(body, content_type, headers)``."""
+        nodes, edges = self.mermaid_graph(data, fmt)
+        if out_format == "mmd":
+            return self._mermaid_text(nodes, edges).encode("utf-8"), "text/plain; charset=utf-8", {}
+        if out_format == "json":
+            # For clients that run mermaid.js themselves
+            source = {"mermaid": self._mermaid_text(nodes, edges), "theme": MERMAID_THEME,
+                      "nodes": len(nodes), "edges": len(edges)}
+            return dumps(source), "application/json", {}
+        if self.engine(out_format) == "builtin":
+            return self.render_builtin(nodes, edges, out_format)
+
+        mmd_text = self._mermaid_text(nodes, edges)
+        image_data, content_type = render_mermaid(mmd_text, out_format, MERMAID_THEME, self._render_mermaid)
+        return image_data, content_type, {}
+
+    def render_builtin(self, nodes, edges, out_format):
+        """Lay out and draw the graph in-process (SVG, or PNG/JPEG via Pillow)."""
+        with stage("layout"):
+            chart = flowchart.layout(
+                [(self._slug(n), n, self._detect_type(n)) for n in nodes],
+                [(self._slug(a), self._slug(b)) for a, b in edges],
+                MERMAID_CLASSES,
+            )
+        with stage("draw"):
+            if out_format == "svg":
+                return flowchart.render_svg(chart), "image/svg+xml", {}
+            content_type = "image/png" if out_format == "png" else "image/jpeg"
+            return flowchart.render_raster(chart, out_format), content_type, {}
+
+    def mermaid_graph(self, data, fmt):
+        with stage("read"):
+            df = read_netlist(data, columns=["Node", "Connects_To"], fmt=fmt)
+
+        required_columns = {"Node", "Connects_To"}
+        if not required_columns.issubset(df.columns):
+            raise IngestError(f"Excel must contain at least these columns: {required_columns}")
+
+        with stage("graph"):
+            nodes, edges = self._mermaid_graph(df)
+        observe_input(rows=len(df), nodes=len(nodes), edges=len(edges))
+        return nodes, edges
+
+    def mermaid_source(self, data, fmt):
+        return self._mermaid_text(*self.mermaid_graph(data, fmt))
+
+    def _slug(self, label: str) -> str:
+        """Make safe IDs for Mermaid nodes."""
+        s = re.sub(r"\W+", "_", str(label).strip())
+        if not re.match(r"^[A-Za-z]", s):
+            s = "N_" + s
+        return s
+
+    def _detect_type(self, label: str) -> str:
+        """Detect node category from label."""
+        l = label.lower()
+        if "switch" in l:
+            return "switch"
+        if "initiator" in l:
+            return "initiator"
+        if "target" in l:
+            return "target"
+        if "manager" in l:
+            return "manager"
+        if "subordinate" in l:
+            return "subordinate"
+        return "other"
+
+    def _generate_mermaid(self, df: pd.DataFrame) -> str:
+        return self._mermaid_text(*self._mermaid_graph(df))
+
+    def _mermaid_graph(self, df: pd.DataFrame):
+        """Node labels (first-seen order) and (from, to) edges of the netlist."""
+        nodes = {}
+        edges = []
+
+        for _, row in df.iterrows():
+            a = str(row["Node"]).strip()
+            b = str(row["Connects_To"]).strip() if pd.notna(row["Connects_To"]) else ""
+
+            if a: nodes[a] = None
+            if b: nodes[b] = None
+            if a and b:
+                edges.append((a, b))
+
+        return list(nodes), edges
+
+    @timed("mermaid_source")
+    def _mermaid_text(self, nodes, edges) -> str:
+        lines = ["flowchart TB"]
+
+        # Add nodes with proper escaping
+        for n in nodes:
+            nid = self._slug(n)
+            ntype = self._detect_type(n)
+            # Escape quotes and special characters in labels
+            safe_label = n.replace('"', '&quot;').replace("'", "&#39;")
+            lines.append(f'{nid}["{safe_label}"]:::cls_{ntype}')
+
+        # Add edges
+        for a, b in edges:
+            lines.append(f"{self._slug(a)} --> {self._slug(b)}")
+
+        # Add an empty line before styling for better readability
+        lines.append("")
+
+        # Styling with proper syntax (no quotes around color values)
+        lines += [
+            f"classDef cls_{name} fill:{fill},stroke:{stroke},color:{color}"
+            for name, (fill, stroke, color) in MERMAID_CLASSES.items()
+        ]
+        
+        return "\n".join(line.strip() for line in lines if line.strip())
+
+    def _render_mermaid(self, mmd_text: str, out_format: str):
+        with tempfile.TemporaryDirectory() as td:
+            in_path = os.path.join(td, "diagram.mmd")
+            out_ext = "png" if out_format == "png" else "jpg"
+            out_path = os.path.join(td, f"diagram.{out_ext}")
+
+            with open(in_path, "w", encoding="utf-8") as f:
+                f.write(mmd_text)
+
+            # Run and capture error
+            result = subprocess.run(
+                self._mmdc_command(in_path, out_path),
+                capture_output=True,
+                text=True
+            )
+
+            if result.returncode != 0:
+                self._render_failed(td, mmd_text, result.returncode, result.stdout, result.stderr)
+
+            with open(out_path, "rb") as f:
+                blob = f.read()
+            record_disk_write(len(mmd_text.encode("utf-8")) + len(blob))
+
+            content_type = "image/png" if out_ext == "png" else "image/jpeg"
+            return blob, content_type
+
+    @staticmethod
+    def _mmdc_command(in_path, out_path):
+        mmdc_path = shutil.which("mmdc") or shutil.which("mmdc.cmd")
+        if not mmdc_path:
+            raise FileNotFoundError("Mermaid CLI (mmdc) not found. Install globally: npm install -g @mermaid-js/mermaid-cli")
+        return [mmdc_path, "-i", in_path, "-o", out_path, "-t", MERMAID_THEME, "-b", "transparent"]
+
+    @staticmethod
+    def _render_failed(td, mmd_text, returncode, stdout, stderr):
+        debug_path = os.path.join(td, "debug_diagram.mmd")
+        with open(debug_path, "w", encoding="utf-8") as dbg:
+            dbg.write(mmd_text)
+
+        raise RuntimeError(
+            f"Mermaid render failed with code {returncode}\n"
+            f"STDOUT:\n{stdout}\n\nSTDERR:\n{stderr}\n\n"
+            f"Mermaid input was saved at: {debug_path}\n"
+            f"Generated Mermaid code:\n"
+            f"---\n"
+            f"{mmd_text}\n"
+            f"---"
+        )
@@ -0,0 +1,509 @@
+"""
+Prometheus metrics for every server process, without a client library or
+an external service.
+
+Each process keeps its counters and histograms in memory and writes them
+as ``<LOCATION>/<pid>-<start>.json`` every ``FLUSH_SECONDS`` (and at
+exit). ``/metrics`` merges the files of every process that has written
+one, including processes that have since exited so counters never go
+backwards, with the live state of the process serving the scrape. So any
+WSGI worker behind the load balancer can answer the scrape for all of
+them. A scrape folds the files of processes that have exited (stale and
+their pid gone, like prometheus_client's ``mark_process_dead``) into one
+``dead.json`` aggregate and deletes them, so recycled workers do not pile
+up files in ``LOCATION``. The pid check assumes every process sharing
+``LOCATION`` runs on the same host.
+
+Request metrics are recorded by ``metrics_middleware``: the render views
+:func:`annotate` the request with their endpoint and output format, and
+the renderers report input sizes with :func:`observe_input`. Per-process
+gauges (RSS, pool queues) carry a ``pid`` label and are only reported for
+processes whose file is fresh.
+"""
+import atexit
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.decorators import sync_and_async_middleware
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_METRICS_CONFIG = {
+    'ENABLED': True,
+    # Directory shared by the server's processes (the same one for every worker)
+    'LOCATION': os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.path.join(tempfile.gettempdir(), 'diagram_metrics'),
+    'FLUSH_SECONDS': 5.0,  # how often each process writes its metrics for the others
+    # Histogram bucket upper bounds (a last +Inf bucket is implied)
+    'DURATION_BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+    'SIZE_BUCKETS': (10, 30, 100, 300, 1000, 3000, 10000, 30000, 100000),
+    'BYTES_BUCKETS': (1 << 10, 1 << 12, 1 << 14, 1 << 16, 1 << 18, 1 << 20, 1 << 22, 1 << 24, 1 << 26),
+}
+
+# name: (type, help, buckets setting)
+METRICS = {
+    'diagram_requests_total': (
+        'counter', "Requests by endpoint, output format, status and render-cache result.", None),
+    'diagram_request_duration_seconds': (
+        'histogram', "Request latency by endpoint and output format.", 'DURATION_BUCKETS'),
+    'diagram_output_bytes': (
+        'histogram', "Response body size (before compression) by endpoint and output format.", 'BYTES_BUCKETS'),
+    'diagram_input_rows': ('histogram', "Netlist rows per render.", 'SIZE_BUCKETS'),
+    'diagram_input_nodes': ('histogram', "Diagram nodes (devices) per render.", 'SIZE_BUCKETS'),
+    'diagram_input_edges': ('histogram', "Diagram edges (connections) per render.", 'SIZE_BUCKETS'),
+}
+
+# Labels of the request being served ({'endpoint', 'format', 'rows', ...}), or None outside a request
+_request_labels = contextvars.ContextVar('diagram_metrics', default=None)
+
+
+def get_metrics_config():
+    return {**DEFAULT_METRICS_CONFIG, **getattr(settings, 'DIAGRAM_METRICS', {})}
+
+
+def annotate(endpoint=None, format=None):
+    """Label the current request with its render endpoint and output format."""
+    labels = _request_labels.get()
+    if labels is not None:
+        if endpoint is not None:
+            labels['endpoint'] = endpoint
+        if format is not None:
+            labels['format'] = format
+
+
+def observe_input(rows=None, nodes=None, edges=None):
+    """Report the size of the netlist the current request renders."""
+    labels = _request_labels.get()
+    if labels is not None:
+        for name, value in (('rows', rows), ('nodes', nodes), ('edges', edges)):
+            if value is not None:
+                labels[name] = value
+
+
+def measured(func, *args):
+    """
+    ``(func(*args), input sizes it reported)``: for renders in a pool
+    process, whose sizes the request process passes to :func:`observe_input`.
+    """
+    labels = {}
+    token = _request_labels.set(labels)
+    try:
+        return func(*args), labels
+    finally:
+        _request_labels.reset(token)
+
+
+class ProcessMetrics:
+    """Counters and histograms of one process, and its file in ``LOCATION``."""
+
+    def __init__(self, config):
+        self.config = config
+        self.pid = os.getpid()
+        self.path = os.path.join(config['LOCATION'], f"{self.pid}-{time.time_ns()}.json")
+        self.counters = {}     # (name, labels) -> value
+        self.histograms = {}   # (name, labels) -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        bounds = self.config[METRICS[name][2]]
+        key = (name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(bounds) + 1) + [0.0]
+            histogram[bisect_left(bounds, value)] += 1
+            histogram[-1] += value
+
+    def snapshot(self, gauges=True):
+        with self._lock:
+            counters = [[name, list(labels), value] for (name, labels), value in self.counters.items()]
+            histograms = [[name, list(labels), list(values)] for (name, labels), values in self.histograms.items()]
+        return {
+            'pid': self.pid,
+            'written': time.time(),
+            'counters': counters,
+            'histograms': histograms,
+            'gauges': process_gauges() if gauges else [],
+        }
+
+    def write(self, gauges=True):
+        """Write this process's snapshot atomically (readers never see half a file)."""
+        os.makedirs(self.config['LOCATION'], exist_ok=True)
+        snapshot = self.snapshot(gauges)
+        fd, tmp_path = tempfile.mkstemp(dir=self.config['LOCATION'], suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(snapshot, f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        return snapshot
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._flush_loop, name="diagram-metrics", daemon=True)
+                self._thread.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.config['FLUSH_SECONDS'])
+            try:
+                self.write()
+            except OSError:
+                logger.exception("Writing metrics to %s failed", self.path)
+
+
+_process_metrics = None
+_process_metrics_lock = threading.Lock()
+
+
+def get_process_metrics():
+    """This process's metrics (a forked worker starts its own, empty)."""
+    global _process_metrics
+    if _process_metrics is None or _process_metrics.pid != os.getpid():
+        with _process_metrics_lock:
+            if _process_metrics is None or _process_metrics.pid != os.getpid():
+                _process_metrics = ProcessMetrics(get_metrics_config())
+    return _process_metrics
+
+
+@atexit.register
+def _write_at_exit():
+    # Counters outlive the process; its gauges do not
+    if _process_metrics is not None and _process_metrics.pid == os.getpid():
+        try:
+            _process_metrics.write(gauges=False)
+        except OSError:
+            pass
+
+
+def _resident_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource  # not on Windows; peak rather than current RSS
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def process_gauges():
+    """``[[name, labels, value]]`` of this process's resources and pools (only the pools it started)."""
+    from . import export_pool, jobs, mermaid_pool, render_pool
+
+    pid = str(os.getpid())
+    gauges = [['diagram_process_resident_memory_bytes', [['pid', pid]], _resident_bytes()]]
+    depth = render_pool.queue_depth()
+    if depth is not None:
+        gauges.append(['diagram_render_pool_queue_depth', [['pid', pid]], depth])
+    for name, pool in (('export', export_pool._export_pool), ('mermaid', mermaid_pool._mermaid_pool)):
+        if pool is not None:
+            stats = pool.stats()
+            labels = [['pid', pid], ['pool', name]]
+            gauges.append(['diagram_pool_waiting', labels, stats['waiting']])
+            gauges.append(['diagram_pool_busy', labels, stats['busy']])
+    manager = jobs._job_manager
+    if manager is not None and manager.pid == os.getpid():
+        gauges.append(['diagram_job_queue_depth', [['pid', pid]], manager.queue_depth()])
+    return gauges
+
+
+GAUGE_HELP = {
+    'diagram_process_resident_memory_bytes': "Resident memory of each server process.",
+    'diagram_render_pool_queue_depth': "Renders submitted to the render process pool and not finished, per process.",
+    'diagram_pool_waiting': "Requests waiting for a worker of the export or Mermaid pool, per process.",
+    'diagram_pool_busy': "Busy workers of the export or Mermaid pool, per process.",
+    'diagram_job_queue_depth': "Background jobs queued and not yet started, per process.",
+    'diagram_temp_files': "Files in each on-disk store.",
+    'diagram_temp_bytes': "Bytes in each on-disk store.",
+    'diagram_render_cache_hit_ratio': "Render-cache hits over hits and misses, by endpoint, for all processes.",
+    'diagram_metrics_processes': "Server processes whose metrics are fresh.",
+}
+
+
+def temp_file_gauges():
+    """File counts and sizes of the on-disk stores (temp files of jobs, caches, revisions)."""
+    from .jobs import get_jobs_config
+    from .netlist import get_model_cache_config
+    from .render_cache import DEFAULT_CACHE_CONFIG
+    from .revisions import get_revisions_config
+
+    render_cache_config = {**DEFAULT_CACHE_CONFIG, **(getattr(settings, 'DIAGRAM_RENDER_CACHE', None) or {})}
+    stores = {'jobs': get_jobs_config()['LOCATION'], 'revisions': get_revisions_config()['LOCATION']}
+    for store, config in (('render_cache', render_cache_config), ('models', get_model_cache_config())):
+        if config.get('BACKEND') == 'disk':
+            stores[store] = config['LOCATION']
+    gauges = []
+    for store, location in stores.items():
+        files = size = 0
+        for root, _, names in os.walk(location):
+            for name in names:
+                try:
+                    size += os.stat(os.path.join(root, name)).st_size
+                except OSError:
+                    continue
+                files += 1
+        gauges.append(['diagram_temp_files', [['store', store]], files])
+        gauges.append(['diagram_temp_bytes', [['store', store]], size])
+    return gauges
+
+
+DEAD_FILE = 'dead.json'
+
+
+@contextlib.contextmanager
+def _locked(location):
+    """Hold the lock of ``location`` against other processes folding or reading its files."""
+    try:
+        import fcntl
+    except ImportError:  # not on Windows; scrapes there only read
+        yield
+        return
+    with open(os.path.join(location, '.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _is_running(pid):
+    if os.name == 'nt':
+        return True  # os.kill(pid, 0) would terminate it
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # another user's process
+    return True
+
+
+def _merge(counters, histograms, snapshot):
+    for name, labels, value in snapshot['counters']:
+        key = (name, tuple(map(tuple, labels)))
+        counters[key] = counters.get(key, 0) + value
+    for name, labels, values in snapshot['histograms']:
+        key = (name, tuple(map(tuple, labels)))
+        merged = histograms.get(key)
+        histograms[key] = values if merged is None else [a + b for a, b in zip(merged, values)]
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None   # being replaced, or removed
+
+
+def read_snapshots(location, skip, stale):
+    """
+    The snapshots in ``location`` except ``skip`` (the caller's own file):
+    the ``dead.json`` aggregate of exited processes first, then one per
+    running process. Files of processes that have exited are folded into
+    the aggregate and deleted first.
+    """
+    if not os.path.isdir(location):
+        return []
+    with _locked(location):
+        dead_path = os.path.join(location, DEAD_FILE)
+        dead = _read_json(dead_path) or {'written': 0, 'counters': [], 'histograms': [], 'gauges': [], 'folded': []}
+        snapshots, folded = [], []
+        for name in os.listdir(location):
+            path = os.path.join(location, name)
+            if not name.endswith('.json') or name == DEAD_FILE or path == skip:
+                continue
+            if name in dead['folded']:
+                # Folded by a scrape that stopped before deleting it
+                with contextlib.suppress(OSError):
+                    os.unlink(path)
+                continue
+            snapshot = _read_json(path)
+            if snapshot is None:
+                continue
+            if snapshot['written'] < stale and not _is_running(snapshot['pid']):
+                folded.append((name, snapshot))
+            else:
+                snapshots.append(snapshot)
+
+        if folded:
+            counters, histograms = {}, {}
+            for snapshot in (dead, *(snapshot for _, snapshot in folded)):
+                _merge(counters, histograms, snapshot)
+            dead = {
+                'written': 0,  # never fresh: an aggregate has no gauges
+                'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+                'histograms': [[name, list(labels), values] for (name, labels), values in histograms.items()],
+                'gauges': [],
+                'folded': [name for name, _ in folded],
+            }
+            fd, tmp_path = tempfile.mkstemp(dir=location, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(dead, f, separators=(",", ":"))
+            os.replace(tmp_path, dead_path)
+            for name, _ in folded:
+                with contextlib.suppress(OSError):
+                    os.unlink(os.path.join(location, name))
+    return [dead, *snapshots]
+
+
+def collect(config=None):
+    """
+    Merged ``(counters, histograms, gauges)`` of every process: this one's
+    live state plus the last file written by each of the others, and the
+    aggregate of processes that have exited.
+    """
+    config = config or get_metrics_config()
+    current = get_process_metrics()
+    stale = time.time() - 3 * config['FLUSH_SECONDS']
+    snapshots = [current.write(), *read_snapshots(config['LOCATION'], current.path, stale)]
+
+    counters, histograms, gauges = {}, {}, {}
+    live = 0
+    for snapshot in snapshots:
+        _merge(counters, histograms, snapshot)
+        if snapshot['written'] >= stale:
+            live += 1
+            for name, labels, value in snapshot['gauges']:
+                gauges[(name, tuple(map(tuple, labels)))] = value
+
+    for name, labels, value in temp_file_gauges():
+        gauges[(name, tuple(map(tuple, labels)))] = value
+    lookups = {}
+    for (name, labels), value in counters.items():
+        if name == 'diagram_requests_total':
+            label = dict(labels)
+            if label['cache'] in ('hit', 'miss'):
+                hits_total = lookups.setdefault(label['endpoint'], [0, 0])
+                hits_total[0] += value if label['cache'] == 'hit' else 0
+                hits_total[1] += value
+    for endpoint, (hits, total) in lookups.items():
+        gauges[('diagram_render_cache_hit_ratio', (('endpoint', endpoint),))] = hits / total
+    gauges[('diagram_metrics_processes', ())] = live
+    return counters, histograms, gauges
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _series(name, labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return name
+    return name + "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _number(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def exposition(config=None):
+    """All metrics in the Prometheus text format (version 0.0.4)."""
+    config = config or get_metrics_config()
+    counters, histograms, gauges = collect(config)
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{_series(name, labels)} {_number(value)}")
+            continue
+        bounds = config[buckets]
+        for (metric, labels), values in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip((*bounds, "+Inf"), values[:-1]):
+                cumulative += count
+                lines.append(f"{_series(name + '_bucket', labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{_series(name + '_sum', labels)} {_number(values[-1])}")
+            lines.append(f"{_series(name + '_count', labels)} {cumulative}")
+    for name, help_text in GAUGE_HELP.items():
+        series = sorted((labels, value) for (metric, labels), value in gauges.items() if metric == name)
+        if not series:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(f"{_series(name, labels)} {_number(value)}" for labels, value in series)
+    return "\n".join(lines) + "\n"
+
+
+def _route(request):
+    match = getattr(request, "resolver_match", None)
+    return "/" + match.route if match is not None else "unresolved"
+
+
+def _body_bytes(response):
+    if response.streaming:
+        length = response.get('Content-Length')
+        return int(length) if length else None
+    return len(response.content)
+
+
+def _start():
+    labels = {}
+    return labels, _request_labels.set(labels), time.perf_counter()
+
+
+def _finish(request, response, labels, token, started):
+    elapsed = time.perf_counter() - started
+    _request_labels.reset(token)
+    metrics = get_process_metrics()
+    if metrics._thread is None:
+        metrics.start()
+    endpoint = labels.get('endpoint') or _route(request)
+    out_format = labels.get('format', "")
+    cache = (response.get('X-Render-Cache') or "none").lower()
+    metrics.inc('diagram_requests_total', (('endpoint', endpoint), ('format', out_format),
+                                           ('status', str(response.status_code)), ('cache', cache)))
+    by_format = (('endpoint', endpoint), ('format', out_format))
+    metrics.observe('diagram_request_duration_seconds', by_format, elapsed)
+    size = _body_bytes(response)
+    if size is not None:
+        metrics.observe('diagram_output_bytes', by_format, size)
+    for name in ('rows', 'nodes', 'edges'):
+        if name in labels:
+            metrics.observe(f'diagram_input_{name}', (('endpoint', endpoint),), labels[name])
+    return response
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """Count requests and observe their latency, sizes and cache results for ``/metrics``."""
+    if not get_metrics_config()['ENABLED']:
+        raise MiddlewareNotUsed()
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            labels, token, started = _start()
+            return _finish(request, await get_response(request), labels, token, started)
+    else:
+        def middleware(request):
+            labels, token, started = _start()
+            return _finish(request, get_response(request), labels, token, started)
+    return middleware
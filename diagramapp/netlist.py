@@ -0,0 +1,153 @@
+"""
+Parsed netlist model shared by the drawing stages of DynamicCircuitDiagram.
+
+A :class:`Netlist` is built once per upload (``DynamicCircuitDiagram.prepare``)
+and holds fixed-shape tables instead of DataFrames or per-row dicts:
+
+- ``devices``: one entry per device name, integer ids, last position wins;
+- ``buses``: interned bus names with integer ids and the y of extended buses;
+- ``rows``: the per-row chip columns, devices referenced by id;
+- ``drops`` / ``segments``: device-to-bus and device-to-device connections,
+  buses referenced by id, each entry tagged with its source row;
+- ``arrows``: free arrows, or None when the netlist has no arrow columns.
+
+Every table uses ``__slots__``, so memory per device is a fixed set of
+column cells. Models pickle compactly and are cached by upload content
+(:func:`get_model_cache`), independently of the rendered output.
+"""
+import os
+import sys
+import tempfile
+import threading
+
+from django.conf import settings
+
+from .render_cache import ObjectCache, RenderCache, build_backend
+
+
+DEFAULT_MODEL_CACHE_CONFIG = {
+    'BACKEND': 'memory',        # 'memory', 'disk' or None to disable
+    'LOCATION': os.path.join(tempfile.gettempdir(), 'diagram_models'),
+    'MAX_BYTES': 64 * 1024 * 1024,
+    'MAX_ENTRIES': 64,
+}
+
+# Bump when the tables change shape, so cached models from older code are ignored
+MODEL_VERSION = 1
+
+
+class Table:
+    """Column store: one attribute (list or array) per name in ``__slots__``."""
+    __slots__ = ()
+
+    def __init__(self, **columns):
+        for name in self.__slots__:
+            setattr(self, name, columns[name])
+
+    def __len__(self):
+        return len(getattr(self, self.__slots__[0]))
+
+
+class Devices(Table):
+    __slots__ = ('names', 'index', 'x', 'y')
+
+    @classmethod
+    def from_rows(cls, names, xs, ys):
+        index = {}
+        x, y = [], []
+        for name, xi, yi in zip(names, xs, ys):
+            i = index.get(name)
+            if i is None:
+                index[name] = len(x)
+                x.append(xi)
+                y.append(yi)
+            else:
+                x[i], y[i] = xi, yi
+        return cls(names=list(index), index=index, x=x, y=y)
+
+    def position(self, name):
+        i = self.index.get(name)
+        return None if i is None else (self.x[i], self.y[i])
+
+
+class Buses(Table):
+    __slots__ = ('names', 'index', 'line_y')
+
+    @classmethod
+    def empty(cls):
+        return cls(names=[], index={}, line_y=[])
+
+    def intern(self, name):
+        """Integer id of a bus name, adding it on first sight."""
+        i = self.index.get(name)
+        if i is None:
+            i = self.index[name] = len(self.names)
+            self.names.append(sys.intern(name))
+            self.line_y.append(None)
+        return i
+
+    def line_of(self, name):
+        """y of an extended bus, or None."""
+        i = self.index.get(name)
+        return None if i is None else self.line_y[i]
+
+    def colors(self, palette, default="black"):
+        return [palette.get(name, default) for name in self.names]
+
+
+class Rows(Table):
+    __slots__ = ('device', 'device_type', 'address', 'x', 'y')
+
+
+class Drops(Table):
+    __slots__ = ('row', 'bus', 'x', 'y0', 'y1', 'dash')
+
+
+class Segments(Table):
+    __slots__ = ('row', 'bus', 'start_x', 'end_x', 'bus_y', 'mid_x')
+
+
+class Arrows(Table):
+    __slots__ = ('row', 'x', 'y', 'ax', 'ay', 'color')
+
+
+class Netlist:
+    __slots__ = ('devices', 'buses', 'rows', 'drops', 'segments', 'arrows')
+
+    def __init__(self, devices, buses, rows, drops, segments, arrows=None):
+        self.devices = devices
+        self.buses = buses
+        self.rows = rows
+        self.drops = drops
+        self.segments = segments
+        self.arrows = arrows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def device_names(self):
+        """Device name of every row."""
+        names = self.devices.names
+        return [names[i] for i in self.rows.device]
+
+
+def get_model_cache_config():
+    return {**DEFAULT_MODEL_CACHE_CONFIG, **getattr(settings, 'DIAGRAM_MODEL_CACHE', {})}
+
+
+def model_key(data, fmt, model):
+    return RenderCache.make_key(data, model=model, version=MODEL_VERSION, input_format=fmt)
+
+
+_model_cache = None
+_model_cache_lock = threading.Lock()
+
+
+def get_model_cache():
+    """Process-wide cache of parsed netlists, configured from ``settings.DIAGRAM_MODEL_CACHE``."""
+    global _model_cache
+    if _model_cache is None:
+        with _model_cache_lock:
+            if _model_cache is None:
+                _model_cache = ObjectCache(build_backend(get_model_cache_config()))
+    return _model_cache
@@ -0,0 +1,74 @@
+// Long-running Mermaid renderer driven by diagramapp/mermaid_pool.py.
+//
+// Keeps one headless browser open and renders diagrams with mermaid-cli's
+// renderMermaid(). Protocol: one JSON object per line on stdin/stdout.
+//   startup  -> {"ready": true} | {"ready": false, "error": "..."}
+//   request  <- {"id": 1, "code": "flowchart TB ...", "format": "png",
+//                "theme": "default", "backgroundColor": "transparent"}
+//   response -> {"id": 1, "ok": true, "data": "<base64>"} | {"id": 1, "ok": false, "error": "..."}
+//
+// MERMAID_CLI_DIR points at the installed @mermaid-js/mermaid-cli package;
+// PUPPETEER_CONFIG is an optional JSON object passed to puppeteer.launch().
+import { createRequire } from "node:module";
+import { readFileSync } from "node:fs";
+import path from "node:path";
+import readline from "node:readline";
+import { pathToFileURL } from "node:url";
+
+function send(message) {
+  process.stdout.write(JSON.stringify(message) + "\n");
+}
+
+async function loadModules(cliDir) {
+  const pkg = JSON.parse(readFileSync(path.join(cliDir, "package.json"), "utf8"));
+  let entry = pkg.exports;
+  if (entry && typeof entry === "object") entry = entry["."] ?? entry;
+  if (entry && typeof entry === "object") entry = entry.import ?? entry.default;
+  entry = entry || pkg.main || "src/index.js";
+  const cli = await import(pathToFileURL(path.join(cliDir, entry)).href);
+
+  // puppeteer is a dependency of mermaid-cli; resolve it from there
+  const require = createRequire(path.join(cliDir, "package.json"));
+  const puppeteer = await import(pathToFileURL(require.resolve("puppeteer")).href);
+  return { renderMermaid: cli.renderMermaid, puppeteer: puppeteer.default ?? puppeteer };
+}
+
+async function main() {
+  let browser, renderMermaid;
+  try {
+    const modules = await loadModules(process.env.MERMAID_CLI_DIR);
+    renderMermaid = modules.renderMermaid;
+    const launchConfig = JSON.parse(process.env.PUPPETEER_CONFIG || "{}");
+    browser = await modules.puppeteer.launch({ headless: true, ...launchConfig });
+  } catch (err) {
+    send({ ready: false, error: String(err && err.stack || err) });
+    process.exit(1);
+  }
+  send({ ready: true });
+
+  const shutdown = async () => {
+    try { await browser.close(); } finally { process.exit(0); }
+  };
+  process.on("SIGTERM", shutdown);
+
+  // Requests are handled one at a time; the pool never pipelines a worker
+  const lines = readline.createInterface({ input: process.stdin, crlfDelay: Infinity });
+  for await (const line of lines) {
+    if (!line.trim()) continue;
+    let request;
+    try {
+      request = JSON.parse(line);
+      const { data } = await renderMermaid(browser, request.code, request.format || "png", {
+        backgroundColor: request.backgroundColor || "white",
+        mermaidConfig: { theme: request.theme || "default" },
+        viewport: { width: 800, height: 600, deviceScaleFactor: 1 },
+      });
+      send({ id: request.id, ok: true, data: Buffer.from(data).toString("base64") });
+    } catch (err) {
+      send({ id: request && request.id, ok: false, error: String(err && err.message || err) });
+    }
+  }
+  await shutdown();
+}
+
+main();
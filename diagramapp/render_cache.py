@@ -0,0 +1,355 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+
+from .disk_io import record_disk_write, spool_body
+from .timing import stage
+
+
+DEFAULT_CACHE_CONFIG = {
+    'BACKEND': 'memory',        # 'memory', 'disk' or None to disable
+    'LOCATION': os.path.join(tempfile.gettempdir(), 'diagram_render_cache'),
+    'MAX_BYTES': 256 * 1024 * 1024,
+    'MAX_ENTRIES': 1024,
+}
+
+
+class MemoryCacheBackend:
+    """In-process LRU store, bounded by total body size and entry count."""
+
+    def __init__(self, max_bytes, max_entries, **kwargs):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # {key: (meta, body)}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def set(self, key, meta, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[1])
+            self._entries[key] = (meta, body)
+            self._size += len(body)
+            while self._entries and (self._size > self.max_bytes or len(self._entries) > self.max_entries):
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        return {'entries': len(self._entries), 'bytes': self._size}
+
+
+class DiskCacheBackend:
+    """
+    Directory-backed LRU store. Each entry is one file: a JSON meta line
+    followed by the raw body. Recency is tracked through file mtimes so the
+    order survives restarts and is shared by every process using the directory.
+    """
+
+    suffix = '.render'
+
+    def __init__(self, location, max_bytes, max_entries, **kwargs):
+        self.location = str(location)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(self.location, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.location, key + self.suffix)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                meta = json.loads(f.readline())
+                body = f.read()
+            os.utime(path)  # bump recency
+        except (OSError, ValueError):
+            return None
+        return meta, body
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def set(self, key, meta, body):
+        if len(body) > self.max_bytes:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.location, suffix='.tmp')
+        try:
+            header = json.dumps(meta).encode('utf-8') + b'\n'
+            with os.fdopen(fd, 'wb') as f:
+                f.write(header)
+                f.write(body)
+            os.replace(tmp_path, self._path(key))
+            record_disk_write(len(header) + len(body))
+        except OSError:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            return
+        self._evict()
+
+    def _scan(self):
+        entries = []
+        for name in os.listdir(self.location):
+            if not name.endswith(self.suffix):
+                continue
+            try:
+                st = os.stat(os.path.join(self.location, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+        return entries
+
+    def _evict(self):
+        with self._lock:
+            entries = sorted(self._scan())
+            total = sum(size for _, size, _ in entries)
+            while entries and (total > self.max_bytes or len(entries) > self.max_entries):
+                _, size, name = entries.pop(0)
+                try:
+                    os.unlink(os.path.join(self.location, name))
+                except OSError:
+                    pass
+                total -= size
+
+    def clear(self):
+        for _, _, name in self._scan():
+            try:
+                os.unlink(os.path.join(self.location, name))
+            except OSError:
+                pass
+
+    def stats(self):
+        entries = self._scan()
+        return {'entries': len(entries), 'bytes': sum(size for _, size, _ in entries)}
+
+
+BACKENDS = {
+    'memory': MemoryCacheBackend,
+    'disk': DiskCacheBackend,
+}
+
+
+class RenderCache:
+    """
+    Content-addressed cache of rendered diagram responses.
+
+    Keys are a SHA-256 over the uploaded bytes and every output parameter
+    that influences the render, so the same key always maps to the same
+    body. That also makes the key usable as a strong ETag: a client that
+    sends it back in ``If-None-Match`` gets 304 on GET (tiles) and 412 on
+    the POST render endpoints instead of the body.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    @staticmethod
+    def make_key(data, **params):
+        h = hashlib.sha256()
+        h.update(json.dumps(params, sort_keys=True, default=str).encode('utf-8'))
+        h.update(b'\0')
+        h.update(data)
+        return h.hexdigest()
+
+    @staticmethod
+    def etag_for(key):
+        return f'"{key}"'
+
+    def get(self, key):
+        entry = self.backend.get(key) if self.enabled else None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def __contains__(self, key):
+        """Whether ``key`` is cached, without reading it (or counting a hit or miss)."""
+        return self.enabled and key in self.backend
+
+    def set(self, key, meta, body):
+        if self.enabled:
+            self.backend.set(key, meta, body)
+
+    def clear(self):
+        if self.enabled:
+            self.backend.clear()
+        with self._lock:
+            self.hits = self.misses = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        data = {
+            'backend': type(self.backend).__name__ if self.enabled else None,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': (self.hits / total) if total else 0.0,
+        }
+        if self.enabled:
+            data.update(self.backend.stats())
+        return data
+
+    # --- HTTP helpers ---
+
+    def not_modified(self, request, key):
+        """
+        The response when ``If-None-Match`` names the render for ``key`` (or
+        is ``*`` and that render is cached), or None. RFC 9110 section 13.1.2 only allows 304 Not Modified for GET and
+        HEAD; any other method (the render endpoints are POST-only) gets
+        412 Precondition Failed.
+        """
+        if_none_match = request.headers.get('If-None-Match', '')
+        etag = self.etag_for(key)
+        tags = [t.strip() for t in if_none_match.split(',')]
+        if etag in tags or f'W/{etag}' in tags or ('*' in tags and key in self):
+            if request.method in ('GET', 'HEAD'):
+                response = HttpResponseNotModified()
+            else:
+                response = HttpResponse(status=412)
+            response['ETag'] = etag
+            return response
+        return None
+
+    def lookup(self, request, key):
+        """Return a 304/412 for a matching ``If-None-Match``, a cached response for ``key``, or None on a miss."""
+        with stage("cache"):
+            response = self.not_modified(request, key)
+            if response is not None:
+                return response
+            entry = self.get(key)
+            if entry is None:
+                return None
+            meta, body = entry
+            return self._build_response(key, meta, body, 'HIT')
+
+    def store(self, key, body, content_type, headers=None, stream=False):
+        """
+        Cache a freshly rendered body and return the response for it.
+        With ``stream`` the body (now and on later hits) is streamed from an
+        in-memory buffer, spilling to disk only above the spool limit.
+        """
+        meta = {'content_type': content_type, 'headers': headers or {}, 'stream': stream}
+        with stage("cache"):
+            self.set(key, meta, body)
+            return self._build_response(key, meta, body, 'MISS')
+
+    def _build_response(self, key, meta, body, state):
+        if meta.get('stream'):
+            response = FileResponse(spool_body(body), content_type=meta['content_type'])
+        else:
+            response = HttpResponse(body, content_type=meta['content_type'])
+        for name, value in meta.get('headers', {}).items():
+            response[name] = value
+        response['ETag'] = self.etag_for(key)
+        response['X-Render-Cache'] = state
+        return response
+
+
+class ObjectCache:
+    """
+    Python objects (pickled) on one of the backends above, for parsed
+    models that are reused across renders rather than served as responses.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        entry = self.backend.get(key) if self.backend is not None else None
+        value = None
+        if entry is not None:
+            try:
+                value = pickle.loads(entry[1])
+            except Exception:
+                value = None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if self.backend is not None:
+            self.backend.set(key, {}, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def stats(self):
+        data = {
+            'backend': type(self.backend).__name__ if self.backend is not None else None,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+        if self.backend is not None:
+            data.update(self.backend.stats())
+        return data
+
+
+def build_backend(config):
+    """Backend for a ``{'BACKEND', 'LOCATION', 'MAX_BYTES', 'MAX_ENTRIES'}`` config, or None when disabled."""
+    backend_name = config.get('BACKEND')
+    if not backend_name:
+        return None
+    if backend_name not in BACKENDS:
+        raise ValueError(f"Unknown cache backend: {backend_name!r}")
+    return BACKENDS[backend_name](
+        location=config['LOCATION'],
+        max_bytes=config['MAX_BYTES'],
+        max_entries=config['MAX_ENTRIES'],
+    )
+
+
+def build_render_cache(config=None):
+    return RenderCache(build_backend({**DEFAULT_CACHE_CONFIG, **(config or {})}))
+
+
+_render_cache = None
+_render_cache_lock = threading.Lock()
+
+
+def get_render_cache():
+    """Process-wide render cache, configured from ``settings.DIAGRAM_RENDER_CACHE``."""
+    global _render_cache
+    if _render_cache is None:
+        with _render_cache_lock:
+            if _render_cache is None:
+                _render_cache = build_render_cache(getattr(settings, 'DIAGRAM_RENDER_CACHE', None))
+    return _render_cache
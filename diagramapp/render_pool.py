@@ -0,0 +1,140 @@
+import asyncio
+import atexit
+import multiprocessing
+import os
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+
+DEFAULT_RENDER_POOL_CONFIG = {
+    'PROCESSES': os.cpu_count() or 2,  # parse/render processes per server process
+    'MAX_IN_FLIGHT': 256,              # requests waiting on the pool before new ones queue in the loop
+    'TIMEOUT': 120.0,                  # seconds before a request gives up on its render
+}
+
+
+class RenderPoolTimeout(TimeoutError):
+    pass
+
+
+def get_render_pool_config():
+    return {**DEFAULT_RENDER_POOL_CONFIG, **getattr(settings, 'DIAGRAM_RENDER_POOL', {})}
+
+
+def _init_worker():
+    import django
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pythondiagram.settings')
+    django.setup()
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+# Renders submitted through submit() in this process and not finished yet
+_in_flight = 0
+# One admission semaphore per event loop (WSGI runs each async view on a fresh loop)
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def get_render_executor():
+    """Process-wide pool of spawned Django processes for CPU-bound rendering."""
+    global _executor, _executor_pid, _in_flight
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            if _executor_pid != os.getpid():
+                _in_flight = 0  # a forked child inherits the parent's count, not its renders
+            _executor = ProcessPoolExecutor(
+                max_workers=get_render_pool_config()['PROCESSES'],
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+            )
+            _executor_pid = os.getpid()
+    return _executor
+
+
+def _reset_executor(broken):
+    global _executor
+    with _executor_lock:
+        if _executor is broken:
+            _executor = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def warm_up():
+    """Start every render process now instead of on the first renders (each one runs django.setup())."""
+    executor = get_render_executor()
+    # Processes are spawned on demand, one per submission finding none idle
+    futures = [executor.submit(os.getpid) for _ in range(get_render_pool_config()['PROCESSES'])]
+    return len({future.result() for future in futures})
+
+
+def _finished(future):
+    global _in_flight
+    with _executor_lock:
+        _in_flight -= 1
+
+
+def submit(executor, func, *args):
+    """``executor.submit(func, *args)``, counted in :func:`queue_depth` until the render finishes."""
+    global _in_flight
+    future = executor.submit(func, *args)
+    with _executor_lock:
+        _in_flight += 1
+    future.add_done_callback(_finished)
+    return future
+
+
+def queue_depth():
+    """
+    Renders submitted to this process's pool and not finished (queued or
+    running, including renders whose request gave up), or None before the
+    pool starts.
+    """
+    if _executor is None or _executor_pid != os.getpid():
+        return None
+    return _in_flight
+
+
+def _semaphore():
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(get_render_pool_config()['MAX_IN_FLIGHT'])
+    return semaphore
+
+
+async def run_in_pool(func, *args):
+    """
+    Run ``func(*args)`` in the render process pool without blocking the
+    event loop. ``func`` and its arguments must be picklable (module-level
+    functions, bytes, plain dicts). A crashed pool is replaced for the
+    next call.
+
+    On ``TIMEOUT`` the request gets :class:`RenderPoolTimeout` and the render
+    is cancelled if the pool has not picked it up yet; one that started
+    cannot be interrupted: it runs to the end and holds its pool process.
+    :func:`queue_depth` keeps counting it, so abandoned renders show up as
+    pool load rather than idle capacity.
+    """
+    config = get_render_pool_config()
+    async with _semaphore():
+        executor = get_render_executor()
+        try:
+            future = submit(executor, func, *args)
+            return await asyncio.wait_for(asyncio.wrap_future(future), config['TIMEOUT'])
+        except asyncio.TimeoutError:
+            raise RenderPoolTimeout(f"Render did not finish within {config['TIMEOUT']}s")
+        except BrokenProcessPool:
+            _reset_executor(executor)
+            raise
+
+
+@atexit.register
+def _shutdown_executor():
+    if _executor is not None and _executor_pid == os.getpid():
+        _executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,249 @@
+"""
+Incremental re-render of an edited netlist against an earlier revision.
+
+Every render through the revisions endpoint keeps the parsed model of its
+netlist under a diagram id (the render-cache key of that netlist). A
+later upload naming that id as its base is diffed row by row against the
+stored model:
+
+- ``diagram`` (DynamicCircuitDiagram): chips, bus drops, bus segments and
+  arrows are kept per row, keyed by the row's cells plus the positions and
+  bus lines it depends on. Only rows without a match are prepared and drawn
+  again; the figure is assembled from the kept pieces in the usual order
+  as a plain dict (no plotly validation pass), and comes out identical to
+  a full render, so the revision also seeds the render cache and the id
+  is its ETag.
+- ``generate`` (CircuitAPIView): nodes that stay on their row keep their
+  previous x (``layered.relayout``); only new nodes are placed. The image
+  depends on the revision history, so it is not put in the render cache.
+"""
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .circuit_generator import DynamicCircuitDiagram
+from .export_pool import export_figure
+from .layered import relayout
+from .netlist import Devices, Drops, Netlist, Segments
+from .render_cache import ObjectCache, build_backend
+
+
+DEFAULT_REVISIONS_CONFIG = {
+    'BACKEND': 'memory',        # 'memory' or 'disk' (shared by every process using LOCATION)
+    'LOCATION': os.path.join(tempfile.gettempdir(), 'diagram_revisions'),
+    'MAX_BYTES': 128 * 1024 * 1024,
+    'MAX_ENTRIES': 256,
+}
+
+
+def get_revisions_config():
+    return {**DEFAULT_REVISIONS_CONFIG, **getattr(settings, 'DIAGRAM_REVISIONS', {})}
+
+
+_revision_store = None
+_revision_store_lock = threading.Lock()
+
+
+def get_revision_store():
+    """Process-wide store of revision models, configured from ``settings.DIAGRAM_REVISIONS``."""
+    global _revision_store
+    if _revision_store is None:
+        with _revision_store_lock:
+            if _revision_store is None:
+                _revision_store = ObjectCache(build_backend(get_revisions_config()))
+    return _revision_store
+
+
+def diff_tables(old, new):
+    """
+    Added, removed and changed entries between two ``{name: {field: value}}``
+    tables; a changed entry lists its changed fields as ``[old, new]``.
+    """
+    changed = []
+    for name, fields in new.items():
+        before = old.get(name)
+        if before is not None and before != fields:
+            changed.append({
+                'name': name,
+                'fields': {f: [before.get(f), fields.get(f)]
+                           for f in sorted(set(before) | set(fields)) if before.get(f) != fields.get(f)},
+            })
+    return {
+        'added': [name for name in new if name not in old],
+        'removed': [name for name in old if name not in new],
+        'changed': changed,
+    }
+
+
+def _counted(names):
+    """Make repeated names unique: ``a``, ``a #2``, ``a #3`` ..."""
+    seen = {}
+    for name in names:
+        seen[name] = seen.get(name, 0) + 1
+        yield name if seen[name] == 1 else f"{name} #{seen[name]}"
+
+
+class Revision:
+    """Outcome of :meth:`Reviser.revise`: the rendered body plus the new model and the diff."""
+
+    def __init__(self, body, content_type, headers, model, diff, seconds):
+        self.body = body
+        self.content_type = content_type
+        self.headers = headers
+        self.model = model
+        self.diff = diff
+        self.seconds = seconds
+
+
+class CircuitDiagramReviser:
+    """Row-level incremental render for GenerateCircuitDiagramView (``diagram``)."""
+    endpoint = 'diagram'
+    device_fields = ("Device_Type", "X", "Y", "Address")
+
+    def __init__(self, view):
+        self.view = view
+
+    def revise(self, data, fmt, base=None, trace_mode="segments"):
+        started = time.perf_counter()
+        generator = DynamicCircuitDiagram(trace_mode=trace_mode)
+        df = generator.read_excel_data(data, fmt=fmt)
+        columns = list(df.columns)
+        cells = {c: df[c].to_numpy(dtype=object).tolist() for c in columns}
+        blank = [""] * len(df)
+        records = list(zip(*(cells[c] for c in columns))) if columns else []
+
+        devices = Devices.from_rows(cells["From_Device"], cells["X"], cells["Y"])
+        buses = generator.bus_table(df, devices)
+        to_device, connect = cells.get("To_Device", blank), cells.get("Connect_To_Bus", blank)
+        keys = [
+            (record, devices.position(device), devices.position(to),
+             tuple(buses.line_of(b.strip()) for b in str(names).split(",")) if names != "" else ())
+            for record, device, to, names in zip(records, cells["From_Device"], to_device, connect)
+        ]
+
+        # Reuse the pieces of every row whose inputs are unchanged
+        known = base['fragments'] if base else {}
+        fragments = [known.get(key) for key in keys]
+        missing = [r for r, fragment in enumerate(fragments) if fragment is None]
+        if missing:
+            for r, fragment in zip(missing, self._draw_rows(generator, df.iloc[missing], devices, buses)):
+                fragments[r] = fragment
+
+        shapes = [f['shape'] for f in fragments]
+        annotations = [f['label'] for f in fragments]
+        drops = [(r, *drop) for r, f in enumerate(fragments) for drop in f['drops']]
+        segments = [(r, *segment) for r in generator._device_order(df).tolist() for segment in fragments[r]['segments']]
+        netlist = Netlist(devices, buses, rows=None, drops=self._table(Drops, drops, buses),
+                          segments=self._table(Segments, segments, buses))
+
+        traces, comm_annotations = generator.connect_devices(netlist)
+        arrows = [f['arrow'] for f in fragments if f['arrow'] is not None]
+        # All pieces come from the generator's own drawing code; the dict validates to
+        # the figure a full render builds, so plotly's validation pass is skipped
+        fig = generator.figure_dict(traces, shapes, annotations + comm_annotations + arrows)
+        image = export_figure(fig, format="png", width=1000, height=800)
+
+        devices, connections = self._tables(cells, records, columns, blank)
+        model = {
+            'endpoint': self.endpoint,
+            'devices': devices,
+            'connections': connections,
+            'fragments': dict(zip(keys, fragments)),
+        }
+        diff = {
+            'devices': diff_tables(base['devices'] if base else {}, devices),
+            'connections': diff_tables(base['connections'] if base else {}, connections),
+            'rows': {'total': len(records), 'reused': len(records) - len(missing), 'recomputed': len(missing)},
+        }
+        return Revision(image, "image/png", self.view.figure_headers(fig, attachment=True), model, diff,
+                        time.perf_counter() - started)
+
+    @staticmethod
+    def _draw_rows(generator, rows, devices, buses):
+        """Chips, drops, segments and arrows of ``rows``, drawn against the whole netlist."""
+        netlist = generator.prepare(rows.reset_index(drop=True), devices=devices, buses=buses)
+        shapes, labels = generator.create_chips(netlist)
+        fragments = [{'shape': shape, 'label': label, 'arrow': None, 'drops': [], 'segments': []}
+                     for shape, label in zip(shapes, labels)]
+
+        # Buses are kept by name: ids are only stable within one netlist
+        names = buses.names
+        if netlist.arrows is not None:
+            for r, arrow in zip(netlist.arrows.row.tolist(), generator.add_free_arrows(netlist)):
+                fragments[r]['arrow'] = arrow
+        drops = netlist.drops
+        for r, bus, *drop in zip(drops.row.tolist(), drops.bus.tolist(), drops.x, drops.y0, drops.y1, drops.dash):
+            fragments[r]['drops'].append((names[bus], *drop))
+        segments = netlist.segments
+        for r, bus, *segment in zip(segments.row.tolist(), segments.bus.tolist(), segments.start_x,
+                                    segments.end_x, segments.bus_y, segments.mid_x):
+            fragments[r]['segments'].append((names[bus], *segment))
+        return fragments
+
+    @staticmethod
+    def _table(cls, entries, buses):
+        """Drops or Segments from ``(row, bus_name, *values)`` tuples, bus names interned into ``buses``."""
+        columns = [name for name in cls.__slots__ if name not in ('row', 'bus')]
+        values = list(zip(*(entry[2:] for entry in entries))) or [()] * len(columns)
+        return cls(row=np.array([entry[0] for entry in entries], dtype=np.int64),
+                   bus=np.array([buses.intern(entry[1]) for entry in entries], dtype=np.int64),
+                   **{name: list(column) for name, column in zip(columns, values)})
+
+    def _tables(self, cells, records, columns, blank):
+        """Devices (last row wins, like positions) and connection rows, for the diff."""
+        devices = {}
+        for r, device in enumerate(cells["From_Device"]):
+            devices[device] = {f: cells[f][r] for f in self.device_fields if f in cells}
+
+        to_device, connect = cells.get("To_Device", blank), cells.get("Connect_To_Bus", blank)
+        rows = [r for r in range(len(records)) if to_device[r] != "" or connect[r] != ""]
+        names = [f"{cells['From_Device'][r]} -> {to_device[r]}" if to_device[r] != ""
+                 else f"{cells['From_Device'][r]} -> bus {connect[r]}" for r in rows]
+        connections = {
+            name: {c: value for c, value in zip(columns, records[r])
+                   if c not in self.device_fields and c != "From_Device"}
+            for name, r in zip(_counted(names), rows)
+        }
+        return devices, connections
+
+
+class LayeredReviser:
+    """Incremental layout for CircuitAPIView (``generate``): unchanged nodes keep their place."""
+    endpoint = 'generate'
+
+    def __init__(self, view):
+        self.view = view
+
+    def revise(self, data, fmt, base=None):
+        started = time.perf_counter()
+        G = self.view.build_graph(data, fmt)
+        if base:
+            layout = relayout(base['positions'], list(G.nodes), {n: G.nodes[n]["layer"] for n in G.nodes},
+                              list(G.edges), spacing=3.0, layer_gap=3.0)
+        else:
+            layout = self.view.layout(G)
+        body, content_type, headers = self.view.draw(G, layout)
+
+        devices = {str(n): {'Type': G.nodes[n].get("type", "Unknown")} for n in G.nodes}
+        connections = {f"{u} -> {v}": {} for u, v in G.edges}
+        previous = base['positions'] if base else {}
+        kept = sum(1 for n, xy in layout.positions.items() if previous.get(n) == xy)
+        model = {
+            'endpoint': self.endpoint,
+            'devices': devices,
+            'connections': connections,
+            'positions': layout.positions,
+        }
+        diff = {
+            'devices': diff_tables(base['devices'] if base else {}, devices),
+            'connections': diff_tables(base['connections'] if base else {}, connections),
+            'nodes': {'total': G.number_of_nodes(), 'kept': kept, 'moved_or_new': G.number_of_nodes() - kept},
+        }
+        return Revision(body, content_type, headers, model, diff, time.perf_counter() - started)
+
+
+REVISERS = {reviser.endpoint: reviser for reviser in (CircuitDiagramReviser, LayeredReviser)}
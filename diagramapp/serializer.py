@@ -1,15 +1,47 @@
 from rest_framework import serializers
+from .circuit_generator import FIGURE_FORMATS, TRACE_MODES
+from .ingest import FORMATS
 
 class CircuitFileUploadSerializer(serializers.Serializer):
-    file = serializers.FileField(required=True, help_text="Excel file with circuit data")
+    file = serializers.FileField(required=False, help_text="Netlist file (Excel, CSV, Parquet, JSON or JSON-lines)")
+    rows = serializers.ListField(
+        child=serializers.DictField(), required=False,
+        help_text="Netlist rows inline, when posting JSON instead of a file"
+    )
+    trace_mode = serializers.ChoiceField(
+        choices=TRACE_MODES, required=False, default="segments",
+        help_text="'merged' or 'webgl' draw each bus as one trace instead of one per segment"
+    )
+    format = serializers.ChoiceField(
+        choices=FIGURE_FORMATS, required=False, default="png",
+        help_text="'json' returns the plotly figure for client-side rendering instead of a PNG"
+    )
+    figure_bytes = serializers.BooleanField(
+        required=False, default=False,
+        help_text="Also report the figure's JSON size (X-Figure-Bytes) on a PNG; costs a serialization"
+    )
     
     def validate_file(self, value):
         """Validate the uploaded file"""
-        if not value.name.endswith(('.xlsx', '.xls')):
-            raise serializers.ValidationError("File must be an Excel file (.xlsx or .xls)")
+        if not value.name.lower().endswith(tuple(FORMATS)):
+            raise serializers.ValidationError(
+                "File must be a netlist file (" + ", ".join(FORMATS) + ")"
+            )
         
         # Check file size (10MB limit)
         if value.size > 10 * 1024 * 1024:
             raise serializers.ValidationError("File size must be less than 10MB")
         
-        return value
\ No newline at end of file
+        return value
+
+    def validate(self, attrs):
+        if not attrs.get('file') and 'rows' not in attrs:
+            raise serializers.ValidationError("Upload a 'file' or post the netlist 'rows' as JSON")
+        return attrs
+
+
+def validate_upload(data):
+    """``CircuitFileUploadSerializer`` run over a request body (a JSON list is the netlist rows)."""
+    serializer = CircuitFileUploadSerializer(data={'rows': data} if isinstance(data, list) else data)
+    serializer.is_valid()
+    return serializer
@@ -0,0 +1,186 @@
+"""
+Production server: gunicorn with the Django app preloaded in its master.
+
+``manage.py serve`` runs it. The master imports Django, the views of the
+served endpoints and their libraries once (startup.preload), then freezes
+the collector's view of those objects, so the forked workers keep sharing
+their pages copy-on-write instead of each importing (and holding) its
+own copy. Every worker starts its renderer pools before it accepts
+connections and is replaced after MAX_REQUESTS requests (with jitter, so
+the workers do not restart together) or once its resident memory passes
+MAX_RSS_MB; both let in-flight requests finish.
+
+A request may land on any worker, so the stores the API refers back to
+(render cache, parsed models, revision bases, tile scenes and tiles)
+must be shared: with a 'memory' backend each worker keeps its own, and
+a scene or revision created on one worker is missing (404) on the
+others. ``run`` refuses more than one worker while any of them is
+'memory'; settings_production puts them all on 'disk' under one
+DIAGRAM_DATA_DIR.
+
+Needs the gunicorn package (and uvicorn for ``ASGI``).
+"""
+import gc
+import os
+import signal
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from gunicorn.app.base import BaseApplication
+
+
+DEFAULT_SERVER_CONFIG = {
+    'BIND': '127.0.0.1:8000',
+    'ASGI': False,              # uvicorn workers on the ASGI app instead of gthread workers on the WSGI app
+    'WORKERS': None,            # None: one per CPU, at least 2
+    'THREADS': None,            # None: 4 per gthread worker (uploads, cache hits, waits on the renderer pools)
+    'RENDER_PROCESSES': None,   # render pool processes per worker; None: the CPUs shared out between workers
+    'MAX_REQUESTS': 1000,       # replace a worker after this many requests (0: never)
+    'MAX_REQUESTS_JITTER': 100,
+    'MAX_RSS_MB': 1024,         # replace a worker whose resident memory grows past this (None: never)
+    'RSS_CHECK_SECONDS': 5.0,
+    'TIMEOUT': 120,             # seconds a request may hold a worker before it is killed
+    'GRACEFUL_TIMEOUT': 30,     # seconds a replaced worker has to finish its requests
+    'KEEPALIVE': 5,
+    'BACKLOG': 2048,
+}
+
+
+def get_server_config():
+    return {**DEFAULT_SERVER_CONFIG, **getattr(settings, 'DIAGRAM_SERVER', {})}
+
+
+def cpu_count():
+    """CPUs this process may run on (its affinity mask, e.g. a container's share), not the host's."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not Linux
+        return os.cpu_count() or 1
+
+
+def worker_counts(config):
+    """``(workers, threads, render processes per worker)`` for ``config`` on this machine."""
+    cpus = cpu_count()
+    workers = config['WORKERS'] or max(2, cpus)
+    threads = 1 if config['ASGI'] else config['THREADS'] or 4
+    return workers, threads, config['RENDER_PROCESSES'] or max(1, cpus // workers)
+
+
+def per_process_stores():
+    """Settings of the stores that use a 'memory' backend, so each worker would keep its own copy."""
+    from .netlist import get_model_cache_config
+    from .render_cache import DEFAULT_CACHE_CONFIG
+    from .revisions import get_revisions_config
+    from .tiles import get_tiles_config
+
+    tiles = get_tiles_config()
+    stores = {
+        'DIAGRAM_RENDER_CACHE': {**DEFAULT_CACHE_CONFIG, **(getattr(settings, 'DIAGRAM_RENDER_CACHE', None) or {})},
+        'DIAGRAM_MODEL_CACHE': get_model_cache_config(),
+        'DIAGRAM_REVISIONS': get_revisions_config(),
+        "DIAGRAM_TILES['SCENES']": tiles['SCENES'],
+        "DIAGRAM_TILES['CACHE']": tiles['CACHE'],
+    }
+    return [name for name, config in stores.items() if config.get('BACKEND') == 'memory']
+
+
+def gunicorn_options(config):
+    """gunicorn settings for ``config``."""
+    workers, threads, _ = worker_counts(config)
+    options = {
+        'bind': [address.strip() for address in config['BIND'].split(",")],
+        'workers': workers,
+        'threads': threads,
+        'worker_class': 'uvicorn.workers.UvicornWorker' if config['ASGI'] else 'gthread',
+        'preload_app': True,
+        'max_requests': config['MAX_REQUESTS'] or 0,
+        'max_requests_jitter': config['MAX_REQUESTS_JITTER'] or 0,
+        'timeout': config['TIMEOUT'],
+        'graceful_timeout': config['GRACEFUL_TIMEOUT'],
+        'keepalive': config['KEEPALIVE'],
+        'backlog': config['BACKLOG'],
+        'proc_name': 'pythondiagram',
+        'post_worker_init': post_worker_init,
+    }
+    # Heartbeat files on tmpfs, so a slow disk cannot make a busy worker look dead
+    if os.path.isdir('/dev/shm'):
+        options['worker_tmp_dir'] = '/dev/shm'
+    return options
+
+
+def post_worker_init(worker):
+    """Per worker, before it accepts connections: start the renderer pools and the RSS watchdog."""
+    from . import render_pool
+    from .startup import warm_up
+
+    config = get_server_config()
+    started = time.perf_counter()
+    warm_up(wait=True)
+    if config['ASGI']:
+        # Every async render runs on the render pool
+        render_pool.warm_up()
+    worker.log.info("Worker %s warmed up in %.2fs", worker.pid, time.perf_counter() - started)
+
+    if config['MAX_RSS_MB']:
+        threading.Thread(target=watch_rss, args=(worker, config['MAX_RSS_MB'], config['RSS_CHECK_SECONDS']),
+                         name="diagram-rss-watchdog", daemon=True).start()
+
+
+def watch_rss(worker, max_rss_mb, interval):
+    """Ask the worker to exit gracefully (the master starts a fresh one) once its RSS passes ``max_rss_mb``."""
+    from .metrics import _resident_bytes
+
+    while True:
+        time.sleep(interval)
+        rss_mb = _resident_bytes() / 2 ** 20
+        if rss_mb > max_rss_mb:
+            worker.log.warning("Worker %s uses %.0f MB (MAX_RSS_MB %s); replacing it", worker.pid, rss_mb, max_rss_mb)
+            os.kill(worker.pid, signal.SIGTERM)
+            return
+
+
+class DiagramServer(BaseApplication):
+    """gunicorn application serving this project with ``options``."""
+
+    def __init__(self, options, asgi=False):
+        self.options = options
+        self.asgi = asgi
+        super().__init__()
+
+    def load_config(self):
+        for name, value in self.options.items():
+            self.cfg.set(name, value)
+
+    def load(self):
+        # In the master (preload_app): everything loaded here is shared by the workers
+        from .startup import preload, served_endpoints
+
+        if self.asgi:
+            from django.core.asgi import get_asgi_application
+
+            application = get_asgi_application()
+        else:
+            from django.core.wsgi import get_wsgi_application
+
+            application = get_wsgi_application()
+        preload(served_endpoints())
+        # These objects live as long as the process: keep the collector from
+        # writing to (and so copying) their pages in every worker
+        gc.freeze()
+        return application
+
+
+def run(config=None):
+    """Serve with ``config`` (default: DIAGRAM_SERVER over the defaults above) until stopped."""
+    config = config or get_server_config()
+    workers, _, render_processes = worker_counts(config)
+    stores = per_process_stores()
+    if workers > 1 and stores:
+        raise ImproperlyConfigured(f"{workers} workers would each keep their own {', '.join(stores)}: "
+                                   "use the 'disk' backend with a shared LOCATION, or one worker")
+    # Read again in every worker (post_worker_init), which inherits these settings
+    settings.DIAGRAM_SERVER = config
+    settings.DIAGRAM_RENDER_POOL = {**getattr(settings, 'DIAGRAM_RENDER_POOL', {}), 'PROCESSES': render_processes}
+    DiagramServer(gunicorn_options(config), asgi=config['ASGI']).run()
@@ -0,0 +1,115 @@
+"""
+Process startup: lazy endpoint views and the warm-up hook.
+
+URL patterns route to :func:`lazy_view`, so loading the URLconf imports no
+view module; each endpoint's module, and the plotting libraries it needs
+(plotly, Bokeh, networkx, ...), loads on the endpoint's first request. A
+process that serves only ``/api/circuit`` never imports Bokeh.
+
+:func:`warm_up` runs from wsgi.py / asgi.py. It starts the renderer pools
+of the endpoints this deployment serves and, with ``PRELOAD``, imports
+their views up front (before a preforking server forks its workers, so
+the first request on every worker is as fast as the rest).
+"""
+import logging
+from importlib import import_module
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from django.views.decorators.csrf import csrf_exempt
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_STARTUP_CONFIG = {
+    'ENDPOINTS': None,   # render endpoints this deployment serves (None: all); pools start only for these
+    'PRELOAD': False,    # import those endpoints' views and libraries in warm_up() instead of on first use
+}
+
+# Imported by every render endpoint for .xlsx uploads, inside ingest.py's readers
+INGEST_IMPORTS = ('openpyxl',)
+
+
+def get_startup_config():
+    return {**DEFAULT_STARTUP_CONFIG, **getattr(settings, 'DIAGRAM_STARTUP', {})}
+
+
+def lazy_view(path, asynchronous=False, **initkwargs):
+    """
+    URL pattern view for the class-based view at the dotted ``path``,
+    imported on its first request. Pass ``asynchronous=True`` for async
+    views, so Django runs them on the event loop. Every view routed this
+    way is CSRF-exempt, as the DRF and async views are anyway.
+    """
+    view = None
+
+    def load():
+        nonlocal view
+        if view is None:
+            view = import_string(path).as_view(**initkwargs)
+        return view
+
+    if asynchronous:
+        async def dispatch(request, *args, **kwargs):
+            return await load()(request, *args, **kwargs)
+    else:
+        def dispatch(request, *args, **kwargs):
+            return load()(request, *args, **kwargs)
+
+    dispatch.__name__ = dispatch.__qualname__ = path.rpartition(".")[2]
+    dispatch.__module__ = path.rpartition(".")[0]
+    dispatch.load = load
+    return csrf_exempt(dispatch)
+
+
+def served_endpoints(endpoints=None):
+    """The render endpoints configured for this deployment, in RENDER_VIEWS order."""
+    from .views import RENDER_VIEWS
+
+    endpoints = endpoints if endpoints is not None else get_startup_config()['ENDPOINTS']
+    if endpoints is None:
+        return list(RENDER_VIEWS)
+    unknown = sorted(set(endpoints) - set(RENDER_VIEWS))
+    if unknown:
+        raise ValueError(f"Unknown endpoints {unknown}; choose from {sorted(RENDER_VIEWS)}")
+    return [endpoint for endpoint in RENDER_VIEWS if endpoint in endpoints]
+
+
+def preload(endpoints):
+    """Import the views of ``endpoints`` and the modules they would import on their first request."""
+    from django.urls import get_resolver
+
+    from .views import RENDER_VIEWS
+
+    get_resolver().url_patterns  # loads the URLconf
+    modules = list(INGEST_IMPORTS) if endpoints else []
+    for endpoint in endpoints:
+        modules += getattr(RENDER_VIEWS[endpoint], 'deferred_imports', ())
+    for name in modules:
+        try:
+            import_module(name)
+        except ImportError as e:  # optional renderers, e.g. no Pillow
+            logger.info("Not preloading %s: %s", name, e)
+
+
+def warm_up(endpoints=None, pools=True, wait=False):
+    """
+    Prepare this process for the render endpoints it serves: start their
+    renderer pools (when configured to start on boot; ``wait`` until they
+    are up) and, with ``PRELOAD``, import their views.
+    """
+    endpoints = served_endpoints(endpoints)
+    if get_startup_config()['PRELOAD']:
+        preload(endpoints)
+    if not pools:
+        return
+    # Start warm PNG export workers and Mermaid renderers before the first request arrives
+    if 'diagram' in endpoints:
+        from .export_pool import warm_up as warm_up_export
+
+        warm_up_export(wait=wait)
+    if 'circuit' in endpoints:
+        from .mermaid_pool import warm_up as warm_up_mermaid
+
+        warm_up_mermaid(wait=wait)
+
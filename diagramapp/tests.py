@@ -1,3 +1,463 @@
-from django.test import TestCase
+import base64
+import functools
+import io
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
 
-# Create your tests here.
+import pandas as pd
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+
+from benchmarks.netlists import (NETLISTS, csv_bytes, dynamic_netlist, fabric_netlist, master_slave_netlist,
+                                 workbook_bytes)
+from . import metrics, render_cache, render_pool
+from .batch import FileBatch, ZipArchive
+from .circuit_generator import DynamicCircuitDiagram
+from .ingest import read_netlist
+from .jobs import FINISHED, JobManager, JobStore
+from .views import RENDER_VIEWS
+
+
+@functools.cache
+def can_export_png():
+    """Whether plotly figures can be exported here: Kaleido and the Chrome it drives are installed."""
+    import plotly.graph_objects as go
+    try:
+        go.Figure().to_image(format="png", width=10, height=10)
+    except Exception:
+        return False
+    return True
+
+
+def encode(df, fmt):
+    """``df`` as an upload in one of the ingest formats, with its file name."""
+    if fmt == 'excel':
+        return workbook_bytes(df), "netlist.xlsx"
+    if fmt == 'csv':
+        return csv_bytes(df), "netlist.csv"
+    buf = io.BytesIO()
+    if fmt == 'parquet':
+        df.to_parquet(buf, index=False)
+        return buf.getvalue(), "netlist.parquet"
+    df.to_json(buf, orient="records", lines=fmt == 'jsonl')
+    return buf.getvalue(), f"netlist.{fmt}"
+
+
+def small_netlist(endpoint):
+    """A few dozen rows in the schema of ``endpoint``, blank cells as nulls (as every format can carry them)."""
+    df = NETLISTS[endpoint](40)
+    return df.mask(df.eq("")) if endpoint == 'diagram' else df
+
+
+def content(response):
+    return b"".join(response.streaming_content) if response.streaming else response.content
+
+
+@override_settings(DIAGRAM_RENDER_CACHE={'BACKEND': 'memory', 'MAX_BYTES': 64 * 1024 * 1024, 'MAX_ENTRIES': 256},
+                   DIAGRAM_TIMING={**settings.DIAGRAM_TIMING, 'LOG': False})
+class DiagramTestCase(TestCase):
+    """Each test starts from an empty process-wide render cache."""
+
+    def setUp(self):
+        render_cache._render_cache = None
+
+    def post(self, url, body, name="netlist.xlsx", data=None, **extra):
+        return self.client.post(url, {'file': SimpleUploadedFile(name, body), **(data or {})}, **extra)
+
+
+class EndpointFormatTests(DiagramTestCase):
+
+    def test_every_endpoint_and_format(self):
+        for endpoint, view in RENDER_VIEWS.items():
+            body = workbook_bytes(small_netlist(endpoint))
+            for out_format in view.formats:
+                if endpoint == 'diagram' and out_format == "png" and not can_export_png():
+                    continue
+                with self.subTest(endpoint=endpoint, format=out_format):
+                    response = self.post(f'/api/{endpoint}', body, data={'format': out_format})
+                    self.assertEqual(response.status_code, 200)
+                    self.assertTrue(content(response))
+
+    @override_settings(DIAGRAM_EXPORT_POOL={'ENABLED': False})
+    def test_diagram_png(self):
+        if not can_export_png():
+            self.skipTest("Kaleido or Chrome is not installed")
+        response = self.post('/api/diagram', workbook_bytes(small_netlist('diagram')))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], "image/png")
+        self.assertTrue(content(response).startswith(b"\x89PNG"))
+        self.assertFalse(response.has_header('X-Figure-Bytes'))
+
+        response = self.post('/api/diagram', workbook_bytes(small_netlist('diagram')), data={'figure_bytes': "true"})
+        self.assertEqual(response['X-Render-Cache'], "MISS")
+        self.assertGreater(int(response['X-Figure-Bytes']), 0)
+
+    def test_figure_headers(self):
+        response = self.post('/api/diagram', workbook_bytes(small_netlist('diagram')), data={'format': "json"})
+        self.assertEqual(int(response['X-Figure-Bytes']), len(content(response)))
+        self.assertEqual(int(response['X-Trace-Count']), len(json.loads(content(response))['data']))
+        self.assertFalse(response.has_header('Content-Disposition'))
+        # Opt-in serialization for PNGs; JSON responses report their size either way
+        view = RENDER_VIEWS['diagram']()
+        self.assertNotEqual(view.cache_key(b"x", 'excel', figure_bytes=True), view.cache_key(b"x", 'excel'))
+        self.assertEqual(view.cache_key(b"x", 'excel', out_format="json", figure_bytes=True),
+                         view.cache_key(b"x", 'excel', out_format="json"))
+
+    def test_unknown_format(self):
+        response = self.post('/api/generate', workbook_bytes(small_netlist('generate')), data={'format': "gif"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_no_file(self):
+        self.assertEqual(self.client.post('/api/generate', {}).status_code, 400)
+
+
+class OptionalColumnTests(DiagramTestCase):
+
+    def test_master_slave_without_bus_label(self):
+        df = master_slave_netlist(24).drop(columns=["Bus_Label"])
+        response = self.post('/api/generate-diagram', workbook_bytes(df))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith("text/html"))
+        self.assertIn(b'bokeh', response.content.lower())
+
+    def test_diagram_without_optional_columns(self):
+        # Read with row.get() before the columnar rewrite, so sheets may leave them out
+        optional = ["Pin_Side", "Direction", "Arrow_Color"]
+        df = dynamic_netlist(30).drop(columns=optional)
+        response = self.post('/api/diagram', workbook_bytes(df), data={'format': "json"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('data', json.loads(content(response)))
+
+    def test_fabric_without_connections(self):
+        df = fabric_netlist(30).assign(Connects_To=None)
+        for endpoint in ('generate', 'circuit'):
+            with self.subTest(endpoint=endpoint):
+                response = self.post(f'/api/{endpoint}', workbook_bytes(df), data={'format': "json"})
+                self.assertEqual(response.status_code, 200)
+
+
+class IngestTests(DiagramTestCase):
+    formats = ('excel', 'csv', 'parquet', 'jsonl', 'json')
+
+    def test_readers_agree(self):
+        df = small_netlist('diagram')
+        expected = DynamicCircuitDiagram().read_excel_data(workbook_bytes(df))
+        for fmt in self.formats[1:]:
+            with self.subTest(format=fmt):
+                body, _ = encode(df, fmt)
+                pd.testing.assert_frame_equal(DynamicCircuitDiagram().read_excel_data(body, fmt=fmt), expected,
+                                              check_dtype=False, check_categorical=False)
+
+    def test_uploads_render_alike(self):
+        df = small_netlist('diagram')
+        figures = set()
+        for fmt in self.formats:
+            with self.subTest(format=fmt):
+                body, name = encode(df, fmt)
+                response = self.post('/api/diagram', body, name=name, data={'format': "json"})
+                self.assertEqual(response.status_code, 200)
+                figures.add(content(response))
+        self.assertEqual(len(figures), 1)
+
+    def test_inline_json_rows(self):
+        rows = json.loads(small_netlist('diagram').to_json(orient="records"))
+        response = self.client.post('/api/diagram', {'rows': rows, 'format': "json"}, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+
+    def test_upload_checks_on_every_diagram_route(self):
+        board = workbook_bytes(small_netlist('diagram'))
+        uploads = [(board, "netlist.txt"), (board + b"\0" * (10 * 1024 * 1024), "netlist.xlsx")]
+        routes = [('/api/diagram', {}), ('/api/async/diagram', {}), ('/api/jobs', {'endpoint': "diagram"})]
+        for body, name in uploads:
+            for url, data in routes:
+                with self.subTest(url=url, name=name, size=len(body)):
+                    response = self.post(url, body, name=name, data={'format': "json", **data})
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn('file', response.json()['details'])
+
+    def test_projection_and_limits(self):
+        df = read_netlist(csv_bytes(fabric_netlist(20)), columns=["Node", "Type"], fmt='csv')
+        self.assertEqual(list(df.columns), ["Node", "Type"])
+        with self.assertRaises(ValueError):
+            read_netlist(csv_bytes(fabric_netlist(20)), max_rows=5, fmt='csv')
+
+
+class RenderCacheTests(DiagramTestCase):
+
+    def test_second_render_is_a_hit(self):
+        body = workbook_bytes(small_netlist('generate'))
+        first = self.post('/api/generate', body)
+        second = self.post('/api/generate', body)
+        self.assertEqual(first['X-Render-Cache'], "MISS")
+        self.assertEqual(second['X-Render-Cache'], "HIT")
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertEqual(content(first), content(second))
+
+    def test_format_is_part_of_the_key(self):
+        body = workbook_bytes(small_netlist('generate'))
+        self.post('/api/generate', body)
+        response = self.post('/api/generate', body, data={'format': "json"})
+        self.assertEqual(response['X-Render-Cache'], "MISS")
+
+    def test_post_precondition_failed(self):
+        body = workbook_bytes(small_netlist('generate'))
+        etag = self.post('/api/generate', body)['ETag']
+        # POST is not a safe method: a matching If-None-Match is a failed precondition, not a 304
+        response = self.post('/api/generate', body, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.post('/api/generate', body, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_wildcard_matches_cached_renders_only(self):
+        body = workbook_bytes(small_netlist('generate'))
+        response = self.post('/api/generate', body, HTTP_IF_NONE_MATCH="*")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.post('/api/generate', body, HTTP_IF_NONE_MATCH="*").status_code, 412)
+
+    def test_tile_not_modified(self):
+        scene = self.post('/api/scenes', workbook_bytes(small_netlist('diagram'))).json()
+        url = f"/api/scenes/{scene['id']}/tiles/0/0/0.png"
+        tile = self.client.get(url)
+        self.assertEqual(tile.status_code, 200)
+        self.assertEqual(tile['Content-Type'], "image/png")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=tile['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], tile['ETag'])
+
+
+class RevisionTests(DiagramTestCase):
+
+    def revise(self, endpoint, df, base=None):
+        data = {'endpoint': endpoint, **({'base': base} if base else {})}
+        response = self.post('/api/revisions', workbook_bytes(df), data=data)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_generate_revision(self):
+        df = small_netlist('generate')
+        first = self.revise('generate', df)
+        full = self.post('/api/generate', workbook_bytes(df))
+        # Without a base, the revision is laid out from scratch like a full render
+        self.assertEqual(first['headers']['X-Layout-Crossings'], full['X-Layout-Crossings'])
+        self.assertEqual(first['diff']['nodes']['kept'], 0)
+
+        edited = pd.concat([df, pd.DataFrame([{"Node": "Switch999", "Type": "Switch", "Connects_To": "Target0"}])])
+        second = self.revise('generate', edited, base=first['id'])
+        self.assertEqual(second['diff']['devices']['added'], ["Switch999"])
+        self.assertGreater(second['diff']['nodes']['kept'], 0)
+        # Its layout depends on the base, so a plain render is not served from it
+        response = self.post('/api/generate', workbook_bytes(edited))
+        self.assertEqual(response['X-Render-Cache'], "MISS")
+
+    def test_diagram_revision_matches_full_render(self):
+        if not can_export_png():
+            self.skipTest("Kaleido or Chrome is not installed")
+        df = small_netlist('diagram')
+        first = self.revise('diagram', df)
+        edited = df.copy()
+        edited.loc[3, "X"] = edited.loc[3, "X"] + 40
+        second = self.revise('diagram', edited, base=first['id'])
+        self.assertGreater(second['diff']['rows']['reused'], 0)
+        response = self.post('/api/diagram', workbook_bytes(edited))
+        self.assertEqual(response['X-Render-Cache'], "HIT")
+        self.assertEqual(content(response), base64.b64decode(second['image']))
+        render_cache._render_cache = None
+        self.assertEqual(content(self.post('/api/diagram', workbook_bytes(edited))), base64.b64decode(second['image']))
+
+    def test_unknown_base(self):
+        response = self.post('/api/revisions', workbook_bytes(small_netlist('generate')),
+                             data={'endpoint': 'generate', 'base': "0" * 64})
+        self.assertEqual(response.status_code, 404)
+
+
+class ArchiveTests(DiagramTestCase):
+
+    def archive(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], "application/zip")
+        archive = zipfile.ZipFile(io.BytesIO(content(response)))
+        return archive, json.loads(archive.read("manifest.json"))
+
+    def test_batch_manifest(self):
+        buf = io.BytesIO()
+        with pd.ExcelWriter(buf) as writer:
+            dynamic_netlist(20).to_excel(writer, sheet_name="Power", index=False)
+            dynamic_netlist(30, seed=1).to_excel(writer, sheet_name="Sensors bus", index=False)
+        archive, manifest = self.archive(self.post('/api/batch', buf.getvalue(), data={'format': "json"}))
+        self.assertEqual([entry['name'] for entry in manifest['inputs']], ["Power", "Sensors bus"])
+        self.assertEqual(manifest['rendered'], 2)
+        self.assertEqual(manifest['failed'], 0)
+        for entry in manifest['inputs']:
+            self.assertEqual(entry['status'], "rendered")
+            self.assertEqual(len(archive.read(entry['file'])), entry['bytes'])
+
+        single = self.post('/api/diagram', workbook_bytes(dynamic_netlist(20)), data={'format': "json"})
+        self.assertEqual(content(single), archive.read(manifest['inputs'][0]['file']))
+
+    def test_batch_unknown_sheet(self):
+        response = self.post('/api/batch', workbook_bytes(dynamic_netlist(20)), data={'sheets': "Nope"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_manifest(self):
+        board = workbook_bytes(dynamic_netlist(20))
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w") as upload:
+            upload.writestr("boards/a.xlsx", board)
+            upload.writestr("boards/b.xlsx", board)
+            upload.writestr("notes.txt", b"not a netlist")
+        archive, manifest = self.archive(self.post('/api/bulk', buf.getvalue(), name="boards.zip",
+                                                   data={'format': "json"}))
+        status = {entry['name']: entry['status'] for entry in manifest['inputs']}
+        self.assertEqual(status, {"boards/a.xlsx": "rendered", "boards/b.xlsx": "duplicate", "notes.txt": "failed"})
+        self.assertEqual((manifest['rendered'], manifest['duplicate'], manifest['failed']), (1, 1, 1))
+        self.assertIn("boards/a.json", archive.namelist())
+        self.assertIn("notes.error.txt", archive.namelist())
+
+    @override_settings(DIAGRAM_RENDER_POOL={'PROCESSES': 1})
+    def test_render_process_killed_mid_batch(self):
+        render_pool._executor = None
+        self.addCleanup(setattr, render_pool, '_executor', None)
+        worker = render_pool.get_render_executor().submit(os.getpid).result()
+
+        def kill_worker():
+            os.kill(worker, signal.SIGKILL)
+            time.sleep(0.5)
+            return workbook_bytes(dynamic_netlist(20, seed=1))
+
+        boards = [workbook_bytes(dynamic_netlist(20, seed=seed)) for seed in (0, 2)]
+        files = [("a.xlsx", len(boards[0]), lambda: boards[0]), ("b.xlsx", 0, kill_worker),
+                 ("c.xlsx", len(boards[1]), lambda: boards[1])]
+        batch = FileBatch(files, 'diagram', {'trace_mode': "segments", 'out_format': "json"}, ZipArchive())
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(batch.stream())))
+        manifest = json.loads(archive.read("manifest.json"))
+        first, *rest = manifest['inputs']
+        if first['status'] == 'failed':
+            self.assertIn("Render process died", first['error'])
+            self.assertIn("a.error.txt", archive.namelist())
+        self.assertEqual([entry['status'] for entry in rest], ["rendered", "rendered"])
+        render_pool._executor.shutdown()
+
+
+class JobManagerTests(TestCase):
+
+    def setUp(self):
+        location = tempfile.TemporaryDirectory()
+        self.addCleanup(location.cleanup)
+        self.manager = JobManager(JobStore(location.name), workers=1, timeout=60, result_ttl=3600)
+        self.body = workbook_bytes(small_netlist('generate-diagram'))
+
+    def run_job(self):
+        job = self.manager.submit('generate-diagram', self.body, 'excel', {'out_format': "json"})
+        for _ in range(300):
+            job = self.manager.store.get(job['id'])
+            if job['status'] in FINISHED:
+                return job
+            time.sleep(0.1)
+        self.fail(f"Job {job['id']} did not finish")
+
+    def tearDown(self):
+        for worker in self.manager._workers:
+            worker.kill()
+
+    def test_dead_idle_worker_is_replaced(self):
+        self.manager.start()
+        dead = self.manager._workers[0]
+        dead.process.kill()
+        dead.process.join(5)
+
+        with self.assertLogs('diagramapp.jobs', 'ERROR') as logs:
+            job = self.run_job()
+        self.assertIn("Could not start job", logs.output[0])
+        self.assertEqual(job['status'], "failed")
+        self.assertIn("Could not start job", job['error'])
+        self.assertIsNot(self.manager._workers[0], dead)
+        self.assertEqual(self.run_job()['status'], "done")
+        self.assertTrue(self.manager._thread.is_alive())
+
+    def test_dead_supervisor_is_restarted(self):
+        # Stand-in for a supervisor thread that died
+        self.manager._thread = threading.Thread(target=lambda: None)
+        self.manager._thread.start()
+        self.manager._thread.join()
+
+        with self.assertLogs('diagramapp.jobs', 'ERROR') as logs:
+            self.assertEqual(self.run_job()['status'], "done")
+        self.assertIn("Job supervisor thread died", logs.output[0])
+        self.assertTrue(self.manager._thread.is_alive())
+
+    def test_jobs_of_exited_process_are_recovered(self):
+        store = self.manager.store
+        exited = int(subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"],
+                                    capture_output=True, text=True).stdout)
+        params = {'out_format': "json"}
+        queued = store.create('generate-diagram', self.body, 'excel', params, owner=exited)
+        running = store.create('generate-diagram', self.body, 'excel', params, owner=exited)
+        store.update(running['id'], status="running", started=time.time())
+        stale = store.create('generate-diagram', self.body, 'excel', params, owner=exited)
+        store.update(stale['id'], created=time.time() - 7200)
+        live = store.create('generate-diagram', self.body, 'excel', params, owner=os.getppid())
+        store.update(live['id'], created=time.time() - 7200)
+        store.purge_expired(3600)
+        self.assertIsNone(store.get(stale['id']))
+        self.assertIsNotNone(store.get(live['id']))
+
+        self.assertEqual(self.run_job()['status'], "done")
+        self.assertEqual(store.get(running['id'])['status'], "failed")
+        self.assertEqual(store.get(queued['id'])['status'], "done")
+        self.assertEqual(store.get(live['id'])['status'], "queued")
+
+
+class MetricsFileTests(TestCase):
+    labels = (('endpoint', 'generate'), ('format', 'html'), ('status', '200'), ('cache', 'miss'))
+
+    def setUp(self):
+        location = tempfile.TemporaryDirectory()
+        self.addCleanup(location.cleanup)
+        self.location = location.name
+        self.config = {**metrics.get_metrics_config(), 'LOCATION': self.location, 'FLUSH_SECONDS': 1.0}
+        self.addCleanup(setattr, metrics, '_process_metrics', None)
+        metrics._process_metrics = metrics.ProcessMetrics(self.config)
+
+    def write_snapshot(self, pid, written, requests):
+        snapshot = {
+            'pid': pid, 'written': written, 'gauges': [],
+            'counters': [['diagram_requests_total', [list(label) for label in self.labels], requests]],
+            'histograms': [['diagram_input_rows', [['endpoint', 'generate']], [requests] + [0] * 9 + [10.0]]],
+        }
+        name = f"{pid}-{int(written * 1e9)}.json"
+        with open(os.path.join(self.location, name), 'w') as f:
+            json.dump(snapshot, f)
+        return name
+
+    def requests_total(self):
+        counters, histograms, _ = metrics.collect(self.config)
+        return counters.get(('diagram_requests_total', self.labels)), histograms[('diagram_input_rows', (('endpoint', 'generate'),))][0]
+
+    def test_exited_processes_are_folded(self):
+        exited = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"],
+                                capture_output=True, text=True).stdout.strip()
+        old = time.time() - 60
+        dead_files = [self.write_snapshot(int(exited), old, 3), self.write_snapshot(int(exited), old - 1, 4)]
+        # Stale but still running (e.g. stalled): kept, or it would be counted twice later
+        stalled = self.write_snapshot(os.getppid(), old, 5)
+
+        self.assertEqual(self.requests_total(), (12, 12))
+        names = os.listdir(self.location)
+        self.assertIn(metrics.DEAD_FILE, names)
+        self.assertIn(stalled, names)
+        for name in dead_files:
+            self.assertNotIn(name, names)
+        # The aggregate keeps the counts of the deleted files
+        self.assertEqual(self.requests_total(), (12, 12))
+
+        self.write_snapshot(int(exited), old - 2, 1)
+        self.assertEqual(self.requests_total(), (13, 13))
+        self.assertEqual(len([n for n in os.listdir(self.location) if n.endswith('.json')]), 3)
@@ -0,0 +1,101 @@
+"""
+/api/scenes: tile pyramids of DynamicCircuitDiagram netlists (see
+tiles.py), for a slippy-map viewer. POST a netlist to get its scene id and
+pyramid, then GET ``/api/scenes/<id>/tiles/<z>/<x>/<y>.png``.
+"""
+from rest_framework.views import APIView
+from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
+from rest_framework.response import Response
+from rest_framework import status
+from .ingest import IngestError, netlist_payload
+from .metrics import annotate, observe_input
+from .tiles import get_scene_store, get_tile_cache, get_tiles_config, open_scene, render_tile, tile_key
+
+
+def scene_info(request, scene_id, scene):
+    """What a viewer needs to show a scene: its tile URL template, zoom range and grid per zoom level."""
+    config = get_tiles_config()
+    max_zoom = scene.max_zoom(config)
+    return {
+        'id': scene_id,
+        'tiles': request.build_absolute_uri(f"/api/scenes/{scene_id}/tiles/") + "{z}/{x}/{y}.png",
+        'tile_size': config['TILE_SIZE'],
+        'min_zoom': 0,
+        'max_zoom': max_zoom,
+        # Diagram coordinates (y up) of the board; tile rows count down from its top
+        'bounds': scene.bounds,
+        'grid': [dict(zip(('columns', 'rows'), scene.grid(z))) for z in range(max_zoom + 1)],
+        'devices': scene.devices,
+        'primitives': scene.counts(),
+    }
+
+
+class SceneView(APIView):
+    """Draw an uploaded netlist into a scene (once per distinct upload) and describe its tile pyramid."""
+    parser_classes = (MultiPartParser, FormParser, JSONParser)
+    endpoint = 'tiles'
+    # Pillow draws the tiles; startup.preload() can load it ahead of the first request
+    deferred_imports = ("PIL.Image", "PIL.ImageDraw", "PIL.ImageFont")
+
+    def post(self, request, *args, **kwargs):
+        data, fmt = netlist_payload(request)
+        if data is None:
+            return Response({"error": "No file uploaded"}, status=status.HTTP_400_BAD_REQUEST)
+        annotate(self.endpoint, "scene")
+
+        try:
+            scene_id, scene, created = open_scene(data, fmt)
+        except IngestError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        observe_input(nodes=scene.devices)
+        response = Response(scene_info(request, scene_id, scene),
+                            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+        response['Location'] = request.build_absolute_uri(f"/api/scenes/{scene_id}")
+        return response
+
+
+class SceneDetailView(APIView):
+    """The tile pyramid of a stored scene."""
+
+    def get(self, request, scene_id, *args, **kwargs):
+        scene = get_scene_store().get(scene_id)
+        if scene is None:
+            return Response({"error": "Unknown or expired scene", "id": scene_id}, status=status.HTTP_404_NOT_FOUND)
+        return Response(scene_info(request, scene_id, scene))
+
+
+class TileView(APIView):
+    """One PNG tile of a scene, drawn on first request and then served from the LRU tile cache."""
+    endpoint = 'tiles'
+
+    def get(self, request, scene_id, z, x, y, *args, **kwargs):
+        annotate(self.endpoint, "png")
+        config = get_tiles_config()
+        tile_cache = get_tile_cache()
+        cache_key = tile_key(scene_id, z, x, y, config)
+        cached = tile_cache.lookup(request, cache_key)
+        if cached is not None:
+            return cached
+
+        scene = get_scene_store().get(scene_id)
+        if scene is None:
+            return Response({"error": "Unknown or expired scene", "id": scene_id}, status=status.HTTP_404_NOT_FOUND)
+        tile = render_tile(scene, z, x, y, config)
+        if tile is None:
+            return Response({"error": "No such tile", "max_zoom": scene.max_zoom(config)},
+                            status=status.HTTP_404_NOT_FOUND)
+
+        body, items = tile
+        # A scene id names one upload's content, so its tiles never change
+        headers = {'Cache-Control': 'public, max-age=86400, immutable', 'X-Tile-Items': str(items)}
+        return tile_cache.store(cache_key, body, "image/png", headers)
+
+
+class TileStatsView(APIView):
+    """Stored scenes and hit/miss counters of the tile cache (per server process)."""
+
+    def get(self, request, *args, **kwargs):
+        return Response({'scenes': get_scene_store().stats(), 'tiles': get_tile_cache().stats()})
@@ -0,0 +1,483 @@
+"""
+Tile pyramid of DynamicCircuitDiagram netlists, for boards too large to
+read as one image.
+
+A netlist is drawn once into a :class:`Scene`: the chips, bus lines,
+labels and free arrows GenerateCircuitDiagramView puts in its figure, as
+flat primitive tables in diagram coordinates, plus a :class:`GridIndex`
+over their bounding boxes. Scenes are kept under a content id (like the
+revision models, see revisions.py). Tile ``z/x/y`` covers 1/2**z of the
+board's longer side; rendering it asks the index for the primitives that
+reach into the tile and draws only those, with Pillow. Rendered tiles go
+to an LRU render cache keyed by scene id and address, with strong ETags.
+"""
+import io
+import math
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+
+from .circuit_generator import DynamicCircuitDiagram
+from .netlist import Table
+from .render_cache import ObjectCache, RenderCache, build_backend
+from .timing import stage
+
+
+DEFAULT_TILES_CONFIG = {
+    'TILE_SIZE': 256,           # pixels per tile side
+    'MAX_SCALE': 2.0,           # the deepest zoom draws one diagram unit this many pixels wide
+    'MAX_ZOOM': 20,
+    'MIN_LABEL_PX': 6,          # labels smaller than this at a zoom level are left out
+    'PNG_COMPRESS_LEVEL': 3,
+    'LIVE_SCENES': 4,           # unpickled scenes kept per process, most recently used
+    'SCENES': {                 # 'memory', or 'disk' to share scenes between server processes
+        'BACKEND': 'memory',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'diagram_scenes'),
+        'MAX_BYTES': 256 * 1024 * 1024,
+        'MAX_ENTRIES': 32,
+    },
+    'CACHE': {                  # rendered tiles (LRU)
+        'BACKEND': 'memory',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'diagram_tiles'),
+        'MAX_BYTES': 64 * 1024 * 1024,
+        'MAX_ENTRIES': 8192,
+    },
+}
+
+# Bump when scenes or their drawing change, so stored scenes and cached tiles from older code are ignored
+SCENE_VERSION = 1
+
+MARGIN = 50         # diagram units of white space around the drawing
+PAD_PX = 12         # line widths, outlines and arrow heads reach this far past their geometry
+LABEL_WIDTH = 0.7   # label width per character, in font sizes (on the generous side, so no tile cuts one off)
+ARROW_HEAD_PX = 9
+
+# plotly's named dash styles, in line widths (at least 3 px) on and off
+DASHES = {'dot': (1, 1), 'dash': (3, 3), 'longdash': (5, 5)}
+
+
+def get_tiles_config():
+    config = {**DEFAULT_TILES_CONFIG, **getattr(settings, 'DIAGRAM_TILES', {})}
+    for store in ('SCENES', 'CACHE'):
+        config[store] = {**DEFAULT_TILES_CONFIG[store], **config[store]}
+    return config
+
+
+class Lines(Table):
+    __slots__ = ('x0', 'y0', 'x1', 'y1', 'color', 'width', 'dash')
+
+    def boxes(self):
+        return np.column_stack((np.minimum(self.x0, self.x1), np.minimum(self.y0, self.y1),
+                                np.maximum(self.x0, self.x1), np.maximum(self.y0, self.y1)))
+
+
+class Rects(Table):
+    __slots__ = ('x0', 'y0', 'x1', 'y1', 'fill')
+
+    def boxes(self):
+        return np.column_stack((self.x0, self.y0, self.x1, self.y1))
+
+
+class Labels(Table):
+    __slots__ = ('x', 'y', 'text', 'color', 'size')
+
+    def boxes(self):
+        half_w = np.array([len(text) for text in self.text], dtype=float) * self.size * LABEL_WIDTH / 2
+        half_h = self.size * 0.75
+        return np.column_stack((self.x - half_w, self.y - half_h, self.x + half_w, self.y + half_h))
+
+
+class GridIndex:
+    """
+    Uniform grid over bounding boxes ``(x0, y0, x1, y1)``, stored CSR-style:
+    the boxes touching cell ``c`` are ``items[offsets[c]:offsets[c + 1]]``,
+    with cells numbered row by row, so the cells of one grid row within a
+    query rectangle are a single slice.
+    """
+
+    def __init__(self, boxes, items_per_cell=8, max_cells=4096):
+        self.boxes = boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        n = len(boxes)
+        if n == 0:
+            self.origin, self.cell, self.columns, self.rows = (0.0, 0.0), 1.0, 1, 1
+            self.items, self.offsets = np.zeros(0, dtype=np.int64), np.zeros(2, dtype=np.int64)
+            return
+        x0, y0 = boxes[:, 0].min(), boxes[:, 1].min()
+        width, height = boxes[:, 2].max() - x0, boxes[:, 3].max() - y0
+        # About items_per_cell boxes per cell, at most max_cells cells along either side
+        cell = max(math.sqrt(width * height * items_per_cell / n), width / max_cells, height / max_cells, 1e-9)
+        self.origin, self.cell = (x0, y0), cell
+        self.columns, self.rows = int(width // cell) + 1, int(height // cell) + 1
+
+        c0, r0, c1, r1 = self._cells(boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3])
+        spans = c1 - c0 + 1
+        counts = spans * (r1 - r0 + 1)
+        # One entry per (box, cell it touches)
+        item = np.repeat(np.arange(n), counts)
+        k = np.arange(len(item)) - np.repeat(np.cumsum(counts) - counts, counts)
+        cell_id = (r0[item] + k // spans[item]) * self.columns + c0[item] + k % spans[item]
+        self.items = item[np.argsort(cell_id, kind="stable")]
+        self.offsets = np.concatenate(([0], np.cumsum(np.bincount(cell_id, minlength=self.columns * self.rows))))
+
+    def _cells(self, x0, y0, x1, y1):
+        """Cell ranges ``(c0, r0, c1, r1)`` covering the boxes, clamped to the grid."""
+        ox, oy = self.origin
+        return (np.clip(np.floor_divide(np.subtract(x0, ox), self.cell), 0, self.columns - 1).astype(np.int64),
+                np.clip(np.floor_divide(np.subtract(y0, oy), self.cell), 0, self.rows - 1).astype(np.int64),
+                np.clip(np.floor_divide(np.subtract(x1, ox), self.cell), 0, self.columns - 1).astype(np.int64),
+                np.clip(np.floor_divide(np.subtract(y1, oy), self.cell), 0, self.rows - 1).astype(np.int64))
+
+    def query(self, x0, y0, x1, y1):
+        """Sorted ids of the boxes that intersect the rectangle."""
+        boxes = self.boxes
+        if not len(boxes):
+            return np.zeros(0, dtype=np.int64)
+        c0, r0, c1, r1 = (int(v) for v in self._cells(x0, y0, x1, y1))
+        offsets = self.offsets
+        candidates = np.unique(np.concatenate([
+            self.items[offsets[r * self.columns + c0]:offsets[r * self.columns + c1 + 1]]
+            for r in range(r0, r1 + 1)
+        ]))
+        found = boxes[candidates]
+        return candidates[(found[:, 0] <= x1) & (found[:, 2] >= x0) & (found[:, 1] <= y1) & (found[:, 3] >= y0)]
+
+
+class Scene:
+    """
+    Everything a tile may draw, in diagram coordinates (y up), as tables
+    in drawing order (the figure's order: bus lines, chips, labels, free
+    arrows), and one index over all of them.
+    """
+    __slots__ = ('layers', 'offsets', 'index', 'bounds', 'devices')
+
+    def __init__(self, layers, devices=0):
+        self.layers = layers    # [(name, table)]
+        self.devices = devices
+        boxes = [table.boxes() for _, table in layers]
+        self.offsets = np.cumsum([0] + [len(b) for b in boxes])
+        boxes = np.concatenate(boxes) if boxes else np.zeros((0, 4))
+        with stage("index"):
+            self.index = GridIndex(boxes)
+        if len(boxes):
+            self.bounds = (float(boxes[:, 0].min()) - MARGIN, float(boxes[:, 1].min()) - MARGIN,
+                           float(boxes[:, 2].max()) + MARGIN, float(boxes[:, 3].max()) + MARGIN)
+        else:
+            self.bounds = (0.0, 0.0, 2.0 * MARGIN, 2.0 * MARGIN)
+
+    @property
+    def side(self):
+        """Diagram units covered by the single tile of zoom 0."""
+        x0, y0, x1, y1 = self.bounds
+        return max(x1 - x0, y1 - y0)
+
+    def max_zoom(self, config):
+        """Deepest zoom level: the first at MAX_SCALE pixels per unit, at most MAX_ZOOM."""
+        scale = config['TILE_SIZE'] / self.side
+        return min(max(math.ceil(math.log2(config['MAX_SCALE'] / scale)), 0), config['MAX_ZOOM'])
+
+    def grid(self, z):
+        """``(columns, rows)`` of tiles at zoom ``z``; the board's shorter side needs fewer."""
+        x0, y0, x1, y1 = self.bounds
+        span = self.side / 2 ** z
+        return max(math.ceil((x1 - x0) / span), 1), max(math.ceil((y1 - y0) / span), 1)
+
+    def tile_box(self, z, x, y):
+        """``(left, bottom, right, top)`` of tile ``z/x/y`` (rows counted from the top), or None off the board."""
+        columns, rows = self.grid(z)
+        if not (0 <= x < columns and 0 <= y < rows):
+            return None
+        span = self.side / 2 ** z
+        left, top = self.bounds[0] + x * span, self.bounds[3] - y * span
+        return left, top - span, left + span, top
+
+    def query(self, x0, y0, x1, y1):
+        """``{layer name: row ids}`` of the primitives reaching into the rectangle, in drawing order."""
+        ids = self.index.query(x0, y0, x1, y1)
+        bounds = np.searchsorted(ids, self.offsets)
+        return {name: ids[bounds[i]:bounds[i + 1]] - self.offsets[i] for i, (name, _) in enumerate(self.layers)}
+
+    def counts(self):
+        return {name: len(table) for name, table in self.layers}
+
+
+@lru_cache(maxsize=256)
+def _rgb(color):
+    from PIL import ImageColor
+
+    try:
+        return ImageColor.getrgb(str(color))[:3]
+    except ValueError:  # not a colour Pillow knows; plotly would have rejected it too
+        return (0, 0, 0)
+
+
+def _floats(values):
+    return np.asarray(values, dtype=float).reshape(-1)
+
+
+def build_scene(netlist, generator=None):
+    """The :class:`Scene` of a parsed netlist, with the shapes and colours of ``generator``'s figure."""
+    generator = generator or DynamicCircuitDiagram()
+    bus_colors = [_rgb(color) for color in netlist.buses.colors(generator.colors)]
+    drops, segments, rows = netlist.drops, netlist.segments, netlist.rows
+    drop_bus, segment_bus = drops.bus.tolist(), segments.bus.tolist()
+
+    # Drops, then device-to-device segments, as connect_devices adds their traces
+    lines = Lines(
+        x0=_floats(list(drops.x) + list(segments.start_x)),
+        y0=_floats(list(drops.y0) + list(segments.bus_y)),
+        x1=_floats(list(drops.x) + list(segments.end_x)),
+        y1=_floats(list(drops.y1) + list(segments.bus_y)),
+        color=[bus_colors[b] for b in drop_bus] + [bus_colors[b] for b in segment_bus],
+        width=np.array([2] * len(drops) + [3] * len(segments), dtype=np.int64),
+        dash=list(drops.dash) + ["solid"] * len(segments),
+    )
+    x0, x1, y0, y1, fill, chip_labels = generator.chip_geometry(netlist)
+    chips = Rects(x0=_floats(x0), y0=_floats(y0), x1=_floats(x1), y1=_floats(y1), fill=[_rgb(c) for c in fill])
+    # Chip labels, then bus labels above the middle of every segment
+    labels = Labels(
+        x=_floats(list(rows.x) + list(segments.mid_x)),
+        y=np.concatenate((_floats(rows.y), _floats(segments.bus_y) + 10)),
+        text=chip_labels + [netlist.buses.names[b] for b in segment_bus],
+        color=[(0, 0, 0)] * len(chip_labels) + [bus_colors[b] for b in segment_bus],
+        size=np.array([11] * len(chip_labels) + [10] * len(segment_bus), dtype=float),
+    )
+    layers = [('lines', lines), ('chips', chips), ('labels', labels)]
+    arrows = netlist.arrows
+    if arrows is not None:
+        # Tail at the arrow's point, head at the shifted one (the annotation's x/y)
+        layers.append(('arrows', Lines(
+            x0=_floats(arrows.x), y0=_floats(arrows.y), x1=_floats(arrows.ax), y1=_floats(arrows.ay),
+            color=[_rgb(c) for c in arrows.color.tolist()],
+            width=np.full(len(arrows), 2, dtype=np.int64), dash=["solid"] * len(arrows),
+        )))
+    return Scene(layers, devices=len(netlist.devices))
+
+
+def scene_key(data, fmt):
+    """Id of the scene of an upload: a content hash, like the render-cache keys."""
+    return RenderCache.make_key(data, endpoint='tiles', version=SCENE_VERSION, input_format=fmt)
+
+
+def tile_key(scene_id, z, x, y, config):
+    return RenderCache.make_key(scene_id.encode("ascii"), tile=[z, x, y], size=config['TILE_SIZE'],
+                                min_label_px=config['MIN_LABEL_PX'], version=SCENE_VERSION)
+
+
+def _clip(x0, y0, x1, y1, low, high):
+    """
+    Liang-Barsky clipping of segments to the square ``[low, high]``:
+    ``(x0, y0, x1, y1, t0, keep)``, with ``t0`` the clipped start as a
+    fraction of the original segment.
+    """
+    dx, dy = x1 - x0, y1 - y0
+    t0, t1 = np.zeros(len(x0)), np.ones(len(x0))
+    keep = np.ones(len(x0), dtype=bool)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for p, q in ((-dx, x0 - low), (dx, high - x0), (-dy, y0 - low), (dy, high - y0)):
+            r = q / p
+            t0 = np.where(p < 0, np.maximum(t0, r), t0)
+            t1 = np.where(p > 0, np.minimum(t1, r), t1)
+            keep &= ~((p == 0) & (q < 0))
+    keep &= t0 <= t1
+    return x0 + t0 * dx, y0 + t0 * dy, x0 + t1 * dx, y0 + t1 * dy, t0, keep
+
+
+def _dashed(draw, x0, y0, x1, y1, offset, color, width, dash):
+    """Draw a dashed segment; ``offset`` is its distance (px) from the start of the whole line, so tiles line up."""
+    unit = max(width, 3)
+    on, off = DASHES[dash][0] * unit, DASHES[dash][1] * unit
+    length = math.hypot(x1 - x0, y1 - y0)
+    if length == 0:
+        return
+    ux, uy = (x1 - x0) / length, (y1 - y0) / length
+    start = -(offset % (on + off))
+    while start < length:
+        a, b = max(start, 0.0), min(start + on, length)
+        if b > a:
+            draw.line([(x0 + ux * a, y0 + uy * a), (x0 + ux * b, y0 + uy * b)], fill=color, width=width)
+        start += on + off
+
+
+@lru_cache(maxsize=64)
+def _font(size):
+    from PIL import ImageFont
+
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # Pillow < 10.1 has a single bitmap default font
+        return ImageFont.load_default()
+
+
+def _draw_lines(draw, table, ids, left, top, scale, size, heads=False):
+    if not len(ids):
+        return
+    px0, py0 = (table.x0[ids] - left) * scale, (top - table.y0[ids]) * scale
+    px1, py1 = (table.x1[ids] - left) * scale, (top - table.y1[ids]) * scale
+    cx0, cy0, cx1, cy1, t0, keep = _clip(px0, py0, px1, py1, -PAD_PX, size + PAD_PX)
+    # Where the visible part starts along the whole line, to keep dashes in step across tiles
+    offset = t0 * np.hypot(px1 - px0, py1 - py0)
+    for i, x0, y0, x1, y1, start, hx, hy, tx, ty in zip(
+            *(column[keep].tolist() for column in (ids, cx0, cy0, cx1, cy1, offset, px1, py1, px0, py0))):
+        color, width, dash = table.color[i], int(table.width[i]), table.dash[i]
+        if dash in DASHES:
+            _dashed(draw, x0, y0, x1, y1, start, color, width, dash)
+        else:
+            draw.line([(x0, y0), (x1, y1)], fill=color, width=width)
+        if heads:
+            angle = math.atan2(hy - ty, hx - tx)
+            draw.polygon([
+                (hx, hy),
+                (hx - ARROW_HEAD_PX * math.cos(angle - 0.4), hy - ARROW_HEAD_PX * math.sin(angle - 0.4)),
+                (hx - ARROW_HEAD_PX * math.cos(angle + 0.4), hy - ARROW_HEAD_PX * math.sin(angle + 0.4)),
+            ], fill=color)
+
+
+def _draw_rects(draw, table, ids, left, top, scale, size):
+    if not len(ids):
+        return
+    low, high = -PAD_PX, size + PAD_PX
+    x0 = np.clip((table.x0[ids] - left) * scale, low, high)
+    x1 = np.clip((table.x1[ids] - left) * scale, low, high)
+    # y grows downwards in the image
+    y0 = np.clip((top - table.y1[ids]) * scale, low, high)
+    y1 = np.clip((top - table.y0[ids]) * scale, low, high)
+    # The figure's 2 px black outline, thinner (or none) once a chip is only a few pixels tall
+    chip_px = (table.y1[ids] - table.y0[ids]) * scale
+    outline = np.where(chip_px >= 8, 2, np.where(chip_px >= 3, 1, 0))
+    for i, a, b, c, d, width in zip(ids.tolist(), x0.tolist(), y0.tolist(), x1.tolist(), y1.tolist(), outline.tolist()):
+        draw.rectangle([a, b, c, d], fill=table.fill[i], outline=(0, 0, 0) if width else None, width=width)
+
+
+def _draw_labels(draw, table, ids, left, top, scale, min_px):
+    if not len(ids):
+        return
+    font_px = (table.size[ids] * scale).round()
+    shown = font_px >= min_px
+    xs, ys = (table.x[ids] - left) * scale, (top - table.y[ids]) * scale
+    for i, x, y, px in zip(*(column[shown].tolist() for column in (ids, xs, ys, font_px))):
+        draw.text((x, y), table.text[i], fill=table.color[i], font=_font(int(px)), anchor="mm")
+
+
+def render_tile(scene, z, x, y, config=None):
+    """
+    PNG of tile ``z/x/y`` and the number of primitives drawn on it, or
+    None when the tile is outside the pyramid.
+    """
+    from PIL import Image, ImageDraw
+
+    config = config or get_tiles_config()
+    if not 0 <= z <= scene.max_zoom(config):
+        return None
+    box = scene.tile_box(z, x, y)
+    if box is None:
+        return None
+    size = config['TILE_SIZE']
+    left, bottom, right, top = box
+    scale = size / (right - left)
+    pad = PAD_PX / scale
+
+    with stage("query"):
+        hits = scene.query(left - pad, bottom - pad, right + pad, top + pad)
+    with stage("draw"):
+        image = Image.new("RGB", (size, size), "white")
+        draw = ImageDraw.Draw(image)
+        tables = dict(scene.layers)
+        for name, ids in hits.items():
+            if name == 'chips':
+                _draw_rects(draw, tables[name], ids, left, top, scale, size)
+            elif name == 'labels':
+                _draw_labels(draw, tables[name], ids, left, top, scale, config['MIN_LABEL_PX'])
+            else:
+                _draw_lines(draw, tables[name], ids, left, top, scale, size, heads=name == 'arrows')
+    with stage("encode"):
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG", compress_level=config['PNG_COMPRESS_LEVEL'])
+    return buffer.getvalue(), sum(len(ids) for ids in hits.values())
+
+
+class SceneStore:
+    """
+    Scenes by id on a cache backend (pickled; shared by every process when
+    on disk), with the last few used kept unpickled in this process, since
+    every tile request needs its scene.
+    """
+
+    def __init__(self, backend=None, live=4):
+        self.objects = ObjectCache(backend)
+        self.max_live = live
+        self._live = OrderedDict()
+        self.live_hits = 0
+        self._lock = threading.Lock()
+
+    def _remember(self, scene_id, scene):
+        with self._lock:
+            self._live[scene_id] = scene
+            self._live.move_to_end(scene_id)
+            while len(self._live) > self.max_live:
+                self._live.popitem(last=False)
+
+    def get(self, scene_id):
+        with self._lock:
+            scene = self._live.get(scene_id)
+            if scene is not None:
+                self._live.move_to_end(scene_id)
+                self.live_hits += 1
+                return scene
+        scene = self.objects.get(scene_id)
+        if scene is not None:
+            self._remember(scene_id, scene)
+        return scene
+
+    def set(self, scene_id, scene):
+        self.objects.set(scene_id, scene)
+        self._remember(scene_id, scene)
+
+    def stats(self):
+        return {**self.objects.stats(), 'live': len(self._live), 'live_hits': self.live_hits}
+
+
+def open_scene(data, fmt):
+    """``(scene_id, scene, created)`` for an upload, drawing its scene unless one is stored already."""
+    store = get_scene_store()
+    scene_id = scene_key(data, fmt)
+    scene = store.get(scene_id)
+    if scene is not None:
+        return scene_id, scene, False
+    generator = DynamicCircuitDiagram()
+    # The parsed model is cached by content as well, shared with the other renders of this netlist
+    netlist = generator.parse(data, fmt=fmt)
+    with stage("scene"):
+        scene = build_scene(netlist, generator)
+    store.set(scene_id, scene)
+    return scene_id, scene, True
+
+
+_scene_store = None
+_tile_cache = None
+_lock = threading.Lock()
+
+
+def get_scene_store():
+    """Process-wide scene store, configured from ``settings.DIAGRAM_TILES['SCENES']``."""
+    global _scene_store
+    if _scene_store is None:
+        with _lock:
+            if _scene_store is None:
+                config = get_tiles_config()
+                _scene_store = SceneStore(build_backend(config['SCENES']), live=config['LIVE_SCENES'])
+    return _scene_store
+
+
+def get_tile_cache():
+    """Process-wide cache of rendered tiles, configured from ``settings.DIAGRAM_TILES['CACHE']``."""
+    global _tile_cache
+    if _tile_cache is None:
+        with _lock:
+            if _tile_cache is None:
+                _tile_cache = RenderCache(build_backend(get_tiles_config()['CACHE']))
+    return _tile_cache
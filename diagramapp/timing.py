@@ -0,0 +1,304 @@
+"""
+Per-stage request timing.
+
+Code marks its stages with ``with stage("read"):``. While a request is
+being served (``timing_middleware``), every stage adds its wall time to
+the request's timings; outside a request ``stage`` does nothing but read
+one context variable. When the response is ready the middleware
+
+- adds a ``Server-Timing`` header (``read;dur=12.1, draw;dur=40.3, total;dur=60.2``),
+- logs one JSON line on the ``diagramapp.timing`` logger,
+- and adds each stage to per-route histograms (:func:`timing_stats`).
+
+Only the header is built on the request path; the log line and the
+histograms are handed to a background thread through a queue, so the
+cost a request sees is a few microseconds.
+
+A stage entered several times in one request (one per sheet, one per
+chunk ...) is reported once with its summed time and a count. Stages that
+run in other processes (render pool, jobs, Kaleido) are timed from the
+request process as the stage that waits for them.
+"""
+import contextvars
+import logging
+import os
+import queue
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.decorators import sync_and_async_middleware
+
+try:
+    import orjson
+
+    def _dumps(value):
+        return orjson.dumps(value).decode("utf-8")
+except ImportError:  # optional: stdlib json
+    import json
+
+    def _dumps(value):
+        return json.dumps(value, separators=(",", ":"))
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMING_CONFIG = {
+    'ENABLED': True,
+    'HEADER': True,        # Server-Timing on every response
+    'LOG': True,           # one JSON line per request on the diagramapp.timing logger
+    'FLUSH_SECONDS': 1.0,  # how often the background thread logs and records queued requests
+    # Histogram bucket upper bounds in milliseconds (a last +Inf bucket is implied)
+    'BUCKETS_MS': (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000),
+}
+
+# {stage: [seconds, count]} of the request being served, or None outside a request
+_request_timings = contextvars.ContextVar('diagram_timings', default=None)
+
+
+def get_timing_config():
+    return {**DEFAULT_TIMING_CONFIG, **getattr(settings, 'DIAGRAM_TIMING', {})}
+
+
+class _Stage:
+    __slots__ = ('name', 'timings', 'started')
+
+    def __init__(self, name, timings):
+        self.name = name
+        self.timings = timings
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        entry = self.timings.get(self.name)
+        if entry is None:
+            self.timings[self.name] = [elapsed, 1]
+        else:
+            entry[0] += elapsed
+            entry[1] += 1
+        return False
+
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_no_stage = _NoStage()
+
+
+def stage(name):
+    """Context manager timing ``name`` against the current request (a no-op outside one)."""
+    timings = _request_timings.get()
+    if timings is None:
+        return _no_stage
+    return _Stage(name, timings)
+
+
+def timed(name):
+    """Decorator form of :func:`stage`."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def collect():
+    """Time the stages of the code run inside, outside a request: yields ``{stage: [seconds, count]}``."""
+    timings = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+class Histogram:
+    """Cumulative-bucket histogram of durations in milliseconds."""
+    __slots__ = ('bounds', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, ms):
+        self.counts[bisect_left(self.bounds, ms)] += 1
+        self.count += 1
+        self.sum += ms
+        if ms > self.max:
+            self.max = ms
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding quantile ``q`` (the max for the last bucket)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.bounds, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum_ms': round(self.sum, 3),
+            'avg_ms': round(self.sum / self.count, 3) if self.count else None,
+            'max_ms': round(self.max, 3),
+            'p50_ms': self.quantile(0.5),
+            'p90_ms': self.quantile(0.9),
+            'p99_ms': self.quantile(0.99),
+            'buckets': {**{str(b): n for b, n in zip(self.bounds, self.counts)}, '+Inf': self.counts[-1]},
+        }
+
+
+_histograms = {}   # (route, stage) -> Histogram
+_histograms_lock = threading.Lock()
+
+
+def record(route, timings, total, config=None):
+    """Add one request's stage timings (seconds) and total to the histograms."""
+    config = config or get_timing_config()
+    with _histograms_lock:
+        for name, seconds in [*((n, t[0]) for n, t in timings.items()), ('total', total)]:
+            histogram = _histograms.get((route, name))
+            if histogram is None:
+                histogram = _histograms[(route, name)] = Histogram(config['BUCKETS_MS'])
+            histogram.observe(seconds * 1000)
+
+
+def timing_stats():
+    """``{route: {stage: histogram snapshot}}`` for this server process."""
+    _record_pending()
+    with _histograms_lock:
+        items = [(route, name, h.snapshot()) for (route, name), h in _histograms.items()]
+    stats = {}
+    for route, name, snapshot in sorted(items, key=lambda item: item[:2]):
+        stats.setdefault(route, {})[name] = snapshot
+    return stats
+
+
+def server_timing(timings, total):
+    parts = [f"{name};dur={t[0] * 1000:.1f}" if t[1] == 1 else f'{name};dur={t[0] * 1000:.1f};desc="x{t[1]}"'
+             for name, t in timings.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def _route(request):
+    match = getattr(request, "resolver_match", None)
+    return "/" + match.route if match is not None else "unresolved"
+
+
+_pending = queue.SimpleQueue()   # (method, route, status, cache, timings, total, config)
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def _log_line(method, route, status, cache, timings, total):
+    return _dumps({
+        'method': method,
+        'route': route,
+        'status': status,
+        'cache': cache,
+        'total_ms': round(total * 1000, 2),
+        'stages': {name: round(t[0] * 1000, 2) for name, t in timings.items()},
+    })
+
+
+def _record_pending():
+    """Log and record every queued request."""
+    while True:
+        try:
+            method, route, status, cache, timings, total, config = _pending.get_nowait()
+        except queue.Empty:
+            return
+        try:
+            record(route, timings, total, config)
+            if config['LOG'] and logger.isEnabledFor(logging.INFO):
+                logger.info(_log_line(method, route, status, cache, timings, total))
+        except Exception:
+            logger.exception("Failed to record request timings")
+
+
+def _recorder_loop(interval):
+    # Draining in batches rather than waking per request keeps the thread
+    # from contending for the GIL with the requests it is timing.
+    while True:
+        time.sleep(interval)
+        _record_pending()
+
+
+def _start_recorder(config):
+    global _recorder
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = threading.Thread(target=_recorder_loop, args=(config['FLUSH_SECONDS'],),
+                                         name="diagram-timing", daemon=True)
+            _recorder.start()
+
+
+def _after_fork():
+    # A forked worker has the queue but not the thread (preloading servers)
+    global _recorder, _recorder_lock
+    _recorder, _recorder_lock = None, threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def _start():
+    timings = {}
+    return timings, _request_timings.set(timings), time.perf_counter()
+
+
+def _finish(request, response, timings, token, started, config):
+    total = time.perf_counter() - started
+    _request_timings.reset(token)
+    if config['HEADER']:
+        response['Server-Timing'] = server_timing(timings, total)
+    if _recorder is None:
+        _start_recorder(config)
+    _pending.put((request.method, _route(request), response.status_code, response.get('X-Render-Cache'),
+                  timings, total, config))
+    return response
+
+
+@sync_and_async_middleware
+def timing_middleware(get_response):
+    """Collect :func:`stage` timings per request (Server-Timing header, log line, histograms)."""
+    config = get_timing_config()
+    if not config['ENABLED']:
+        raise MiddlewareNotUsed()
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            timings, token, started = _start()
+            return _finish(request, await get_response(request), timings, token, started, config)
+    else:
+        def middleware(request):
+            timings, token, started = _start()
+            return _finish(request, get_response(request), timings, token, started, config)
+    return middleware
@@ -1,445 +1,447 @@
-import tempfile
-import os
-from django.http import FileResponse
+import base64
+from collections.abc import Mapping
+from functools import partial
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.module_loading import import_string
 from rest_framework.views import APIView
-from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
 from rest_framework.response import Response
-from rest_framework import status
-from .serializer import CircuitFileUploadSerializer
-from .circuit_generator import DynamicCircuitDiagram
+from rest_framework import serializers, status
+from .render_cache import get_render_cache
+from .export_pool import get_export_pool
+from .ingest import IngestError, Workbook, netlist_payload
+from .disk_io import disk_write_stats
+from .compression import compression_stats
+from .timing import timing_stats
+from .metrics import annotate, exposition
+from .mermaid_pool import get_mermaid_pool
+from .jobs import DONE, FAILED, FINISHED, get_job_manager, get_job_store, job_links
+from .netlist import get_model_cache
+from .serializer import validate_upload
+from .batch import (ARCHIVES, FileBatch, MultipartArchive, SheetBatch, ZipArchive, get_batch_config,
+                    zip_members)
+
+
+try:
+    import orjson
+
+    def dumps(value):
+        return orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY)
+except ImportError:  # optional: stdlib json
+    import json
+
+    def dumps(value):
+        return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+
+def output_format(request, formats):
+    """
+    The ``format`` field of the request body (DRF keeps ``?format=`` for its
+    own renderers), defaulting to the first of ``formats``.
+    """
+    fields = request.data if hasattr(request.data, "get") else {}
+    out_format = str(fields.get("format") or formats[0]).lower()
+    if out_format not in formats:
+        raise ValueError(f"format must be one of {list(formats)}")
+    return out_format
+
+
+def flag(value, name):
+    """A yes/no request field, spelled as DRF's BooleanField accepts it ('true', '1', 'on', ...)."""
+    if isinstance(value, str):
+        value = value.strip().lower()
+    if value in serializers.BooleanField.TRUE_VALUES:
+        return True
+    if value in serializers.BooleanField.FALSE_VALUES:
+        return False
+    raise ValueError(f"{name} must be true or false")
+
+
+# Outputs of the Bokeh views: a standalone page, or the plot as a json_item
+# document for ``Bokeh.embed.embed_item`` (no inline BokehJS page around it)
+BOKEH_FORMATS = ("html", "json")
 
+MERMAID_THEME = "default"
+MERMAID_FORMATS = ["png", "jpg", "svg", "mmd", "json"]
+MERMAID_FORMAT_ERROR = "Invalid format, choose 'png', 'jpg', 'svg', 'mmd' or 'json'"
 
-class GenerateCircuitDiagramView(APIView):
-    parser_classes = [MultiPartParser, FormParser]
 
-    def post(self, request):
-        serializer = CircuitFileUploadSerializer(data=request.data)
-        if not serializer.is_valid():
-            return Response({
-                'error': 'Invalid file',
-                'details': serializer.errors
-            }, status=status.HTTP_400_BAD_REQUEST)
+class ViewRegistry(Mapping):
+    """
+    Endpoint name -> view class, from dotted paths. A view's module (and the
+    plotting libraries it imports) is loaded on its first lookup, so
+    membership tests and listing the endpoints import nothing.
+    """
 
-        uploaded_file = serializer.validated_data['file']
+    def __init__(self, paths):
+        self.paths = dict(paths)
 
-        try:
-            # Save uploaded Excel temporarily
-            with tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False) as tmp_file:
-                for chunk in uploaded_file.chunks():
-                    tmp_file.write(chunk)
-                tmp_file.flush()
-                excel_path = tmp_file.name
-
-            # Generate figure
-            generator = DynamicCircuitDiagram()
-            fig = generator.generate_diagram(excel_path)
-
-            os.unlink(excel_path)  # cleanup Excel immediately (safe)
-
-            if fig is None:
-                return Response({
-                    'error': 'Failed to generate diagram',
-                    'message': 'Please check your Excel file format'
-                }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-            # Save figure as PNG (don’t auto-delete yet)
-            tmp_img = tempfile.NamedTemporaryFile(suffix=".png", delete=False)
-            fig.write_image(tmp_img.name, format="png", width=1000, height=800)
-            tmp_img.close()  # release lock on Windows
-
-            # Open file again for response
-            response = FileResponse(open(tmp_img.name, "rb"), content_type="image/png")
-            response["Content-Disposition"] = 'attachment; filename="circuit_diagram.png"'
-
-            # Instead of deleting immediately, schedule deletion after response
-            def cleanup(file_path):
-                try:
-                    os.remove(file_path)
-                except Exception:
-                    pass
-
-            import threading
-            threading.Timer(5.0, cleanup, args=[tmp_img.name]).start()
-
-            return response
+    def __getitem__(self, endpoint):
+        return import_string(self.paths[endpoint])
 
-        except Exception as e:
-            return Response({
-                'error': 'Processing failed',
-                'message': str(e)
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    def __contains__(self, endpoint):
+        return endpoint in self.paths
 
+    def __iter__(self):
+        return iter(self.paths)
 
+    def __len__(self):
+        return len(self.paths)
 
-import pandas as pd
-from django.http import HttpResponse
-from rest_framework.views import APIView
-from rest_framework.parsers import MultiPartParser, FormParser
-from bokeh.plotting import figure
-from bokeh.embed import file_html
-from bokeh.resources import CDN
-from bokeh.models import Arrow, NormalHead
 
-class CircuitDiagramAPIView(APIView):
-    parser_classes = (MultiPartParser, FormParser)
+class RenderCacheStatsView(APIView):
+    """Hit/miss counters and current size of the shared render cache and the parsed-model cache."""
 
-    def post(self, request, *args, **kwargs):
-        excel_file = request.FILES.get("file")
-        if not excel_file:
-            return HttpResponse("Please upload an Excel file.", status=400)
-
-        # Read Excel into DataFrame
-        df = pd.read_excel(excel_file)
-
-        # Separate Masters and Slaves
-        masters = df[df["Device_Type"] == "Master"]["From_Device"].unique().tolist()
-        slaves = df[df["Device_Type"] == "Slave"]["From_Device"].unique().tolist()
-
-        # Create Bokeh figure
-        p = figure(title="Circuit Diagram", 
-                   x_range=(0, 1000), 
-                   y_range=(0, 800),
-                   width=1000, height=800)
-
-        device_positions = {}
-
-        # Place Masters on the left
-        for i, m in enumerate(masters):
-            x, y = 200, 700 - i * 200
-            device_positions[m] = (x, y)
-            p.rect(x, y, width=80, height=50, fill_color="lightblue")
-            p.text(x, y, text=[m], text_align="center", text_baseline="middle")
-
-        # Place Slaves on the right
-        for j, s in enumerate(slaves):
-            x, y = 800, 700 - j * 200
-            device_positions[s] = (x, y)
-            p.rect(x, y, width=80, height=50, fill_color="lightgreen")
-            p.text(x, y, text=[s], text_align="center", text_baseline="middle")
-
-        # Draw connections (buses with arrows)
-        for _, row in df.iterrows():
-            from_dev, to_dev = row["From_Device"], row["To_Device"]
-            bus_label = row.get("Bus_Label", "")
-
-            if from_dev in device_positions and to_dev in device_positions:
-                x0, y0 = device_positions[from_dev]
-                x1, y1 = device_positions[to_dev]
-
-                # Add arrow from master to slave
-                arrow = Arrow(end=NormalHead(size=10, fill_color="black"),
-                              x_start=x0 + 40, y_start=y0,
-                              x_end=x1 - 40, y_end=y1,
-                              line_width=2)
-                p.add_layout(arrow)
-
-                # Add bus label in middle
-                if bus_label:
-                    mid_x, mid_y = (x0 + x1) / 2, (y0 + y1) / 2
-                    p.text(mid_x, mid_y, text=[bus_label], text_align="center")
-
-        # Export as HTML
-        html = file_html(p, CDN, "Circuit Diagram")
-        return HttpResponse(html)
-
-
-import pandas as pd
-import networkx as nx
-from bokeh.plotting import figure
-from bokeh.models import Arrow, NormalHead
-from bokeh.embed import file_html
-from bokeh.resources import CDN
-from rest_framework.views import APIView
-from rest_framework.parsers import MultiPartParser, FormParser
-from django.http import HttpResponse
+    def get(self, request, *args, **kwargs):
+        return Response({**get_render_cache().stats(), 'models': get_model_cache().stats()})
 
 
-class CircuitAPIView(APIView):
-    parser_classes = (MultiPartParser, FormParser)
+class CompressionStatsView(APIView):
+    """Bytes in and out of response compression and the CPU spent on it (per server process)."""
 
-    def post(self, request, *args, **kwargs):
-        excel_file = request.FILES.get("file")
-        if not excel_file:
-            return HttpResponse("Please upload an Excel file.", status=400)
-
-        # Load Excel (now without Parent column)
-        df = pd.read_excel(excel_file)
-
-        # Define layer order
-        layer_map = {
-            "Manager": 0,
-            "Initiator": 1,
-            "Switch": 2,
-            "Target": 3,
-            "Subordinate": 4,
-        }
-
-        # Build graph
-        G = nx.DiGraph()
-
-        # Step 1: Add all nodes (no parent anymore)
-        for _, row in df.iterrows():
-            node = row["Node"]
-            G.add_node(node, type=row["Type"])
-
-        # Step 2: Add edges
-        for _, row in df.iterrows():
-            if pd.notna(row["Connects_To"]):
-                target = row["Connects_To"]
-                if target not in G.nodes:
-                    G.add_node(target, type="Unknown")
-                G.add_edge(row["Node"], target)
-
-        # Assign layers
-        for node in G.nodes:
-            node_type = G.nodes[node].get("type", "Unknown")
-            layer = layer_map.get(node_type, len(layer_map))
-            G.nodes[node]["layer"] = layer
-
-        # Initial multipartite layout
-        pos = nx.multipartite_layout(G, subset_key="layer", align="horizontal")
-
-        # Enforce horizontal ordering + spacing
-        def reorder_nodes(node_type, spacing=3.0, vertical_gap=3.0):
-            nodes = [n for n in G.nodes if node_type in G.nodes[n].get("type", "")]
-            nodes_sorted = sorted(nodes, key=lambda x: int("".join(filter(str.isdigit, x)) or 0))
-            if nodes_sorted:
-                layer = layer_map.get(node_type, 0)
-                y_level = layer * vertical_gap
-                for i, node in enumerate(nodes_sorted):
-                    pos[node] = (i * spacing, y_level)
-
-        reorder_nodes("Manager")
-        reorder_nodes("Initiator")
-        reorder_nodes("Switch")
-        reorder_nodes("Target")
-        reorder_nodes("Subordinate")
-
-        # --- Box size for all nodes ---
-        box_width = 1.8
-        box_height = 0.9
-
-        # --- Compute dynamic bounds ---
-        xs, ys = zip(*pos.values())
-        x_min, x_max = min(xs), max(xs)
-        y_min, y_max = min(ys), max(ys)
-
-        margin_x = box_width * 2
-        margin_y = box_height * 2
-
-        x_range = (x_min - margin_x, x_max + margin_x)
-        y_range = (y_min - margin_y, y_max + margin_y)
-
-        # --- Fixed plot size, but dynamic ranges ---
-        p = figure(
-            title="Circuit Diagram",
-            x_range=x_range,
-            y_range=y_range,
-            width=1200,   # fixed frame width
-            height=700,   # fixed frame height
-            match_aspect=True,
-            tools=""  # no pan/zoom/reset
-        )
-
-        # Clean background (white, no axes/grid)
-        p.xaxis.visible = False
-        p.yaxis.visible = False
-        p.xgrid.visible = False
-        p.ygrid.visible = False
-        p.outline_line_color = None
-
-        # Color mapping
-        color_map = {
-            "Manager": "lightblue",
-            "Initiator": "orange",
-            "Switch": "lightgreen",
-            "Target": "pink",
-            "Subordinate": "violet",
-        }
-
-        # Draw nodes
-        for node, (x, y) in pos.items():
-            node_type = G.nodes[node].get("type", "Unknown")
-            color = color_map.get(node_type, "gray")
-            p.rect(x, y, width=box_width, height=box_height,
-                   fill_color=color, line_color="black", line_width=2)
-            p.text(x, y, text=[node],
-                   text_align="center", text_baseline="middle", text_font_size="14pt")
-
-        # Draw arrows (edge clipping at box borders)
-        for src, dst in G.edges():
-            x0, y0 = pos[src]
-            x1, y1 = pos[dst]
-
-            dx = x1 - x0
-            dy = y1 - y0
-            dist = (dx**2 + dy**2) ** 0.5
-            if dist == 0:
-                continue
-
-            ux, uy = dx / dist, dy / dist
-
-            x0_adj = x0 + ux * (box_width / 2 if abs(dx) > abs(dy) else box_height / 2)
-            y0_adj = y0 + uy * (box_height / 2 if abs(dy) >= abs(dx) else box_width / 2)
-
-            x1_adj = x1 - ux * (box_width / 2 if abs(dx) > abs(dy) else box_height / 2)
-            y1_adj = y1 - uy * (box_height / 2 if abs(dy) >= abs(dx) else box_width / 2)
-
-            p.add_layout(Arrow(end=NormalHead(size=12),
-                               x_start=x0_adj, y_start=y0_adj,
-                               x_end=x1_adj, y_end=y1_adj,
-                               line_width=2))
-
-        # Export
-        html = file_html(p, CDN, "Circuit Diagram")
-        return HttpResponse(html)
-
-import os
-import shutil
-import tempfile
-import subprocess
-import pandas as pd
-from django.http import HttpResponse
-from rest_framework.views import APIView
-from rest_framework.parsers import MultiPartParser, FormParser
-from rest_framework.response import Response
-from rest_framework import status
-import re
+    def get(self, request, *args, **kwargs):
+        return Response(compression_stats())
 
-MERMAID_THEME = "default"
 
-class MermaidCircuitAPIView(APIView):
-    parser_classes = (MultiPartParser, FormParser)
+class TimingStatsView(APIView):
+    """Per-route, per-stage latency histograms (per server process)."""
+
+    def get(self, request, *args, **kwargs):
+        return Response(timing_stats())
+
+
+class MetricsView(APIView):
+    """Prometheus metrics of every server process (see metrics.py)."""
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(exposition(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+class DiskWriteStatsView(APIView):
+    """Bytes written to disk while serving requests (per server process)."""
+
+    def get(self, request, *args, **kwargs):
+        return Response(disk_write_stats())
+
+
+class ExportPoolStatsView(APIView):
+    """Health and throughput of the Kaleido export pool."""
+
+    def get(self, request, *args, **kwargs):
+        pool = get_export_pool()
+        if pool is None:
+            return Response({'status': 'disabled'})
+        stats = pool.stats()
+        code = status.HTTP_200_OK if stats['status'] == 'ok' else status.HTTP_503_SERVICE_UNAVAILABLE
+        return Response(stats, status=code)
+
+
+class MermaidPoolStatsView(APIView):
+    """Health and throughput of the warm Mermaid renderers."""
+
+    def get(self, request, *args, **kwargs):
+        pool = get_mermaid_pool()
+        if pool is None:
+            return Response({'status': 'disabled'})
+        stats = pool.stats()
+        code = status.HTTP_200_OK if stats['status'] == 'ok' else status.HTTP_503_SERVICE_UNAVAILABLE
+        return Response(stats, status=code)
+
+
+# Views whose ``render(data, fmt, **params)`` can run outside a request (see jobs.py)
+RENDER_VIEWS = ViewRegistry({
+    'diagram': 'diagramapp.figure_views.GenerateCircuitDiagramView',
+    'generate-diagram': 'diagramapp.bokeh_views.CircuitDiagramAPIView',
+    'generate': 'diagramapp.bokeh_views.CircuitAPIView',
+    'circuit': 'diagramapp.mermaid_views.MermaidCircuitAPIView',
+})
+
+
+def render_params(request, endpoint):
+    """Render parameters of ``endpoint`` from the request body; ValueError when one is invalid."""
+    fields = request.data if hasattr(request.data, "get") else {}
+    params = {}
+    if endpoint == 'diagram':
+        from .circuit_generator import TRACE_MODES
+
+        params['trace_mode'] = fields.get("trace_mode", "segments")
+        if params['trace_mode'] not in TRACE_MODES:
+            raise ValueError(f"trace_mode must be one of {list(TRACE_MODES)}")
+        params['figure_bytes'] = flag(fields.get("figure_bytes", False), "figure_bytes")
+    try:
+        params['out_format'] = output_format(request, RENDER_VIEWS[endpoint].formats)
+    except ValueError:
+        if endpoint == 'circuit':
+            raise ValueError(MERMAID_FORMAT_ERROR)
+        raise
+    annotate(format=params['out_format'])
+    return params
+
+
+class JobListView(APIView):
+    """Queue a render on the background job workers."""
+    parser_classes = (MultiPartParser, FormParser, JSONParser)
 
     def post(self, request, *args, **kwargs):
-        file_obj = request.FILES.get("file")
-        out_format = request.data.get("format", "png").lower()
+        endpoint = request.data.get("endpoint") if hasattr(request.data, "get") else None
+        if endpoint not in RENDER_VIEWS:
+            return Response({"error": f"endpoint must be one of {sorted(RENDER_VIEWS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
 
-        if not file_obj:
+        if endpoint == 'diagram':
+            # The checks of /api/diagram itself (file type, 10 MB limit)
+            serializer = validate_upload(request.data)
+            if serializer.errors:
+                return Response({"error": "Invalid file", "details": serializer.errors},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+        data, fmt = netlist_payload(request)
+        if data is None:
             return Response({"error": "No file uploaded"}, status=status.HTTP_400_BAD_REQUEST)
 
-        if out_format not in ["png", "jpg"]:
-            return Response({"error": "Invalid format, choose 'png' or 'jpg'"},
+        try:
+            params = render_params(request, endpoint)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        cache_key = RENDER_VIEWS[endpoint]().cache_key(data, fmt, **params)
+        job = get_job_manager().submit(endpoint, data, fmt, params, cache_key=cache_key)
+        links = job_links(request, job)
+        response = Response(links, status=status.HTTP_202_ACCEPTED)
+        response['Location'] = links['status_url']
+        return response
+
+
+class JobDetailView(APIView):
+    """Status of a queued job; DELETE cancels it."""
+
+    def get(self, request, job_id, *args, **kwargs):
+        job = get_job_store().get(job_id)
+        if job is None:
+            return Response({"error": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response({
+            **job_links(request, job),
+            'endpoint': job['endpoint'],
+            'created': job['created'],
+            'started': job['started'],
+            'finished': job['finished'],
+            'error': job['error'],
+            'cancel_requested': job['cancel_requested'],
+        })
+
+    def delete(self, request, job_id, *args, **kwargs):
+        store = get_job_store()
+        job = store.get(job_id)
+        if job is None:
+            return Response({"error": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+        if job['status'] not in FINISHED:
+            store.request_cancel(job_id)
+            job['cancel_requested'] = True
+        return Response(job_links(request, job), status=status.HTTP_202_ACCEPTED)
+
+
+class JobResultView(APIView):
+    """Rendered output of a finished job."""
+
+    def get(self, request, job_id, *args, **kwargs):
+        store = get_job_store()
+        job = store.get(job_id)
+        if job is None:
+            return Response({"error": "Job not found or expired"}, status=status.HTTP_404_NOT_FOUND)
+        if job['status'] == FAILED:
+            return Response({"error": "Job failed", "message": job['error']},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        if job['status'] != DONE:
+            return Response(job_links(request, job), status=status.HTTP_409_CONFLICT)
+
+        response = HttpResponse(store.read_result(job_id), content_type=job['content_type'])
+        for name, value in job['headers'].items():
+            response[name] = value
+        return response
+
+
+class DiagramRevisionView(APIView):
+    """
+    Render a netlist as a revision of an earlier one. ``base`` names the
+    diagram id returned by a previous call (omit it for the first revision);
+    only the rows that changed are drawn again. Responds with the new id,
+    the diff against the base and the image, base64-encoded.
+    """
+    parser_classes = (MultiPartParser, FormParser, JSONParser)
+
+    def post(self, request, *args, **kwargs):
+        # plotly and numpy are only needed once a revision is asked for
+        from .circuit_generator import TRACE_MODES
+        from .revisions import REVISERS, get_revision_store
+
+        fields = request.data if hasattr(request.data, "get") else {}
+        endpoint = fields.get("endpoint", "diagram")
+        if endpoint not in REVISERS:
+            return Response({"error": f"endpoint must be one of {sorted(REVISERS)}"},
                             status=status.HTTP_400_BAD_REQUEST)
 
+        data, fmt = netlist_payload(request)
+        if data is None:
+            return Response({"error": "No file uploaded"}, status=status.HTTP_400_BAD_REQUEST)
+
+        params = {}
+        if endpoint == 'diagram':
+            params['trace_mode'] = fields.get("trace_mode", "segments")
+            if params['trace_mode'] not in TRACE_MODES:
+                return Response({"error": f"trace_mode must be one of {list(TRACE_MODES)}"},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+        store = get_revision_store()
+        # Accept the id as returned or as the ETag of the render
+        base_id = str(fields.get("base") or "").removeprefix("W/").strip('"') or None
+        base = store.get(base_id) if base_id else None
+        if base_id and (base is None or base['endpoint'] != endpoint):
+            return Response({"error": "Unknown or expired base diagram", "base": base_id},
+                            status=status.HTTP_404_NOT_FOUND)
+
+        view = RENDER_VIEWS[endpoint]()
         try:
-            df = pd.read_excel(file_obj)
+            revision = REVISERS[endpoint](view).revise(data, fmt, base, **params)
+        except IngestError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            required_columns = {"Node", "Connects_To"}
-            if not required_columns.issubset(df.columns):
-                return Response({
-                    "error": f"Excel must contain at least these columns: {required_columns}"
-                }, status=status.HTTP_400_BAD_REQUEST)
+        diagram_id = view.cache_key(data, fmt, **params)
+        store.set(diagram_id, revision.model)
+
+        response = Response({
+            'id': diagram_id,
+            'base': base_id,
+            'endpoint': endpoint,
+            'diff': revision.diff,
+            'render_ms': round(revision.seconds * 1000, 1),
+            'content_type': revision.content_type,
+            'headers': revision.headers,
+            'image': base64.b64encode(revision.body).decode("ascii"),
+        })
+        if endpoint == 'diagram':
+            # A diagram revision is byte-identical to a full render, so the id (its
+            # render-cache key) can serve it to the plain endpoint. A 'generate'
+            # revision keeps the base's layout: its body depends on the edit
+            # history, not only on the netlist the key is derived from.
+            render_cache = get_render_cache()
+            render_cache.set(diagram_id, {'content_type': revision.content_type, 'headers': revision.headers,
+                                          'stream': True}, revision.body)
+            response['ETag'] = render_cache.etag_for(diagram_id)
+        return response
+
+
+class ArchiveRenderView(APIView):
+    """Shared options and response of the endpoints that answer with an archive of renders."""
+    parser_classes = (MultiPartParser, FormParser)
 
-            mmd_text = self._generate_mermaid(df)
+    def batch_options(self, request):
+        """``(endpoint, params, archive)`` from the request, or a 400 response."""
+        fields = request.data if hasattr(request.data, "get") else {}
+        endpoint = fields.get("endpoint", "diagram")
+        if endpoint not in RENDER_VIEWS:
+            return Response({"error": f"endpoint must be one of {sorted(RENDER_VIEWS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        archive_format = fields.get("archive", "zip")
+        if archive_format not in ARCHIVES:
+            return Response({"error": f"archive must be one of {list(ARCHIVES)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            params = render_params(request, endpoint)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return endpoint, params, ZipArchive() if archive_format == "zip" else MultipartArchive()
+
+    @staticmethod
+    def archive_response(batch, inputs):
+        archive = batch.archive
+        response = StreamingHttpResponse(batch.stream(), content_type=archive.content_type)
+        if isinstance(archive, ZipArchive):
+            response["Content-Disposition"] = 'attachment; filename="diagrams.zip"'
+        response["X-Batch-Inputs"] = str(inputs)
+        return response
+
+
+class BatchRenderView(ArchiveRenderView):
+    """
+    Render every sheet of an uploaded workbook (or the ``sheets`` listed)
+    through one endpoint's renderer, in parallel on the render process pool.
+    The response is a ZIP (or multipart/mixed with ``archive=multipart``)
+    streamed as sheets finish, closed by ``manifest.json`` with per-sheet
+    timings and errors.
+    """
 
-            image_data, content_type = self._render_mermaid(mmd_text, out_format)
-            return HttpResponse(image_data, content_type=content_type)
+    def post(self, request, *args, **kwargs):
+        options = self.batch_options(request)
+        if isinstance(options, Response):
+            return options
+        endpoint, params, archive = options
+
+        data, fmt = netlist_payload(request)
+        if data is None or fmt != 'excel':
+            return Response({"error": "Upload an .xlsx workbook as 'file'"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            workbook = Workbook(data)
+        except IngestError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        sheets = self.selected_sheets(request.data) or workbook.sheet_names
+        unknown = [name for name in sheets if name not in workbook.sheet_names]
+        limit = get_batch_config()['MAX_SHEETS']
+        if unknown or len(sheets) > limit:
+            workbook.close()
+            error = f"Unknown sheets: {unknown}" if unknown else f"At most {limit} sheets per batch"
+            return Response({"error": error, "sheets": workbook.sheet_names}, status=status.HTTP_400_BAD_REQUEST)
+
+        batch = SheetBatch(workbook, sheets, endpoint, params, archive, render_cache=get_render_cache())
+        return self.archive_response(batch, len(sheets))
+
+    @staticmethod
+    def selected_sheets(fields):
+        """Sheet names from repeated ``sheets`` fields, a JSON list or one comma-separated string."""
+        values = fields.getlist("sheets") if hasattr(fields, "getlist") else fields.get("sheets") or []
+        if isinstance(values, str):
+            values = [values]
+        if len(values) == 1:
+            values = str(values[0]).split(",")
+        return list(dict.fromkeys(name.strip() for name in map(str, values) if name.strip()))
+
+
+class BulkRenderView(ArchiveRenderView):
+    """
+    Render many netlists in one request: a ZIP of netlist files as
+    ``file``, or repeated ``files`` fields. Every input is rendered through
+    one endpoint on the render process pool, identical inputs once. The
+    response archive is streamed as renders finish; inputs that fail get
+    an ``.error.txt`` entry instead of failing the batch.
+    """
 
-        except Exception as e:
-            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    def post(self, request, *args, **kwargs):
+        options = self.batch_options(request)
+        if isinstance(options, Response):
+            return options
+        endpoint, params, archive = options
+
+        upload = request.FILES.get("file")
+        try:
+            if upload is not None:
+                if not upload.name.lower().endswith(".zip"):
+                    return Response({"error": "'file' must be a .zip of netlists; post single files as 'files'"},
+                                    status=status.HTTP_400_BAD_REQUEST)
+                files = zip_members(b"".join(upload.chunks()))
+            else:
+                files = [(f.name, f.size, partial(b"".join, f.chunks())) for f in request.FILES.getlist("files")]
+        except IngestError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        limit = get_batch_config()['MAX_FILES']
+        if not files:
+            return Response({"error": "Upload a .zip of netlists as 'file' or the netlists as 'files'"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(files) > limit:
+            return Response({"error": f"At most {limit} netlists per request"}, status=status.HTTP_400_BAD_REQUEST)
 
-    def _slug(self, label: str) -> str:
-        """Make safe IDs for Mermaid nodes."""
-        s = re.sub(r"\W+", "_", str(label).strip())
-        if not re.match(r"^[A-Za-z]", s):
-            s = "N_" + s
-        return s
-
-    def _detect_type(self, label: str) -> str:
-        """Detect node category from label."""
-        l = label.lower()
-        if "switch" in l:
-            return "switch"
-        if "initiator" in l:
-            return "initiator"
-        if "target" in l:
-            return "target"
-        if "manager" in l:
-            return "manager"
-        if "subordinate" in l:
-            return "subordinate"
-        return "other"
-
-    def _generate_mermaid(self, df: pd.DataFrame) -> str:
-        lines = ["flowchart TB"]
-
-        nodes = set()
-        edges = []
-
-        for _, row in df.iterrows():
-            a = str(row["Node"]).strip()
-            b = str(row["Connects_To"]).strip() if pd.notna(row["Connects_To"]) else ""
-
-            if a: nodes.add(a)
-            if b: nodes.add(b)
-            if a and b:
-                edges.append((a, b))
-
-        # Add nodes with proper escaping
-        for n in nodes:
-            nid = self._slug(n)
-            ntype = self._detect_type(n)
-            # Escape quotes and special characters in labels
-            safe_label = n.replace('"', '&quot;').replace("'", "&#39;")
-            lines.append(f'{nid}["{safe_label}"]:::cls_{ntype}')
-
-        # Add edges
-        for a, b in edges:
-            lines.append(f"{self._slug(a)} --> {self._slug(b)}")
-
-        # Add an empty line before styling for better readability
-        lines.append("")
-
-        # Styling with proper syntax (no quotes around color values)
-        lines += [
-            "classDef cls_switch fill:#3399ff,stroke:#000,color:#ffffff",
-            "classDef cls_initiator fill:#ffcccc,stroke:#000,color:#000000",
-            "classDef cls_target fill:#ff9966,stroke:#000,color:#000000",
-            "classDef cls_manager fill:#ffff99,stroke:#000,color:#000000",
-            "classDef cls_subordinate fill:#cc99ff,stroke:#000,color:#000000",
-            "classDef cls_other fill:#dddddd,stroke:#000,color:#000000",
-        ]
-        
-        return "\n".join(line.strip() for line in lines if line.strip())
-
-    def _render_mermaid(self, mmd_text: str, out_format: str):
-        with tempfile.TemporaryDirectory() as td:
-            in_path = os.path.join(td, "diagram.mmd")
-            out_ext = "png" if out_format == "png" else "jpg"
-            out_path = os.path.join(td, f"diagram.{out_ext}")
-
-            with open(in_path, "w", encoding="utf-8") as f:
-                f.write(mmd_text)
-
-            mmdc_path = shutil.which("mmdc") or shutil.which("mmdc.cmd")
-            if not mmdc_path:
-                raise FileNotFoundError("Mermaid CLI (mmdc) not found. Install globally: npm install -g @mermaid-js/mermaid-cli")
-
-            # Run and capture error
-            result = subprocess.run(
-                [mmdc_path, "-i", in_path, "-o", out_path, "-t", MERMAID_THEME, "-b", "transparent"],
-                capture_output=True,
-                text=True
-            )
-
-            if result.returncode != 0:
-                debug_path = os.path.join(td, "debug_diagram.mmd")
-                with open(debug_path, "w", encoding="utf-8") as dbg:
-                    dbg.write(mmd_text)
-
-                raise RuntimeError(
-                    f"Mermaid render failed with code {result.returncode}\n"
-                    f"STDOUT:\n{result.stdout}\n\nSTDERR:\n{result.stderr}\n\n"
-                    f"Mermaid input was saved at: {debug_path}\n"
-                    f"Generated Mermaid code:\n"
-                    f"---\n"
-                    f"{mmd_text}\n"
-                    f"---"
-                )
-
-            with open(out_path, "rb") as f:
-                blob = f.read()
-
-            content_type = "image/png" if out_ext == "png" else "image/jpeg"
-            return blob, content_type
\ No newline at end of file
+        batch = FileBatch(files, endpoint, params, archive, render_cache=get_render_cache())
+        return self.archive_response(batch, len(files))
@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pythondiagram.settings')
 
 application = get_asgi_application()
+
+# Start the renderer pools of the endpoints served here (and preload their
+# views with DIAGRAM_PRELOAD=1) before the first request arrives
+from diagramapp.startup import warm_up  # noqa: E402
+
+warm_up()
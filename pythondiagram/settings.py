@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -53,14 +54,170 @@ REST_FRAMEWORK = {
     )
 }
 
+# Shared cache for rendered diagrams (see diagramapp/render_cache.py).
+# BACKEND is 'memory' (per process), 'disk' (shared directory) or None.
+DIAGRAM_RENDER_CACHE = {
+    'BACKEND': 'memory',
+    'LOCATION': BASE_DIR / 'render_cache',
+    'MAX_BYTES': 256 * 1024 * 1024,
+    'MAX_ENTRIES': 1024,
+}
+
+# Warm Kaleido browsers used for PNG export (see diagramapp/export_pool.py).
+DIAGRAM_EXPORT_POOL = {
+    'ENABLED': True,
+    'SIZE': 2,
+    'MAX_RENDERS': 200,
+    'QUEUE_TIMEOUT': 10.0,
+    'RENDER_TIMEOUT': 30.0,
+    'START_ON_BOOT': True,
+}
+
+# Limits enforced while streaming uploaded spreadsheets (see diagramapp/ingest.py).
+DIAGRAM_INGEST = {
+    'MAX_ROWS': 100_000,
+    'MAX_COLUMNS': 64,
+}
+
+# Background render jobs (see diagramapp/jobs.py). Synchronous endpoints hand
+# inputs with more than OFFLOAD_ROWS rows to a job and answer 202; None disables.
+DIAGRAM_JOBS = {
+    'LOCATION': BASE_DIR / 'jobs',
+    'WORKERS': 2,
+    'TIMEOUT': 300,
+    'RESULT_TTL': 3600,
+    'OFFLOAD_ROWS': 5000,
+}
+
+# Process pool the async (ASGI) endpoints and the batch renders run in (see
+# diagramapp/render_pool.py); one process per core by default.
+DIAGRAM_RENDER_POOL = {
+    'PROCESSES': os.cpu_count() or 2,
+    'MAX_IN_FLIGHT': 256,
+    'TIMEOUT': 120.0,
+}
+
+# Warm Node renderers for /api/circuit (see diagramapp/mermaid_pool.py). Needs
+# node and @mermaid-js/mermaid-cli; without them requests fall back to mmdc.
+DIAGRAM_MERMAID_POOL = {
+    'ENABLED': True,
+    'SIZE': 2,
+    'MAX_RENDERS': 500,
+    'MAX_WAITING': 32,
+    'QUEUE_TIMEOUT': 10.0,
+    'RENDER_TIMEOUT': 30.0,
+    'START_ON_BOOT': True,
+}
+
+# Built-in flowchart renderer for /api/circuit (see diagramapp/flowchart.py).
+# format=svg always uses it; with ENGINE 'auto' png/jpg use it when mmdc is absent.
+DIAGRAM_FLOWCHART = {
+    'ENGINE': 'auto',
+}
+
+# Crossing reduction for the layered /api/generate layout (see diagramapp/layered.py).
+DIAGRAM_LAYOUT = {
+    'METHOD': 'median',
+    'ITERATIONS': 8,
+}
+
+# Parsed netlist models, cached by upload content apart from the rendered output
+DIAGRAM_MODEL_CACHE = {
+    'BACKEND': 'memory',
+    'MAX_BYTES': 64 * 1024 * 1024,
+}
+
+# Parsed netlists kept for incremental re-renders (/api/revisions); 'disk'
+# shares them between server processes
+DIAGRAM_REVISIONS = {
+    'BACKEND': 'memory',
+    'MAX_ENTRIES': 256,
+}
+
+# Multi-input renders: workbook sheets (/api/batch) and ZIPs of netlists
+# (/api/bulk), see diagramapp/batch.py. Inputs render on the DIAGRAM_RENDER_POOL
+# processes, at most MAX_IN_FLIGHT queued (None: twice the pool size).
+DIAGRAM_BATCH = {
+    'MAX_SHEETS': 64,
+    'MAX_FILES': 5000,
+    'MAX_FILE_BYTES': 10 * 1024 * 1024,
+    'MAX_IN_FLIGHT': None,
+    'TIMEOUT': 300.0,
+}
+
+# Tile pyramids of large boards (/api/scenes, see diagramapp/tiles.py). Scenes
+# on 'disk' are shared by every server process; tiles are kept in an LRU cache.
+DIAGRAM_TILES = {
+    'TILE_SIZE': 256,
+    'SCENES': {'BACKEND': 'memory', 'LOCATION': BASE_DIR / 'scenes', 'MAX_ENTRIES': 32},
+    'CACHE': {'BACKEND': 'memory', 'MAX_BYTES': 64 * 1024 * 1024},
+}
+
+# Rendered bodies above MAX_MEMORY_BYTES are streamed from a temp file rather
+# than memory (see diagramapp/disk_io.py). Uploads up to the 10 MB serializer
+# limit stay in memory as well.
+DIAGRAM_SPOOL = {
+    'MAX_MEMORY_BYTES': 16 * 1024 * 1024,
+}
+FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024
+
+# Per-stage request timing (see diagramapp/timing.py): Server-Timing headers,
+# one JSON log line per request and histograms at /api/stats/timing
+DIAGRAM_TIMING = {
+    'ENABLED': True,
+    'HEADER': True,
+    'LOG': True,
+    'FLUSH_SECONDS': 1.0,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'diagramapp.timing': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+# Prometheus metrics at /metrics (see diagramapp/metrics.py). Every server
+# process writes its metrics to LOCATION, which must be shared by all the
+# workers on the host; files of exited workers are folded into dead.json
+DIAGRAM_METRICS = {
+    'ENABLED': True,
+    'LOCATION': os.environ.get('PROMETHEUS_MULTIPROC_DIR') or BASE_DIR / 'metrics',
+    'FLUSH_SECONDS': 5.0,
+}
+
+# Render endpoints this deployment serves and whether their views load at
+# startup (see diagramapp/startup.py); the others still load on first use.
+# e.g. DIAGRAM_ENDPOINTS=circuit for workers that only serve /api/circuit
+DIAGRAM_STARTUP = {
+    'ENDPOINTS': [name for name in os.environ.get('DIAGRAM_ENDPOINTS', '').split(',') if name] or None,
+    'PRELOAD': os.environ.get('DIAGRAM_PRELOAD', '') == '1',
+}
+
+# Brotli/gzip for JSON, HTML, SVG and Mermaid responses (see diagramapp/compression.py);
+# brotli needs the optional Brotli package, gzip is used without it
+DIAGRAM_COMPRESSION = {
+    'ENABLED': True,
+    'MIN_BYTES': 512,
+    'BROTLI_QUALITY': 5,
+}
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'diagramapp.timing.timing_middleware',
+    'diagramapp.compression.compression_middleware',
+    'diagramapp.metrics.metrics_middleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'diagramapp.disk_io.disk_write_middleware',
 ]
 
 ROOT_URLCONF = 'pythondiagram.urls'
@@ -0,0 +1,57 @@
+"""
+Production settings: settings.py without the debug overhead.
+
+    DJANGO_SECRET_KEY=... DJANGO_ALLOWED_HOSTS=diagrams.example.com \
+        python manage.py serve --settings pythondiagram.settings_production
+
+DEBUG is off (no SQL query log, cached templates, no debug error pages),
+DRF renders JSON only (no browsable API pages) and the served endpoints'
+views load in the server's master process (see diagramapp/server.py).
+The stores the workers must share (render cache, parsed models, revision
+bases, tile scenes and tiles) are on disk under DIAGRAM_DATA_DIR.
+"""
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .settings import *  # noqa: F401,F403
+from .settings import (BASE_DIR, DIAGRAM_MODEL_CACHE, DIAGRAM_RENDER_CACHE, DIAGRAM_REVISIONS, DIAGRAM_STARTUP,
+                       DIAGRAM_TILES, REST_FRAMEWORK)
+
+DEBUG = False
+
+try:
+    SECRET_KEY = os.environ['DJANGO_SECRET_KEY']
+except KeyError:
+    raise ImproperlyConfigured("Set DJANGO_SECRET_KEY for the production settings")
+
+ALLOWED_HOSTS = [host.strip() for host in os.environ.get('DJANGO_ALLOWED_HOSTS', 'localhost').split(',')]
+
+# Cookies (admin only) over HTTPS; TLS, HSTS and redirects are left to the proxy in front
+SESSION_COOKIE_SECURE = True
+CSRF_COOKIE_SECURE = True
+
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    'DEFAULT_RENDERER_CLASSES': ('rest_framework.renderers.JSONRenderer',),
+}
+
+DIAGRAM_STARTUP = {**DIAGRAM_STARTUP, 'PRELOAD': True}
+
+# manage.py serve (see diagramapp/server.py); workers and threads are sized from the CPUs
+DIAGRAM_SERVER = {
+    'BIND': os.environ.get('DIAGRAM_BIND', '0.0.0.0:8000'),
+    'MAX_REQUESTS': 1000,
+    'MAX_RSS_MB': int(os.environ.get('DIAGRAM_MAX_RSS_MB', 1024)),
+}
+
+# Every worker reads and writes the same stores, whichever one a request lands on
+DATA_DIR = os.environ.get('DIAGRAM_DATA_DIR') or os.path.join(BASE_DIR, 'data')
+DIAGRAM_RENDER_CACHE = {**DIAGRAM_RENDER_CACHE, 'BACKEND': 'disk', 'LOCATION': os.path.join(DATA_DIR, 'render_cache')}
+DIAGRAM_MODEL_CACHE = {**DIAGRAM_MODEL_CACHE, 'BACKEND': 'disk', 'LOCATION': os.path.join(DATA_DIR, 'models')}
+DIAGRAM_REVISIONS = {**DIAGRAM_REVISIONS, 'BACKEND': 'disk', 'LOCATION': os.path.join(DATA_DIR, 'revisions')}
+DIAGRAM_TILES = {
+    **DIAGRAM_TILES,
+    'SCENES': {**DIAGRAM_TILES['SCENES'], 'BACKEND': 'disk', 'LOCATION': os.path.join(DATA_DIR, 'scenes')},
+    'CACHE': {**DIAGRAM_TILES['CACHE'], 'BACKEND': 'disk', 'LOCATION': os.path.join(DATA_DIR, 'tiles')},
+}
@@ -16,14 +16,47 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path
-from diagramapp.views import *
+from diagramapp.startup import lazy_view
+
+# Views are imported on their first request (see diagramapp/startup.py), so a
+# process only loads the plotting libraries of the endpoints it serves
+V = 'diagramapp.views.'
+A = 'diagramapp.async_views.'
+T = 'diagramapp.tile_views.'
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     
-    path('api/diagram', GenerateCircuitDiagramView.as_view(), name='generate_diagram'),
-    path('api/generate-diagram', CircuitDiagramAPIView.as_view(), name='generate_diagram'),
-    path('api/generate', CircuitAPIView.as_view(), name='generate_diagram'),
-    path('api/circuit', MermaidCircuitAPIView.as_view(), name='generate_diagram'),
+    path('api/diagram', lazy_view('diagramapp.figure_views.GenerateCircuitDiagramView'), name='generate_diagram'),
+    path('api/generate-diagram', lazy_view('diagramapp.bokeh_views.CircuitDiagramAPIView'), name='generate_diagram'),
+    path('api/generate', lazy_view('diagramapp.bokeh_views.CircuitAPIView'), name='generate_diagram'),
+    path('api/circuit', lazy_view('diagramapp.mermaid_views.MermaidCircuitAPIView'), name='generate_diagram'),
+    path('api/stats/cache', lazy_view(V + 'RenderCacheStatsView'), name='render_cache_stats'),
+    path('api/stats/export-pool', lazy_view(V + 'ExportPoolStatsView'), name='export_pool_stats'),
+    path('api/stats/mermaid-pool', lazy_view(V + 'MermaidPoolStatsView'), name='mermaid_pool_stats'),
+    path('api/stats/disk-io', lazy_view(V + 'DiskWriteStatsView'), name='disk_io_stats'),
+    path('api/stats/compression', lazy_view(V + 'CompressionStatsView'), name='compression_stats'),
+    path('api/stats/timing', lazy_view(V + 'TimingStatsView'), name='timing_stats'),
+    path('api/stats/tiles', lazy_view(T + 'TileStatsView'), name='tile_stats'),
+    path('metrics', lazy_view(V + 'MetricsView'), name='metrics'),
+    # Async variants of the endpoints above, for ASGI deployments
+    path('api/async/diagram', lazy_view(A + 'AsyncGenerateCircuitDiagramView', asynchronous=True),
+         name='async_generate_diagram'),
+    path('api/async/generate-diagram', lazy_view(A + 'AsyncCircuitDiagramAPIView', asynchronous=True),
+         name='async_generate_diagram'),
+    path('api/async/generate', lazy_view(A + 'AsyncCircuitAPIView', asynchronous=True),
+         name='async_generate_diagram'),
+    path('api/async/circuit', lazy_view(A + 'AsyncMermaidCircuitAPIView', asynchronous=True),
+         name='async_generate_diagram'),
+    path('api/jobs', lazy_view(V + 'JobListView'), name='jobs'),
+    path('api/jobs/<str:job_id>', lazy_view(V + 'JobDetailView'), name='job_detail'),
+    path('api/jobs/<str:job_id>/result', lazy_view(V + 'JobResultView'), name='job_result'),
+    path('api/revisions', lazy_view(V + 'DiagramRevisionView'), name='diagram_revisions'),
+    path('api/batch', lazy_view(V + 'BatchRenderView'), name='batch_render'),
+    path('api/bulk', lazy_view(V + 'BulkRenderView'), name='bulk_render'),
+    # Tile pyramids of large boards (see diagramapp/tiles.py)
+    path('api/scenes', lazy_view(T + 'SceneView'), name='scenes'),
+    path('api/scenes/<str:scene_id>', lazy_view(T + 'SceneDetailView'), name='scene_detail'),
+    path('api/scenes/<str:scene_id>/tiles/<int:z>/<int:x>/<int:y>.png', lazy_view(T + 'TileView'), name='scene_tile'),
     
 ]